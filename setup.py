@@ -32,6 +32,10 @@ extensions = [
               ['tunescope/audio/audiodecoder.pyx'],
               **audiodecoder_compiler_args),
 
+    Extension('tunescope.audio.pcmdecoder',
+              ['tunescope/audio/pcmdecoder.pyx'],
+              include_dirs=[np.get_include()]),
+
     Extension('tunescope.audio.audiometadata',
               ['tunescope/audio/audiometadata.pyx'],
               **audiometadata_compiler_args),
@@ -48,6 +52,10 @@ extensions = [
               ['tunescope/audio/buffering.pyx'],
               include_dirs=[np.get_include()]),
 
+    Extension('tunescope.audio.shareddecoder',
+              ['tunescope/audio/shareddecoder.pyx'],
+              include_dirs=[np.get_include()]),
+
     Extension('tunescope.audio.looper',
               ['tunescope/audio/looper.pyx'],
               include_dirs=[np.get_include()]),
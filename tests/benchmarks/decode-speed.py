@@ -0,0 +1,71 @@
+""" Measure how fast the given audio files are decoded, as a real-time factor:
+the duration of each file divided by the time taken to decode all of it.
+Each file is decoded in its own format and converted to mono at 22050 Hz (as
+for analysis), with AudioDecoder, and with PCMDecoder if it can read the file.
+With --concurrent, as many decoders decode the file at once (as when a file is
+analyzed while it plays), and the factor is that of each decoder. """
+
+import argparse
+import os.path
+import sys
+import threading
+import time
+
+
+parser = argparse.ArgumentParser(description=globals()['__doc__'])
+parser.add_argument('files', nargs='+', metavar='FILE',
+                    help="Audio files to decode")
+parser.add_argument('--concurrent', type=int, default=1,
+                    help="Number of decoders decoding at once (default: %(default)s)")
+args = parser.parse_args()
+
+# Keep kivy from parsing our arguments
+sys.argv = sys.argv[:1]
+
+from tunescope.audio import AudioDecoder, PCMDecoder
+
+CONVERSIONS = [
+    ('native', {}),
+    ('mono 22050 Hz', {'channels': 1, 'samplerate': 22050}),
+]
+
+
+def decode(decoder_class, file_path, kwargs, results):
+    """ Decode the whole file and append its duration and the time taken to
+    `results`, or None if the decoder can't read the file """
+    start_time = time.time()
+    try:
+        decoder = decoder_class(file_path, **kwargs)
+    except (ValueError, IOError):
+        results.append(None)
+        return
+    while not decoder.is_eos():
+        decoder.read()
+    results.append((decoder.duration, time.time() - start_time))
+
+
+def real_time_factor(decoder_class, file_path, kwargs):
+    """ Return the mean real-time factor of args.concurrent decoders, or
+    None if the decoder can't read the file in the requested format """
+    results = []
+    threads = [threading.Thread(target=decode, args=(decoder_class, file_path, kwargs, results))
+               for _ in range(args.concurrent)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(results) < len(threads) or None in results:
+        return None
+    return sum(duration / seconds for duration, seconds in results) / len(results)
+
+
+print("{:>8}  {:<14} {:<13} {}".format("Factor", "Decoder", "Output", "File"))
+for file_path in args.files:
+    file_format = os.path.splitext(file_path)[1].lstrip('.').lower()
+    for decoder_class in [AudioDecoder, PCMDecoder]:
+        for output, kwargs in CONVERSIONS:
+            factor = real_time_factor(decoder_class, file_path, kwargs)
+            if factor is None:
+                continue
+            print("{:8.1f}x {:<14} {:<13} {} ({})".format(
+                factor, decoder_class.__name__, output, os.path.basename(file_path), file_format))
@@ -0,0 +1,72 @@
+""" Measure the startup time of TuneScope: the time until the first frame of
+the main window is drawn, and the time spent importing the slowest modules
+(including the modules they import). Exits with status 1 if the first frame
+takes longer than --budget seconds. """
+
+import time
+_start_time = time.time()
+
+import __builtin__
+import argparse
+import os.path
+import sys
+
+
+parser = argparse.ArgumentParser(description=globals()['__doc__'])
+parser.add_argument('--budget', type=float, default=None,
+                    help="Maximum time in seconds to the first frame")
+parser.add_argument('--top', type=int, default=20,
+                    help="Number of modules to list (default: %(default)s)")
+args = parser.parse_args()
+
+# Keep kivy from parsing our arguments
+sys.argv = sys.argv[:1]
+
+# Time the first import of each module, including the modules it imports
+_import_times = {}
+_real_import = __builtin__.__import__
+
+
+def _timed_import(name, *args, **kwargs):
+    if name in sys.modules or name in _import_times:
+        return _real_import(name, *args, **kwargs)
+    import_start_time = time.time()
+    try:
+        return _real_import(name, *args, **kwargs)
+    finally:
+        _import_times.setdefault(name, time.time() - import_start_time)
+
+__builtin__.__import__ = _timed_import
+from kivy.clock import Clock
+from kivy.core.window import Window
+from tunescope.main import TuneScopeApp, _DATA_DIR
+__builtin__.__import__ = _real_import
+imported_time = time.time()
+
+if not os.path.isdir(_DATA_DIR):
+    os.makedirs(_DATA_DIR)
+app = TuneScopeApp()
+first_frame_time = []
+
+
+def on_flip(window):
+    if not first_frame_time:
+        first_frame_time.append(time.time())
+        Clock.schedule_once(lambda dt: app.stop(), 0)
+
+Window.bind(on_flip=on_flip)
+app.run()
+
+time_to_first_frame = first_frame_time[0] - _start_time
+print("")
+print("Imports:            {:6.3f} s".format(imported_time - _start_time))
+print("Time to first frame: {:6.3f} s".format(time_to_first_frame))
+print("")
+print("Slowest imports (cumulative):")
+for name, seconds in sorted(_import_times.items(), key=lambda item: -item[1])[:args.top]:
+    print("  {:6.3f} s  {}".format(seconds, name))
+
+if args.budget is not None and time_to_first_frame > args.budget:
+    print("")
+    print("Over budget of {:.3f} s".format(args.budget))
+    sys.exit(1)
@@ -4,7 +4,10 @@ import math
 import pytest
 import numpy as np
 
-from tunescope.analysis import analyze
+from tunescope.analysis import (
+    SPECTRUM_DB_FLOOR, AnalysisJob, analyze, analyze_overview, analyze_range,
+    choose_analysis_parameters, decode_spectrum, encode_envelope, encode_spectrum,
+    estimate_pitch, measure_analysis_speed)
 from test_doubles import FakeAudioSource
 
 
@@ -22,7 +25,6 @@ def A440_sine_wave(tmpdir_factory):
     return sine
 
 
-@pytest.mark.xfail(reason="pitch analysis disabled for now")
 @pytest.mark.parametrize(
     ['window_size', 'hop_size'],
     [
@@ -73,3 +75,182 @@ def test_pitch_A440(A440_sine_wave, window_size, hop_size):
 
     # Check that total amplitude is preserved
     assert np.allclose(trimmed_spectra.sum(axis=1), 1, atol=0.1)
+
+
+@pytest.mark.parametrize('frequency', [55, 220, 1000])
+def test_estimate_pitch_sawtooth(frequency):
+    t = np.arange(4096 * 4) / SINE_WAVE_SAMPLERATE
+    sawtooth = (2 * (t * frequency % 1) - 1).astype(np.float32)
+    frames = np.array([sawtooth[i:i + 4096] for i in range(0, 4096 * 3, 1024)])
+    pitches = estimate_pitch(frames, SINE_WAVE_SAMPLERATE)
+    expected_pitch = 69 + 12 * math.log(frequency / 440, 2)
+    assert np.allclose(pitches, expected_pitch, atol=0.1)
+
+
+def test_estimate_pitch_silence():
+    frames = np.zeros((2, 2048), dtype=np.float32)
+    assert np.all(estimate_pitch(frames, SINE_WAVE_SAMPLERATE) == 0)
+
+
+def test_peak_rms():
+    samples = np.tile(np.array([0.5, -0.5, 0, 0], dtype=np.float32), 32)
+    samples[-4:] = [0.1, -1, 0, 0]
+    page = next(analyze(FakeAudioSource(1, 1000, samples), hop_size=4, page_size=32))
+    assert np.allclose(page['peak'], [0.5] * 31 + [1])
+    assert np.allclose(page['rms'][:31], math.sqrt(0.125))
+
+    envelope = encode_envelope(page['peak'], page['rms'])
+    assert envelope.dtype == np.uint8
+    assert envelope.shape == (32, 2)
+    assert np.all(envelope[0] == [128, 90])
+    assert np.all(envelope[-1] == [255, 128])
+
+
+def test_encode_decode_spectrum():
+    spectrum = np.array([[0, 10 ** (SPECTRUM_DB_FLOOR / 20) / 2, 0.001, 0.5, 1, 2]],
+                        dtype=np.float32)
+
+    assert encode_spectrum(spectrum, 'float32') is spectrum
+
+    float16_spectrum = encode_spectrum(spectrum, 'float16')
+    assert float16_spectrum.dtype == np.float16
+    assert np.allclose(decode_spectrum(float16_spectrum), spectrum, rtol=0.001)
+
+    uint8_spectrum = encode_spectrum(spectrum, 'uint8')
+    assert uint8_spectrum.dtype == np.uint8
+    assert np.all(uint8_spectrum == [[0, 0, 96, 239, 255, 255]])
+    decoded = decode_spectrum(uint8_spectrum)
+    assert decoded.dtype == np.float32
+    assert np.all(decoded[0, :2] == 0)
+    # Within half a quantization step (in dB) of the original
+    step = -SPECTRUM_DB_FLOOR / 255
+    assert np.allclose(20 * np.log10(decoded[0, 2:5]), 20 * np.log10(spectrum[0, 2:5]),
+                       atol=step / 2 + 1e-4)
+
+
+def test_analyze_uint8_spectrum(A440_sine_wave):
+    window_size = 2048
+    hop_size = 512
+
+    float_pages = list(page['spectrum'].copy() for page in analyze(
+        FakeAudioSource(1, SINE_WAVE_SAMPLERATE, A440_sine_wave),
+        window_size=window_size, hop_size=hop_size, page_size=64))
+    uint8_pages = list(page['spectrum'] for page in analyze(
+        FakeAudioSource(1, SINE_WAVE_SAMPLERATE, A440_sine_wave),
+        window_size=window_size, hop_size=hop_size, page_size=64,
+        spectrum_format='uint8'))
+
+    assert len(uint8_pages) == len(float_pages)
+    for float_page, uint8_page in zip(float_pages, uint8_pages):
+        assert uint8_page.dtype == np.uint8
+        assert np.all(uint8_page == encode_spectrum(float_page, 'uint8'))
+
+
+def analyze_with_progress(samples, progress_interval):
+    progress = []
+    for page in analyze(FakeAudioSource(1, SINE_WAVE_SAMPLERATE, samples),
+                        hop_size=512,
+                        on_progress=progress.append,
+                        progress_interval=progress_interval):
+        pass
+    return progress
+
+
+def test_progress_every_hop(A440_sine_wave):
+    hops = int(math.ceil(len(A440_sine_wave) / 512))
+    progress = analyze_with_progress(A440_sine_wave, 0)
+    assert progress == list(range(1, hops + 1)) + [hops]
+
+
+def test_progress_throttled(A440_sine_wave):
+    hops = int(math.ceil(len(A440_sine_wave) / 512))
+    progress = analyze_with_progress(A440_sine_wave, 3600)
+    assert progress == [hops]
+
+
+def test_analysis_job(A440_sine_wave):
+    job = AnalysisJob()
+    pages = list(job.run(FakeAudioSource(1, SINE_WAVE_SAMPLERATE, A440_sine_wave),
+                         hop_size=512, page_size=64))
+    assert len(pages) == int(math.ceil(len(A440_sine_wave) / 512 / 64))
+    assert not job.cancelled
+
+
+def test_analysis_job_cancel(A440_sine_wave):
+    source = FakeAudioSource(1, SINE_WAVE_SAMPLERATE, A440_sine_wave)
+    job = AnalysisJob()
+    pages = 0
+    for page in job.run(source, hop_size=512, page_size=64):
+        pages += 1
+        job.cancel()
+    assert pages == 1
+    assert job.cancelled
+    assert source.position < 1
+
+    # A cancelled job does not start again
+    assert list(job.run(source, hop_size=512, page_size=64)) == []
+
+
+def test_analyze_range():
+    samples = np.random.random(3072).astype(np.float32) * 2 - 1
+    pages = list(analyze(FakeAudioSource(1, 1024, samples),
+                         window_size=64, hop_size=16, page_size=1000))
+    source = FakeAudioSource(1, 1024, samples)
+    page = analyze_range(source, 1.0, 1.5, window_size=64, hop_size=16)
+
+    # Same as the corresponding part of the whole analysis
+    assert len(page['spectrum']) == len(page['pitch']) == 32
+    assert np.allclose(page['spectrum'], pages[0]['spectrum'][64:96])
+    assert np.allclose(page['pitch'], pages[0]['pitch'][64:96])
+
+
+def test_analysis_job_analyze_range_cancel(A440_sine_wave):
+    source = FakeAudioSource(1, SINE_WAVE_SAMPLERATE, A440_sine_wave)
+    job = AnalysisJob()
+    job.cancel()
+    assert job.analyze_range(source, 1.0, 2.0) is None
+
+
+@pytest.mark.parametrize('seek, point_count', [(True, 10), (False, 10), (False, 200)])
+def test_analyze_overview(seek, point_count):
+    samples = np.random.random(4096).astype(np.float32) * 2 - 1
+    pages = list(analyze(FakeAudioSource(1, 1024, samples),
+                         window_size=64, hop_size=16, page_size=1000))
+    source = FakeAudioSource(1, 1024, samples)
+    seek_positions = []
+    source_seek = source.seek
+    source.seek = lambda position: seek_positions.append(position) or source_seek(position)
+    points = list(analyze_overview(source, 4.0, point_count, window_size=64, hop_size=16,
+                                   seek=seek))
+
+    assert len(points) == point_count
+    if seek:
+        assert len(seek_positions) == point_count
+    elif point_count == 10:
+        # Only points closer together than a window need to seek back
+        assert seek_positions == []
+    assert points[0][0] == 0
+    assert points[-1][1] == 256
+    for (hop_start, hop_end, page), (next_start, _, _) in zip(points, points[1:]):
+        assert hop_end == next_start
+    for hop_start, hop_end, page in points:
+        hop = (hop_start + hop_end) // 2
+        assert len(page['spectrum']) == 1
+        assert np.allclose(page['spectrum'][0], pages[0]['spectrum'][hop])
+
+
+def test_choose_analysis_parameters():
+    # Fast enough for the finest default resolution
+    assert choose_analysis_parameters(60, 22050, 1e6, 10) == (2048, 512)
+    # 60 minutes at 22050 Hz is about 2.6 million samples per 1000 hops
+    assert choose_analysis_parameters(3600, 22050, 200, 10) == (2048, 2048)
+    assert choose_analysis_parameters(3600, 22050, 100, 10) == (2048, 2048)
+    assert choose_analysis_parameters(600, 22050, 2000, 10) == (2048, 1024)
+    # Limited by the number of hops that can be shown
+    assert choose_analysis_parameters(60, 22050, 1e6, 10, max_hop_count=1000) == (2048, 2048)
+    assert choose_analysis_parameters(3600, 22050, 1, 1, high_resolution=True) == (2048, 256)
+    assert choose_analysis_parameters(60, 44100, 1e6, 10) == (4096, 1024)
+
+
+def test_measure_analysis_speed():
+    assert measure_analysis_speed(22050, hop_count=64) > 0
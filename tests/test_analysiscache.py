@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from tunescope.analysiscache import AnalysisCache
+
+
+@pytest.fixture
+def cache(tmpdir_factory):
+    return AnalysisCache(str(tmpdir_factory.mktemp('analysiscache').join('cache')))
+
+
+@pytest.fixture
+def audio_file(tmpdir_factory):
+    file_path = str(tmpdir_factory.mktemp('audio').join('audio.wav'))
+    with open(file_path, 'wb') as f:
+        f.write(b'audio')
+    return file_path
+
+
+def test_save_load_envelope(cache, audio_file):
+    assert cache.load_envelope(audio_file) is None
+    envelope = np.array([[1, 2], [255, 0]], dtype=np.uint8)
+    cache.save_envelope(audio_file, envelope)
+    loaded = cache.load_envelope(audio_file)
+    assert loaded.dtype == np.uint8
+    assert np.all(loaded == envelope)
+
+
+def test_entry_invalidated_by_change(cache, audio_file):
+    cache.save_envelope(audio_file, np.zeros((2, 2), dtype=np.uint8))
+    with open(audio_file, 'ab') as f:
+        f.write(b'more audio')
+    assert cache.load_envelope(audio_file) is None
+
+
+def test_nonexistent_file(cache):
+    assert cache.entry_path('nonexistent-file', '.npy') is None
+    assert cache.load_envelope('nonexistent-file') is None
+    cache.save_envelope('nonexistent-file', np.zeros((2, 2), dtype=np.uint8))
+
+
+def test_save_load_seek_index(cache, audio_file):
+    assert cache.load_seek_index(audio_file) is None
+    seek_index = np.array([[0.0, 100], [0.026, 517]])
+    cache.save_seek_index(audio_file, seek_index)
+    assert np.all(cache.load_seek_index(audio_file) == seek_index)
+    assert cache.load_envelope(audio_file) is None
+
+
+def test_save_load_analysis(cache, audio_file):
+    assert cache.load_analysis(audio_file) is None
+    writer = cache.analysis_writer(audio_file, 3, 4, 22050)
+    writer.add_data(np.array([60, 61], dtype=np.float32), np.full((2, 4), 7, dtype=np.uint8))
+    assert cache.load_analysis(audio_file) is None
+    writer.add_data(np.array([62, 63], dtype=np.float32), np.full((2, 4), 9, dtype=np.uint8))
+    writer.commit()
+    pitch, spectrum, samplerate = cache.load_analysis(audio_file)
+    assert np.all(pitch == [60, 61, 62])
+    assert samplerate == 22050
+    assert spectrum.dtype == np.uint8
+    assert np.all(spectrum == [[7] * 4, [7] * 4, [9] * 4])
+
+
+def test_discard_analysis(cache, audio_file):
+    writer = cache.analysis_writer(audio_file, 2, 4, 22050)
+    writer.add_data(np.zeros(2, dtype=np.float32), np.zeros((2, 4), dtype=np.uint8))
+    writer.discard()
+    assert cache.load_analysis(audio_file) is None
@@ -4,7 +4,7 @@ import wave
 import pytest
 import numpy as np
 
-from tunescope.audio import AudioDecoder
+from tunescope.audio import AudioDecoder, decoder_pool
 
 # TODO: Test reading audio from video files
 
@@ -42,12 +42,58 @@ def test_basic_metadata(wav_file, wav_file_params):
     assert decoder.samplerate == wav_file_params['samplerate']
 
 
+def test_read_converted(wav_file, wav_file_params):
+    """ Test that AudioDecoder can downmix and resample the audio """
+    decoder = AudioDecoder(wav_file, channels=1, samplerate=22050)
+    assert decoder.channels == 1
+    assert decoder.samplerate == 22050
+
+    samples_read = 0
+    while not decoder.is_eos():
+        samples_read += len(decoder.read())
+    assert np.isclose(samples_read, 22050 * wav_file_params['duration'], rtol=0.01)
+
+
 def test_delete(wav_file):
     """ Ensure that AudioDecoder.__dealloc__ does not crash """
     decoder = AudioDecoder(wav_file)
     del decoder
 
 
+def test_pipeline_reuse(wav_file):
+    """ Test that a freed decoder's pipeline is reused for the next file """
+    decoder_pool.clear()
+    decoder = AudioDecoder(wav_file)
+    first_block = decoder.read()
+    while not decoder.is_eos():
+        decoder.read()
+    del decoder
+    decoder_pool.wait()
+    assert len(decoder_pool) == 1
+
+    # A pipeline with a different output format is not reused
+    decoder = AudioDecoder(wav_file, channels=1)
+    del decoder
+    decoder_pool.wait()
+    assert len(decoder_pool) == 2
+
+    decoder = AudioDecoder(wav_file)
+    assert len(decoder_pool) == 1
+    assert not decoder.is_eos()
+    assert np.all(decoder.read() == first_block)
+
+
+def test_prewarm(wav_file):
+    decoder_pool.clear()
+    decoder_pool.prewarm()
+    decoder_pool.prewarm()
+    decoder_pool.wait()
+    assert len(decoder_pool) == 1
+    decoder = AudioDecoder(wav_file)
+    assert len(decoder_pool) == 0
+    assert len(decoder.read()) > 0
+
+
 def test_read_ogg():
     """ Test that AudioDecoder can read channels, samplerate, and audio
     from an Ogg Vorbis file """
@@ -122,3 +168,52 @@ def test_read_invalid_file(tmpdir_factory):
         f.write(np.random.bytes(1000))
     with pytest.raises(IOError, match='Could not determine type of stream'):
         AudioDecoder(file_path)
+
+
+def test_read_tags():
+    """ Test that AudioDecoder reads the duration and tags while opening
+    the file """
+    filename = os.path.join(
+        os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg')
+    decoder = AudioDecoder(filename)
+    assert np.isclose(decoder.duration, 1.0, atol=0.01)
+    assert decoder.title == 'Test Track'
+    assert decoder.artist == 'Test Artist'
+    assert decoder.album == 'Test Album'
+
+
+def test_file_with_no_tags(wav_file, wav_file_params):
+    # Leave a pipeline that has read tags in the pool, to check that they
+    # aren't carried over to the next file
+    decoder_pool.clear()
+    decoder = AudioDecoder(os.path.join(
+        os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg'))
+    del decoder
+    decoder_pool.wait()
+
+    decoder = AudioDecoder(wav_file)
+    assert len(decoder_pool) == 0
+    assert np.isclose(decoder.duration, wav_file_params['duration'], atol=0.01)
+    assert decoder.title == ''
+    assert decoder.artist == ''
+    assert decoder.album == ''
+
+
+def test_seek_index():
+    """ Test that a seek index can be passed to another decoder of the same
+    file, and that seeking with it is accurate """
+    filename = os.path.join(
+        os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg')
+    decoder = AudioDecoder(filename)
+    while not decoder.is_eos():
+        decoder.read()
+    seek_index = decoder.get_seek_index()
+    assert seek_index.shape[1] == 2
+    assert np.all(np.diff(seek_index, axis=0) > 0)
+
+    decoder = AudioDecoder(filename)
+    decoder.set_seek_index(seek_index)
+    assert np.all(decoder.get_seek_index() == seek_index)
+    decoder.seek(0.5)
+    assert np.isclose(decoder.position, 0.5, atol=0.01)
+    assert len(decoder.read()) > 0
@@ -2,7 +2,7 @@ import os.path
 
 import pytest
 
-from tunescope.audio import AudioMetadata
+from tunescope.audio import AudioMetadata, MetadataReader, read_metadata
 
 
 def test_nonexistent_file():
@@ -28,3 +28,22 @@ def test_file_with_no_tags(wav_file, wav_file_params):
     assert metadata.title == ''
     assert metadata.artist == ''
     assert metadata.album == ''
+
+
+def test_metadata_reader(wav_file, wav_file_params):
+    filename = os.path.join(
+        os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg')
+    reader = MetadataReader()
+    assert reader.read(filename).title == 'Test Track'
+    assert reader.read(wav_file).duration == wav_file_params['duration']
+    with pytest.raises(IOError):
+        reader.read('nonexistent-file')
+
+
+def test_read_metadata(wav_file, wav_file_params):
+    filename = os.path.join(
+        os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg')
+    results = dict(read_metadata([filename, wav_file, 'nonexistent-file'] * 2, workers=2))
+    assert results[filename].title == 'Test Track'
+    assert results[wav_file].duration == wav_file_params['duration']
+    assert results['nonexistent-file'] is None
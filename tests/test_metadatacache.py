@@ -0,0 +1,79 @@
+import os
+import shutil
+
+import pytest
+
+from tunescope.metadatacache import MetadataCache
+
+
+class Metadata(object):
+    def __init__(self, duration, title, artist=u'', album=u''):
+        self.duration = duration
+        self.title = title
+        self.artist = artist
+        self.album = album
+
+
+@pytest.fixture
+def cache(tmpdir_factory):
+    return MetadataCache(str(tmpdir_factory.mktemp('metadatacache').join('metadata.sqlite3')))
+
+
+@pytest.fixture
+def music_dir(tmpdir_factory, wav_file):
+    """ A directory tree with two copies of the WAV file and a non-audio file """
+    directory = tmpdir_factory.mktemp('music')
+    shutil.copy(wav_file, str(directory.join('a.wav')))
+    directory.mkdir('album')
+    shutil.copy(wav_file, str(directory.join('album', 'b.WAV')))
+    directory.join('notes.txt').write('not audio')
+    return str(directory)
+
+
+def test_update_get(cache, music_dir):
+    file_path = os.path.join(music_dir, 'a.wav')
+    assert cache.get(file_path) is None
+    cache.update(file_path, Metadata(1.5, u'Title', u'Artist', u'Album'))
+    assert cache.get(file_path) == dict(
+        path=file_path, duration=1.5, title=u'Title', artist=u'Artist', album=u'Album')
+
+
+def test_record_invalidated_by_change(cache, music_dir):
+    file_path = os.path.join(music_dir, 'a.wav')
+    cache.update(file_path, Metadata(1.5, u'Title'))
+    with open(file_path, 'ab') as f:
+        f.write(b'\0\0')
+    assert cache.get(file_path) is None
+
+
+def test_unreadable_file(cache, music_dir):
+    file_path = os.path.join(music_dir, 'notes.txt')
+    cache.update(file_path, None)
+    assert cache.get(file_path) is None
+    assert cache.records(music_dir) == []
+
+
+def test_records(cache, music_dir):
+    cache.update(os.path.join(music_dir, 'album', 'b.WAV'), Metadata(2.0, u'B'))
+    cache.update(os.path.join(music_dir, 'a.wav'), Metadata(1.0, u'A'))
+    assert [r['title'] for r in cache.records(music_dir)] == [u'A', u'B']
+    assert [r['title'] for r in cache.records(os.path.join(music_dir, 'album'))] == [u'B']
+    assert cache.records(music_dir + 'x') == []
+
+
+def test_scan(cache, music_dir, wav_file_params):
+    progress = []
+    assert cache.scan(music_dir, progress_callback=lambda *args: progress.append(args)) == 2
+    assert progress[-1] == (2, 2)
+    records = cache.records(music_dir)
+    assert [os.path.basename(r['path']) for r in records] == ['a.wav', 'b.WAV']
+    assert records[0]['duration'] == wav_file_params['duration']
+
+    # Only new and changed files are read again, and records of deleted
+    # files are removed
+    assert cache.scan(music_dir) == 0
+    with open(os.path.join(music_dir, 'a.wav'), 'ab') as f:
+        f.write(b'\0\0')
+    os.remove(os.path.join(music_dir, 'album', 'b.WAV'))
+    assert cache.scan(music_dir) == 1
+    assert [os.path.basename(r['path']) for r in cache.records(music_dir)] == ['a.wav']
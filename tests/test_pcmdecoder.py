@@ -0,0 +1,137 @@
+import aifc
+import os.path
+import struct
+
+import pytest
+import numpy as np
+
+from tunescope.audio.pcmdecoder import PCMDecoder, open_decoder
+
+
+def read_all(decoder):
+    blocks = []
+    while not decoder.is_eos():
+        blocks.append(decoder.read())
+    return np.concatenate(blocks)
+
+
+def write_wav(file_path, samples, channels, samplerate, format_tag, sample_format,
+              info=None):
+    """ Write a WAV file of `samples` converted to numpy `sample_format`,
+    with an INFO list of the given {chunk ID: text} """
+    data = samples.astype(sample_format).tobytes()
+    width = np.dtype(sample_format).itemsize
+    chunks = [b'fmt ' + struct.pack('<IHHIIHH', 16, format_tag, channels, samplerate,
+                                    samplerate * channels * width, channels * width,
+                                    8 * width)]
+    if info:
+        items = b''.join(key + struct.pack('<I', len(value) + 1) + value + b'\0\0'[:2 - len(value) % 2]
+                         for key, value in info.items())
+        chunks.append(b'LIST' + struct.pack('<I', 4 + len(items)) + b'INFO' + items)
+    chunks.append(b'data' + struct.pack('<I', len(data)) + data)
+    body = b'WAVE' + b''.join(chunks)
+    with open(file_path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+
+
+def test_read_wav(wav_file, wav_file_params, wav_file_samples):
+    decoder = PCMDecoder(wav_file)
+    assert decoder.channels == wav_file_params['channels']
+    assert decoder.samplerate == wav_file_params['samplerate']
+    assert decoder.duration == wav_file_params['duration']
+    assert decoder.title == ''
+    samples = read_all(decoder)
+    assert samples.dtype == np.float32
+    assert np.array_equal(samples, (wav_file_samples * 2.0 ** 15).astype('<i2') / 2.0 ** 15)
+    assert np.all(decoder.read() == 0)
+
+
+def test_seek(wav_file, wav_file_params, wav_file_samples):
+    decoder = PCMDecoder(wav_file)
+    assert decoder.seek(5.0)
+    assert decoder.position == 5.0
+    start = 5 * wav_file_params['samplerate'] * wav_file_params['channels']
+    block = decoder.read()
+    assert np.allclose(block, wav_file_samples[start:start + len(block)], atol=2.0 ** -15)
+    assert not decoder.seek(-1)
+    assert not decoder.seek(wav_file_params['duration'] + 1)
+
+
+@pytest.mark.parametrize('format_tag, sample_format, scale', [
+    (1, 'u1', None),
+    (1, '<i4', 2.0 ** 31),
+    (3, '<f4', 1.0),
+    (3, '<f8', 1.0),
+])
+def test_wav_formats(tmpdir, format_tag, sample_format, scale):
+    samples = np.linspace(-1, 0.99, 1000)
+    file_path = str(tmpdir.join('test.wav'))
+    if scale is None:
+        write_wav(file_path, samples * 128 + 128, 1, 8000, format_tag, sample_format)
+    else:
+        write_wav(file_path, samples * scale, 1, 8000, format_tag, sample_format)
+    assert np.allclose(read_all(PCMDecoder(file_path)), samples, atol=1.0 / 128)
+
+
+def test_wav_tags(tmpdir):
+    file_path = str(tmpdir.join('test.wav'))
+    write_wav(file_path, np.zeros(100), 1, 8000, 1, '<i2',
+              {b'INAM': b'Test Track', b'IART': b'Test Artist', b'IPRD': b'Album'})
+    decoder = PCMDecoder(file_path)
+    assert (decoder.title, decoder.artist, decoder.album) == ('Test Track', 'Test Artist', 'Album')
+    assert decoder.duration == 100 / 8000.0
+
+
+@pytest.mark.parametrize('sample_width', [2, 3])
+def test_read_aiff(tmpdir, sample_width):
+    samples = np.random.random(2 * 5000) * 2 - 1
+    integers = (samples * 2 ** (8 * sample_width - 1)).astype('>i4')
+    file_path = str(tmpdir.join('test.aiff'))
+    writer = aifc.open(file_path, 'wb')
+    writer.setnchannels(2)
+    writer.setsampwidth(sample_width)
+    writer.setframerate(48000)
+    writer.writeframes(integers.view(np.uint8).reshape(-1, 4)[:, 4 - sample_width:].tobytes())
+    writer.close()
+
+    decoder = PCMDecoder(file_path)
+    assert decoder.channels == 2
+    assert decoder.samplerate == 48000
+    assert np.allclose(read_all(decoder), samples, atol=2.0 ** (1 - 8 * sample_width))
+
+
+def test_channel_conversion(wav_file, wav_file_samples):
+    samples = read_all(PCMDecoder(wav_file, channels=1))
+    expected = (wav_file_samples * 2.0 ** 15).astype('<i2').reshape(-1, 2).mean(axis=1) / 2.0 ** 15
+    assert np.allclose(samples, expected)
+    with pytest.raises(ValueError):
+        PCMDecoder(wav_file, channels=3)
+
+
+def test_open_decoder(wav_file, wav_file_params):
+    assert isinstance(open_decoder(wav_file), PCMDecoder)
+    assert isinstance(open_decoder(wav_file, channels=1), PCMDecoder)
+    ogg_file = os.path.join(os.path.dirname(__file__), 'data', 'short-noise-with-metadata.ogg')
+    with pytest.raises(ValueError):
+        PCMDecoder(ogg_file)
+    assert not isinstance(open_decoder(ogg_file), PCMDecoder)
+    with pytest.raises(ValueError):
+        PCMDecoder(wav_file, samplerate=22050)
+    decoder = open_decoder(wav_file, samplerate=22050)
+    assert not isinstance(decoder, PCMDecoder)
+    assert decoder.samplerate == 22050
+
+
+@pytest.mark.parametrize('length', [20, 30, 40])
+def test_truncated_header(tmpdir, length):
+    file_path = str(tmpdir.join('test.wav'))
+    write_wav(file_path, np.zeros(100), 1, 8000, 1, '<i2')
+    with open(file_path, 'r+b') as f:
+        f.truncate(length)
+    with pytest.raises(ValueError):
+        PCMDecoder(file_path)
+
+
+def test_nonexistent_file():
+    with pytest.raises(IOError):
+        PCMDecoder('nonexistent-file')
@@ -0,0 +1,166 @@
+import threading
+
+import numpy as np
+
+from tunescope.audio.shareddecoder import SharedDecoder
+from test_doubles import FakeAudioDecoder
+
+
+class CountingDecoderFactory(object):
+    """ Opens FakeAudioDecoders for the same blocks, counting the decoders
+    opened and the blocks decoded """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.decoders = []
+
+    def __call__(self):
+        decoder = FakeAudioDecoder(self.blocks)
+        decoder.channels = 2
+        decoder.samplerate = 3
+        self.decoders.append(decoder)
+        return decoder
+
+    @property
+    def blocks_decoded(self):
+        return sum(decoder._next_block_index for decoder in self.decoders)
+
+
+def read_all(reader):
+    data = []
+    while not reader.is_eos():
+        data += list(reader.read())
+    return data
+
+
+def test_readers_share_one_decode():
+    factory = CountingDecoderFactory([range(6), range(6, 12)])
+    shared = SharedDecoder(factory, 1000)
+    reader1 = shared.reader()
+    reader2 = shared.reader()
+    assert read_all(reader1) == range(12)
+    assert read_all(reader2) == range(12)
+    assert len(factory.decoders) == 1
+    assert factory.blocks_decoded == 2
+    assert shared.samples_decoded == 12
+
+
+def test_interleaved_reads():
+    factory = CountingDecoderFactory([range(6), range(6, 12)])
+    shared = SharedDecoder(factory, 1000)
+    reader1 = shared.reader()
+    reader2 = shared.reader()
+    assert list(reader2.read()) == range(6)
+    assert list(reader1.read()) == range(6)
+    assert list(reader1.read()) == range(6, 12)
+    assert list(reader2.read()) == range(6, 12)
+    assert reader1.is_eos() and reader2.is_eos()
+    assert factory.blocks_decoded == 2
+
+
+def test_position():
+    shared = SharedDecoder(CountingDecoderFactory([range(6), range(6, 12)]), 1000)
+    reader = shared.reader()
+    assert reader.position == 0
+    reader.read()
+    assert reader.position == 1
+
+
+def test_seek_within_decoded_stream():
+    factory = CountingDecoderFactory([range(6), range(6, 12)])
+    shared = SharedDecoder(factory, 1000)
+    reader = shared.reader()
+    read_all(reader)
+    assert reader.seek(1.0 / 3)
+    assert reader.shared
+    assert reader.position == 1.0 / 3
+    assert list(reader.read()) == range(2, 6)
+    assert list(reader.read()) == range(6, 12)
+    assert factory.blocks_decoded == 2
+
+
+def test_seek_past_decoded_stream_uses_private_decoder():
+    factory = CountingDecoderFactory([range(6), range(6, 12), range(12, 18)])
+    shared = SharedDecoder(factory, 1000)
+    reader = shared.reader()
+    assert reader.seek(1)
+    assert not reader.shared
+    assert list(reader.read()) == range(6, 12)
+    assert len(factory.decoders) == 2
+
+    # Seeking back into the decoded stream stops using the private decoder
+    shared.reader().read()
+    assert reader.seek(0)
+    assert reader.shared
+    assert list(reader.read()) == range(6)
+
+
+def test_private_decoder_rejoins_shared_decoder():
+    factory = CountingDecoderFactory([range(6), range(6, 12), range(12, 18)])
+    shared = SharedDecoder(factory, 1000)
+    reader = shared.reader()
+    reader.seek(1)
+    assert list(reader.read()) == range(6, 12)
+    assert not reader.shared
+
+    # Once the shared decoder has caught up, the reader continues from it
+    other_reader = shared.reader()
+    other_reader.read()
+    other_reader.read()
+    assert list(reader.read()) == range(12, 18)
+    assert reader.shared
+    assert factory.decoders[1]._next_block_index == 2  # Seeked to 1, read 1
+
+
+def test_exceeding_max_samples_releases_decoded_stream():
+    factory = CountingDecoderFactory([range(6), range(6, 12), range(12, 18)])
+    shared = SharedDecoder(factory, 6)
+    reader1 = shared.reader()
+    reader2 = shared.reader()
+    assert list(reader1.read()) == range(6)
+    assert list(reader1.read()) == range(6, 12)
+    assert not shared.shared
+    assert not reader1.shared
+    assert read_all(reader1) == range(12, 18)
+
+    # reader2 carries on from where it was with a decoder of its own
+    assert read_all(reader2) == range(18)
+    assert len(factory.decoders) == 2
+
+
+def test_buffered_blocks_read_while_decoding():
+    factory = CountingDecoderFactory([range(6), range(6, 12)])
+    shared = SharedDecoder(factory, 1000)
+    reader1 = shared.reader()
+    reader2 = shared.reader()
+    reader1.read()
+
+    # Make decoding the next block wait until it is allowed to finish (or
+    # for a second, so the test fails rather than hangs)
+    decoder = factory.decoders[0]
+    decode = decoder.read
+    decoding = threading.Event()
+    finish = threading.Event()
+    timer = threading.Timer(1, finish.set)
+    timer.start()
+
+    def slow_read():
+        decoding.set()
+        finish.wait()
+        return decode()
+    decoder.read = slow_read
+
+    blocks = []
+    thread = threading.Thread(target=lambda: blocks.append(list(reader1.read())))
+    thread.start()
+    assert decoding.wait(1)
+
+    # reader2 reads the block decoded already while reader1 decodes the next
+    assert list(reader2.read()) == range(6)
+    assert not finish.is_set()
+    finish.set()
+    timer.cancel()
+    thread.join()
+    assert blocks == [range(6, 12)]
+    assert list(reader2.read()) == range(6, 12)
+    assert factory.blocks_decoded == 2
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from tunescope.visualization.colormaps import COLORMAP_NAMES, colormap_lut, get_colormap
+
+
+def test_get_colormap():
+    for name in COLORMAP_NAMES:
+        colormap = get_colormap(name)
+        assert colormap.shape == (256, 3)
+        assert colormap.dtype == np.uint8
+        assert get_colormap(name) is colormap
+    assert np.all(get_colormap('viridis')[0] == [68, 1, 84])
+    with pytest.raises(ValueError):
+        get_colormap('jet')
+
+
+def test_colormap_attributes():
+    from tunescope.visualization import colormaps
+    from tunescope.visualization.colormaps import viridis
+
+    assert viridis is get_colormap('viridis')
+    for name in COLORMAP_NAMES:
+        assert getattr(colormaps, name) is get_colormap(name)
+    with pytest.raises(AttributeError):
+        colormaps.jet
+
+
+def test_colormap_lut():
+    for name in COLORMAP_NAMES:
+        lut = colormap_lut(name)
+        assert lut.shape == (256, 3)
+        assert lut.dtype == np.uint8
+        assert lut.flags.c_contiguous
+        assert np.all(lut == get_colormap(name))
+
+
+def test_colormap_lut_levels():
+    full = colormap_lut('magma')
+    lut = colormap_lut('magma', black_level=0.5, white_level=0.75)
+    assert np.all(lut[:128] == full[0])
+    assert np.all(lut[192:] == full[255])
+    assert np.all(lut[160] == full[130])
+
+    lut = colormap_lut('magma', black_level=0.5, white_level=0.5)
+    assert np.all(lut[:127] == full[0])
+    assert np.all(lut[128:] == full[255])
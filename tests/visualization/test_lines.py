@@ -0,0 +1,26 @@
+import numpy as np
+
+from tunescope.visualization.lines import decimate_min_max
+
+
+def test_decimate_few_values():
+    values = np.array([3, 1, 2], dtype=np.float32)
+    x, y = decimate_min_max(values, 2)
+    assert np.all(x == [0, 1, 2])
+    assert np.all(y == values)
+
+
+def test_decimate_min_max():
+    values = np.array([1, 5, 2, 0, 3, 4, 9, 8, 7], dtype=np.float32)
+    x, y = decimate_min_max(values, 3)
+    assert np.all(x == [1, 1, 4, 4, 7, 7])
+    assert np.all(y == [1, 5, 0, 4, 7, 9])
+
+
+def test_decimate_uneven_buckets():
+    values = np.arange(10, dtype=np.float32)
+    x, y = decimate_min_max(values, 4)
+    assert len(x) == len(y) == 8
+    assert y[0] == 0
+    assert y[-1] == 9
+    assert np.all(np.diff(x) >= 0)
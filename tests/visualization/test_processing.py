@@ -1,6 +1,7 @@
 import numpy as np
 
-from tunescope.visualization.processing import log_axis
+from tunescope.visualization.processing import (
+    INTENSITY_LEVELS, apply_colormap, log_axis, render_spectra)
 
 
 def test_log_axis():
@@ -130,3 +131,61 @@ def test_log_axis_with_expected_data_for_refactoring():
         , dtype=np.float32)
 
     assert np.allclose(output_spectra, expected_output_spectra)
+
+
+def test_render_spectra_matches_numpy_pipeline():
+    from tunescope.visualization.spectrogram import spectra_to_pixels
+
+    spectra = np.random.random((16, 65)).astype(np.float32)
+    spectra[3] *= 0.001  # quiet time step: normalization peak is clipped
+
+    # With this colormap, each pixel's color is its intensity level
+    colormap = np.arange(INTENSITY_LEVELS).repeat(3).reshape((-1, 3)).astype(np.uint8)
+
+    normalized = log_axis(spectra)
+    normalized /= np.clip(normalized.max(axis=1)[:, np.newaxis], 0.03, 1)
+    expected_pixels, size = spectra_to_pixels(np.log10(normalized * 9 + 1), colormap)
+    expected_intensities = expected_pixels[::3].reshape((size[1], size[0]))
+
+    intensities = np.zeros((size[1], size[0]), dtype=np.uint8)
+    render_spectra(spectra, intensities)
+
+    # Levels may be off by one due to quantization
+    assert np.abs(intensities.astype(int) - expected_intensities).max() <= 1
+
+
+def test_render_spectra_x_offset():
+    spectra = np.random.random((4, 9)).astype(np.float32)
+
+    page_intensities = np.zeros((8, 4), dtype=np.uint8)
+    render_spectra(spectra, page_intensities)
+
+    intensities = np.zeros((8, 10), dtype=np.uint8)
+    render_spectra(spectra, intensities, x_offset=5)
+
+    assert np.all(intensities[:, 5:9] == page_intensities)
+    assert np.all(intensities[:, :5] == 0)
+    assert np.all(intensities[:, 9:] == 0)
+
+
+def test_render_uint8_spectra():
+    magnitudes = np.random.random(256).astype(np.float32)
+    spectra = np.random.randint(0, 256, (8, 33)).astype(np.uint8)
+
+    expected_intensities = np.zeros((32, 8), dtype=np.uint8)
+    render_spectra(magnitudes[spectra], expected_intensities)
+
+    intensities = np.zeros((32, 8), dtype=np.uint8)
+    render_spectra(spectra, intensities, 0, magnitudes)
+
+    assert np.all(intensities == expected_intensities)
+
+
+def test_apply_colormap():
+    colormap = np.random.randint(0, 256, (INTENSITY_LEVELS, 3)).astype(np.uint8)
+    intensities = np.random.randint(0, INTENSITY_LEVELS, (3, 5)).astype(np.uint8)
+    pixels = np.zeros((3, 5, 3), dtype=np.uint8)
+
+    apply_colormap(intensities, colormap, pixels)
+
+    assert np.all(pixels == colormap[intensities])
@@ -0,0 +1,108 @@
+import numpy as np
+
+from tunescope.visualization.tiles import MappedTileStore, TileStore, TilePyramid
+
+
+def test_tile_allocation():
+    tiles = TileStore(4, 8)
+    assert len(tiles) == 0
+    assert tiles.get(2) is None
+
+    tile = tiles.tile(2)
+    assert tile.shape == (4, 8)
+    assert tile.dtype == np.uint8
+    assert np.all(tile == 0)
+    assert tiles.get(2) is tile
+    assert tiles.tile(2) is tile
+    assert len(tiles) == 3
+
+    tiles.clear()
+    assert len(tiles) == 0
+
+
+def test_tile_range():
+    tiles = TileStore(4, 8)
+    assert list(tiles.tile_range(0, 8)) == [0]
+    assert list(tiles.tile_range(0, 9)) == [0, 1]
+    assert list(tiles.tile_range(7.5, 16)) == [0, 1]
+    assert list(tiles.tile_range(-20, 3)) == [0]
+    assert list(tiles.tile_range(20, 20)) == []
+
+
+def test_spans():
+    tiles = TileStore(4, 8)
+    assert tiles.spans(0, 8) == [(0, 0, 0, 8)]
+    assert tiles.spans(5, 3) == [(0, 5, 0, 3)]
+    assert tiles.spans(5, 20) == [
+        (0, 5, 0, 3),
+        (1, 0, 3, 11),
+        (2, 0, 11, 19),
+        (3, 0, 19, 20),
+    ]
+    assert tiles.spans(5, 0) == []
+
+
+def test_read_write():
+    tiles = TileStore(2, 4)
+    data = np.arange(2 * 6, dtype=np.uint8).reshape((2, 6))
+    tiles.write(3, data)
+    assert len(tiles) == 3
+    assert np.all(tiles.read(3, 6) == data)
+    assert np.all(tiles.read(0, 3) == 0)
+    assert np.all(tiles.get(1) == data[:, 1:5])
+
+
+def test_pyramid_levels():
+    assert len(TilePyramid(2, 4, 4).levels) == 1
+    assert len(TilePyramid(2, 4, 5).levels) == 2
+    assert len(TilePyramid(2, 4, 16).levels) == 3
+    assert len(TilePyramid(2, 4, 17).levels) == 4
+
+
+def test_pyramid_update_incrementally():
+    pyramid = TilePyramid(1, 4, 16)
+    data = np.array([[1, 5, 2, 0, 3, 3, 9, 4, 0, 7, 6, 1, 8, 2, 2, 5]], dtype=np.uint8)
+
+    # Write level 0 in uneven pages, as analysis would
+    for x_start, x_end in [(0, 3), (3, 10), (10, 16)]:
+        pyramid.levels[0].write(x_start, data[:, x_start:x_end])
+        pyramid.update(x_start, x_end)
+
+    assert np.all(pyramid.levels[1].read(0, 8) == [[5, 2, 3, 9, 7, 6, 8, 5]])
+    assert np.all(pyramid.levels[2].read(0, 4) == [[5, 9, 7, 8]])
+
+
+def test_pyramid_level_for_scale():
+    pyramid = TilePyramid(1, 4, 16)
+    assert pyramid.level_for_scale(0.5) == 0
+    assert pyramid.level_for_scale(1.9) == 0
+    assert pyramid.level_for_scale(2) == 1
+    assert pyramid.level_for_scale(3.9) == 1
+    assert pyramid.level_for_scale(100) == 2
+
+
+def test_mapped_tile_store(tmpdir):
+    tiles = MappedTileStore(2, 4, str(tmpdir))
+    assert len(tiles) == 0
+    assert tiles.get(1) is None
+
+    data = np.arange(2 * 6, dtype=np.uint8).reshape((2, 6))
+    tiles.write(5, data)
+    assert len(tiles) == 3
+    assert tiles.get(0) is None
+    assert np.all(tiles.get(1)[:, 1:] == data[:, :3])
+    assert np.all(tiles.read(5, 6) == data)
+    assert np.all(tiles.read(0, 5) == 0)
+
+    tiles.clear()
+    assert len(tiles) == 0
+    assert np.all(tiles.tile(1) == 0)
+
+
+def test_mapped_pyramid(tmpdir):
+    pyramid = TilePyramid(1, 4, 16, directory=str(tmpdir))
+    assert all(isinstance(level, MappedTileStore) for level in pyramid.levels)
+    data = np.array([[1, 5, 2, 0, 3, 3, 9, 4, 0, 7, 6, 1, 8, 2, 2, 5]], dtype=np.uint8)
+    pyramid.levels[0].write(0, data)
+    pyramid.update(0, 16)
+    assert np.all(pyramid.levels[2].read(0, 4) == [[5, 9, 7, 8]])
@@ -1,8 +1,43 @@
 from __future__ import division
 import math
+import threading
+import time
 
 import numpy as np
-import aubio
+
+
+# Spectrum magnitudes are scaled so that a full-scale sine wave has a total
+# magnitude of about 1. In the compact 'uint8' spectrum format, magnitudes are
+# stored in decibels relative to that full scale, quantized linearly so that
+# 0 represents SPECTRUM_DB_FLOOR dB or less (decoded as silence) and 255
+# represents 0 dB or more. This gives steps of about 0.38 dB.
+SPECTRUM_DB_FLOOR = -96.0
+
+SPECTRUM_FORMATS = ('float32', 'float16', 'uint8')
+
+# Magnitude represented by each uint8 spectrum value
+UINT8_SPECTRUM_MAGNITUDES = np.concatenate((
+    [0],
+    10 ** (np.linspace(SPECTRUM_DB_FLOOR, 0, 256)[1:] / 20),
+)).astype(np.float32)
+
+# YIN accepts the first lag whose cumulative mean normalized difference is
+# below this threshold (and is a local minimum) as the period
+YIN_THRESHOLD = 0.15
+
+# Frames quieter than this (RMS, in dB relative to full scale) have no pitch
+PITCH_SILENCE_DB = -60.0
+
+# Frames are decimated to about this sample rate before estimating pitch,
+# which is plenty for musical pitches and halves the work at 44.1/48 kHz
+_PITCH_SAMPLERATE = 22050
+
+# Number of frames whose pitch is estimated at once, bounding the size of
+# the temporary arrays
+_PITCH_CHUNK_SIZE = 64
+
+# Maximum number of samples read at a time when skipping audio
+_SKIP_BLOCK_SIZE = 65536
 
 
 def analyze(
@@ -10,7 +45,10 @@ def analyze(
         window_size=2048,
         hop_size=512,
         page_size=1024,
-        on_progress=None):
+        on_progress=None,
+        progress_interval=0.1,
+        spectrum_format='float32',
+        cancel_event=None):
     """ Analyze the audio, producing data for plots.
 
     Parameters
@@ -27,7 +65,20 @@ def analyze(
     page_size : int
         Number of data points (hops) per page yielded
     on_progress : function
-        Called on each hop to report progress
+        Called with the number of hops analyzed so far to report progress,
+        at most once every `progress_interval` seconds and once more when
+        analysis is complete. It is called in the analysis thread.
+    progress_interval : float
+        Minimum time in seconds between calls to `on_progress`
+    spectrum_format : str
+        One of SPECTRUM_FORMATS. 'float32' pages hold magnitudes and are
+        reused for each page yielded, so consumers must copy any data they
+        want to keep (as is always the case for pitch, peak and RMS pages).
+        'float16' and 'uint8' pages are compact copies (see
+        `encode_spectrum`) that may be kept as they are.
+    cancel_event : threading.Event
+        If given, analysis stops (without yielding a partial page) as soon
+        as the current hop is finished after the event is set
 
     Yields
     ------
@@ -35,37 +86,438 @@ def analyze(
     A dictionary with the current page of data:
         {
             'pitch' : np.ndarray(shape=(page_size,), dtype=np.float32)
-                MIDI pitch values
-            'spectrum': np.ndarray(shape=(page_size, window_size / 2 + 1), dtype=np.float32)
+                MIDI pitch values (0 where there is no pitch)
+            'peak' : np.ndarray(shape=(page_size,), dtype=np.float32)
+                Peak absolute amplitude of each hop (of the mono mix)
+            'rms' : np.ndarray(shape=(page_size,), dtype=np.float32)
+                RMS amplitude of each hop (of the mono mix)
+            'spectrum': np.ndarray(shape=(page_size, window_size / 2 + 1), dtype=spectrum_format)
                 FFT magnitudes
         }
     """
+    if spectrum_format not in SPECTRUM_FORMATS:
+        raise ValueError("Unknown spectrum format: {}".format(spectrum_format))
+
+    # Pitch is estimated a page at a time from the same frames as the
+    # spectrum: frame i is the window ending with hop i. `page_samples` holds
+    # the samples of the page's hops, preceded by the end of the previous
+    # page needed to complete the first window.
+    history_size = window_size - hop_size
+    page_samples = np.zeros(history_size + page_size * hop_size, dtype=np.float32)
+    pitch_page = np.zeros(page_size, dtype=np.float32)
+    peak_page = np.zeros(page_size, dtype=np.float32)
+    rms_page = np.zeros(page_size, dtype=np.float32)
 
-    # pitch_detector = aubio.pitch('yinfft', window_size, hop_size, audio_source.samplerate)
-    # pitch_detector.set_unit('midi')
-    # pitch_page = np.zeros(page_size, dtype=np.float32)
+    # aubio is imported when first needed, as it is slow to import
+    import aubio
 
     spectrum_size = window_size // 2 + 1
     pvoc = aubio.pvoc(window_size, hop_size)
     spectrum_page = np.zeros((page_size, spectrum_size), dtype=np.float32)
 
+    def finish_page(page_length):
+        frames = np.lib.stride_tricks.as_strided(
+            page_samples,
+            shape=(page_length, window_size),
+            strides=(hop_size * page_samples.itemsize, page_samples.itemsize))
+        pitch_page[:page_length] = estimate_pitch(frames, audio_source.samplerate)
+        hops = page_samples[history_size:history_size + page_length * hop_size].reshape(
+            (page_length, hop_size))
+        np.abs(hops).max(axis=1, out=peak_page[:page_length])
+        np.sqrt(np.square(hops).mean(axis=1), out=rms_page[:page_length])
+        page_samples[:history_size] = page_samples[
+            page_length * hop_size:page_length * hop_size + history_size]
+        return {
+            'pitch': pitch_page[:page_length],
+            'peak': peak_page[:page_length],
+            'rms': rms_page[:page_length],
+            'spectrum': encode_spectrum(spectrum_page[:page_length], spectrum_format)}
+
+    hops_analyzed = 0
+    next_progress_time = time.time() + progress_interval
+
     i = 0
     while not audio_source.is_eos():
-        frames_mono = (
-            audio_source
-            .read(hop_size * audio_source.channels)
-            .reshape((-1, audio_source.channels))
-            .mean(axis=1))
-        # pitch_page[i] = pitch_detector(frames_mono)[0]
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        if audio_source.channels == 1:
+            frames_mono = audio_source.read(hop_size)
+        else:
+            frames_mono = (
+                audio_source
+                .read(hop_size * audio_source.channels)
+                .reshape((-1, audio_source.channels))
+                .mean(axis=1))
+        page_samples[history_size + i * hop_size:history_size + (i + 1) * hop_size] = frames_mono
         spectrum_page[i] = pvoc(frames_mono).norm / window_size * 2
         i += 1
         if i == page_size:
-            yield {
-                # 'pitch': pitch_page,
-                'spectrum': spectrum_page}
+            yield finish_page(page_size)
             i = 0
-        on_progress and on_progress()
+        hops_analyzed += 1
+        if on_progress and time.time() >= next_progress_time:
+            on_progress(hops_analyzed)
+            next_progress_time = time.time() + progress_interval
     if i != 0:
-        yield {
-            # 'pitch': pitch_page[:i],
-            'spectrum': spectrum_page[:i]}
+        yield finish_page(i)
+    on_progress and on_progress(hops_analyzed)
+
+
+def analyze_range(audio_source, start, end, window_size=2048, hop_size=512, **kwargs):
+    """ Analyze the audio from `start` to `end` (in seconds), which is
+    typically a short part of a file analyzed at a finer resolution than the
+    whole file. `audio_source` is as for `analyze`, but must also implement
+    `seek(position)`. Audio before `start` is read as needed so that the
+    first windows are full. Other keyword arguments are passed to `analyze`.
+
+    Return a single page (as yielded by `analyze`) with one data point per
+    hop from `start`, or None if the analysis was cancelled.
+    """
+    samplerate = audio_source.samplerate
+    hop_duration = hop_size / samplerate
+    lead_hops = min(_lead_hops(window_size, hop_size), int(start / hop_duration))
+    hop_count = int(math.ceil((end - start) / hop_duration))
+    if hop_count <= 0:
+        raise ValueError("Empty range: {} to {}".format(start, end))
+    if not audio_source.seek(max(start - lead_hops * hop_duration, 0)):
+        raise IOError("Could not seek to {} seconds".format(start))
+    return _analyze_hops(audio_source, lead_hops, hop_count, window_size, hop_size, **kwargs)
+
+
+def _lead_hops(window_size, hop_size):
+    """ Return the number of hops before a hop that its window covers """
+    return int(math.ceil((window_size - hop_size) / hop_size))
+
+
+def _analyze_hops(audio_source, lead_hops, hop_count, window_size, hop_size, **kwargs):
+    """ Analyze `lead_hops` + `hop_count` hops from the current position of
+    `audio_source`, returning a page of the last `hop_count`, or None if the
+    analysis was cancelled """
+    source = _RangeSource(audio_source, (lead_hops + hop_count) * hop_size)
+    for page in analyze(source,
+                        window_size=window_size,
+                        hop_size=hop_size,
+                        page_size=lead_hops + hop_count,
+                        **kwargs):
+        return {key: values[lead_hops:] for key, values in page.items()}
+    return None
+
+
+def analyze_overview(audio_source, duration, point_count, window_size=2048, hop_size=512,
+                     seek=True, **kwargs):
+    """ Quickly analyze `point_count` hops spread evenly over the `duration`
+    seconds of `audio_source`, seeking to each one, to give a rough overview
+    of a file before it has been analyzed in full. `audio_source` must
+    implement `seek(position)`. Other keyword arguments are passed to
+    `analyze_range`.
+
+    If `seek` is False, the audio is read in order instead, and the audio
+    between the points is read and discarded. This is faster where seeking
+    is slow (as in compressed files without a seek index) and the audio
+    would be decoded anyway (as when a SharedDecoder keeps it for the full
+    analysis). It only seeks back if the points are closer together than a
+    window.
+
+    Yields
+    ------
+    tuple
+    (hop_start, hop_end, page) for each point, in order, where `page` is a
+    one-data-point page (as returned by `analyze_range`) from the middle of
+    the hops `hop_start` to `hop_end` of the full analysis, which it stands
+    for. Stops early if the analysis is cancelled.
+    """
+    hop_duration = hop_size / audio_source.samplerate
+    hop_count = int(math.ceil(duration / hop_duration))
+    point_count = min(point_count, hop_count)
+    frames_read = 0  # Position of `audio_source` in frames, if not seeking
+    for i in range(point_count):
+        hop_start = i * hop_count // point_count
+        hop_end = (i + 1) * hop_count // point_count
+        hop = (hop_start + hop_end) // 2
+        if seek:
+            page = analyze_range(audio_source, hop * hop_duration, (hop + 1) * hop_duration,
+                                 window_size=window_size, hop_size=hop_size, **kwargs)
+        else:
+            lead_hops = min(_lead_hops(window_size, hop_size), hop)
+            start_frame = (hop - lead_hops) * hop_size
+            if start_frame < frames_read:
+                if not audio_source.seek(start_frame / audio_source.samplerate):
+                    raise IOError("Could not seek to {} seconds".format(
+                        start_frame / audio_source.samplerate))
+            else:
+                _skip(audio_source, start_frame - frames_read)
+            page = _analyze_hops(audio_source, lead_hops, 1, window_size, hop_size, **kwargs)
+            frames_read = start_frame + (lead_hops + 1) * hop_size
+        if page is None:
+            return
+        yield hop_start, hop_end, page
+
+
+def _skip(audio_source, frame_count):
+    """ Read and discard the next `frame_count` frames of `audio_source` """
+    sample_count = frame_count * audio_source.channels
+    while sample_count > 0 and not audio_source.is_eos():
+        block_size = min(sample_count, _SKIP_BLOCK_SIZE)
+        audio_source.read(block_size)
+        sample_count -= block_size
+
+
+def choose_analysis_parameters(duration, samplerate, hops_per_second, target_time,
+                               max_hop_count=None, high_resolution=False):
+    """ Choose the window and hop sizes for analyzing a whole file.
+
+    The window is about 93 ms long, whatever the sample rate. The hop starts
+    at a quarter of the window, and is doubled (up to the window size) until
+    analysis is expected to take no more than `target_time` seconds and
+    produces no more than `max_hop_count` hops (e.g. the most columns the
+    plot can show).
+
+    Parameters
+    ----------
+    duration : float
+        Duration of the audio in seconds
+    samplerate : int
+        Sample rate of the audio
+    hops_per_second : float
+        Analysis speed, as measured by `measure_analysis_speed`
+    target_time : float
+        Longest time in seconds that analysis should take
+    max_hop_count : int, optional
+        Largest useful number of hops
+    high_resolution : bool
+        If True, use a hop of an eighth of the window regardless of the time
+        it takes
+
+    Returns
+    -------
+    (window_size, hop_size) : tuple of int
+    """
+    window_size = _analysis_window_size(samplerate)
+    if high_resolution:
+        return window_size, window_size // 8
+    hop_size = window_size // 4
+    while hop_size < window_size:
+        hop_count = duration * samplerate / hop_size
+        if (hop_count <= hops_per_second * target_time
+                and (max_hop_count is None or hop_count <= max_hop_count)):
+            break
+        hop_size *= 2
+    return window_size, hop_size
+
+
+def measure_analysis_speed(samplerate, hop_count=512):
+    """ Return the number of hops per second that `analyze` processes on this
+    machine (not counting decoding) with the window chosen by
+    `choose_analysis_parameters` for `samplerate`, measured by analyzing
+    `hop_count` hops of noise """
+    window_size = _analysis_window_size(samplerate)
+    hop_size = window_size // 4
+    noise = np.random.RandomState(0).uniform(-0.5, 0.5, hop_count * hop_size)
+    audio_source = _ArraySource(noise.astype(np.float32), samplerate)
+    start_time = time.time()
+    for page in analyze(audio_source, window_size, hop_size, page_size=hop_count,
+                        spectrum_format='uint8'):
+        pass
+    return hop_count / max(time.time() - start_time, 1e-6)
+
+
+def _analysis_window_size(samplerate):
+    """ Return the power-of-2 window size closest to 93 ms """
+    return 2 ** int(round(math.log(samplerate * 4096 / 44100, 2)))
+
+
+class _ArraySource(object):
+    """ A mono audio source that reads from an ndarray """
+
+    channels = 1
+
+    def __init__(self, samples, samplerate):
+        self.samplerate = samplerate
+        self._samples = samples
+        self._position = 0
+
+    def read(self, sample_count):
+        block = np.zeros(sample_count, dtype=np.float32)
+        samples = self._samples[self._position:self._position + sample_count]
+        block[:len(samples)] = samples
+        self._position += sample_count
+        return block
+
+    def is_eos(self):
+        return self._position >= len(self._samples)
+
+
+class _RangeSource(object):
+    """ An audio source that reads the next `frame_count` frames from
+    `audio_source` and then reaches end-of-stream """
+
+    def __init__(self, audio_source, frame_count):
+        self.channels = audio_source.channels
+        self.samplerate = audio_source.samplerate
+        self._audio_source = audio_source
+        self._samples_left = frame_count * audio_source.channels
+
+    def read(self, sample_count):
+        block = self._audio_source.read(sample_count)
+        if sample_count > self._samples_left:
+            block = block.copy()
+            block[self._samples_left:] = 0
+        self._samples_left = max(self._samples_left - sample_count, 0)
+        return block
+
+    def is_eos(self):
+        return self._samples_left == 0 or self._audio_source.is_eos()
+
+
+def estimate_pitch(frames, samplerate, threshold=YIN_THRESHOLD):
+    """ Estimate the pitch of each row of the 2D ndarray `frames` using the
+    YIN algorithm, vectorized across frames. The difference function is
+    computed from the autocorrelation of the most recent half of each frame
+    with the whole frame, using FFTs. Return the MIDI pitches as a float32
+    ndarray, with 0 for silent frames. """
+    decimation = max(int(samplerate // _PITCH_SAMPLERATE), 1)
+    while frames.shape[1] % decimation:
+        decimation -= 1
+    pitches = np.zeros(len(frames), dtype=np.float32)
+    for start in range(0, len(frames), _PITCH_CHUNK_SIZE):
+        chunk = frames[start:start + _PITCH_CHUNK_SIZE]
+        pitches[start:start + len(chunk)] = _yin(chunk, samplerate, threshold, decimation)
+    return pitches
+
+
+def _yin(frames, samplerate, threshold, decimation):
+    # Reverse the frames so that lags reach back in time from their ends,
+    # decimating by averaging groups of samples
+    frames = frames[:, ::-1].astype(np.float64)
+    if decimation > 1:
+        frames = sum(frames[:, i::decimation] for i in range(decimation)) / decimation
+    samplerate = samplerate / decimation
+    window_size = frames.shape[1]
+    lag_count = window_size // 2
+    rows = np.arange(len(frames))
+
+    # Autocorrelation of the first half of each frame with the whole frame.
+    # The lags never wrap around the FFT, so the frame size is enough.
+    autocorrelation = np.fft.irfft(
+        np.fft.rfft(frames[:, :lag_count], window_size).conj() * np.fft.rfft(frames),
+        window_size)[:, :lag_count]
+
+    # Difference function d(tau) = sum((x[j] - x[j + tau]) ** 2), j < lag_count
+    energy = np.zeros((len(frames), window_size + 1))
+    np.cumsum(frames ** 2, axis=1, out=energy[:, 1:])
+    difference = (energy[:, lag_count, np.newaxis]
+                  + energy[:, lag_count:2 * lag_count] - energy[:, :lag_count]
+                  - 2 * autocorrelation)
+    difference[:, 0] = 0
+
+    # Cumulative mean normalized difference
+    normalized = np.ones_like(difference)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized[:, 1:] = (difference[:, 1:] * np.arange(1, lag_count)
+                             / np.cumsum(difference[:, 1:], axis=1))
+    normalized[~np.isfinite(normalized)] = 1
+
+    # Take the first local minimum below the threshold, or failing that, the
+    # global minimum
+    candidates = ((normalized[:, 1:-1] < threshold)
+                  & (normalized[:, 1:-1] <= normalized[:, 2:]))
+    lags = np.where(candidates.any(axis=1),
+                    candidates.argmax(axis=1),
+                    normalized[:, 1:-1].argmin(axis=1)) + 1
+
+    # Refine the lag by parabolic interpolation
+    before = normalized[rows, lags - 1]
+    at = normalized[rows, lags]
+    after = normalized[rows, lags + 1]
+    curvature = before - 2 * at + after
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(curvature > 0, 0.5 * (before - after) / curvature, 0)
+    periods = lags + np.clip(shift, -1, 1)
+
+    pitches = 69 + 12 * np.log2(samplerate / periods / 440)
+    silence = energy[:, lag_count] / lag_count < 10 ** (PITCH_SILENCE_DB / 10)
+    pitches[silence] = 0
+    return pitches
+
+
+class AnalysisJob(object):
+    """ A cancellable run of `analyze`, `analyze_overview` or
+    `analyze_range`. Create the job in the thread that may cancel it, then
+    call the method of the same name (`run()` for `analyze`) in the analysis
+    thread. """
+
+    def __init__(self):
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """ Stop the analysis. May be called from any thread. """
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def run(self, audio_source, **kwargs):
+        """ Analyze `audio_source`, yielding pages as `analyze` does, until
+        the end of the audio or until the job is cancelled. Keyword arguments
+        are passed to `analyze`. """
+        if self.cancelled:
+            return
+        for page in analyze(audio_source, cancel_event=self._cancel_event, **kwargs):
+            yield page
+            if self.cancelled:
+                return
+
+    def analyze_overview(self, audio_source, duration, point_count, **kwargs):
+        """ Run `analyze_overview` until it finishes or the job is
+        cancelled """
+        if self.cancelled:
+            return
+        for point in analyze_overview(audio_source, duration, point_count,
+                                      cancel_event=self._cancel_event, **kwargs):
+            if self.cancelled:
+                return
+            yield point
+
+    def analyze_range(self, audio_source, start, end, **kwargs):
+        """ Run `analyze_range`, returning None if the job is cancelled """
+        if self.cancelled:
+            return None
+        page = analyze_range(audio_source, start, end,
+                             cancel_event=self._cancel_event, **kwargs)
+        return None if self.cancelled else page
+
+
+def encode_spectrum(spectrum, spectrum_format):
+    """ Convert float32 FFT magnitudes to the given format (one of
+    SPECTRUM_FORMATS). 'float32' spectra are returned unchanged. """
+    if spectrum_format == 'float32':
+        return spectrum
+    if spectrum_format == 'float16':
+        return spectrum.astype(np.float16)
+    if spectrum_format == 'uint8':
+        with np.errstate(divide='ignore'):
+            decibels = 20 * np.log10(spectrum)
+        return np.clip(
+            np.round((decibels - SPECTRUM_DB_FLOOR) * (255 / -SPECTRUM_DB_FLOOR)),
+            0, 255).astype(np.uint8)
+    raise ValueError("Unknown spectrum format: {}".format(spectrum_format))
+
+
+def decode_spectrum(spectrum):
+    """ Convert a spectrum in any of SPECTRUM_FORMATS to float32 FFT
+    magnitudes """
+    if spectrum.dtype == np.uint8:
+        return UINT8_SPECTRUM_MAGNITUDES[spectrum]
+    return spectrum.astype(np.float32, copy=False)
+
+
+def encode_envelope(peak, rms):
+    """ Combine peak and RMS amplitudes from `analyze` pages into a compact
+    envelope: a uint8 ndarray of shape (hops, 2) holding the peak and RMS
+    amplitudes scaled from 0..1 to 0..255. Peaks are rounded up so that no
+    sound is shown as silence. """
+    envelope = np.empty((len(peak), 2), dtype=np.uint8)
+    envelope[:, 0] = np.clip(np.ceil(peak * 255), 0, 255)
+    envelope[:, 1] = np.clip(np.round(rms * 255), 0, 255)
+    return envelope
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import os.path
+
+import numpy as np
+from kivy import Logger
+
+
+_ENVELOPE_SUFFIX = '.envelope.npy'
+_SEEK_INDEX_SUFFIX = '.seekindex.npy'
+_ANALYSIS_SUFFIX = '.analysis.npz'
+_SPECTRUM_SUFFIX = '.spectrum.npy'
+
+# Total size of the cached spectra, beyond which the least recently used
+# are deleted
+_MAX_SPECTRUM_BYTES = 512 * 1024 * 1024
+
+
+class AnalysisCache(object):
+    """ Stores the results of analyzing audio files in a directory, so that
+    they are available straight away when a file is opened again. Entries are
+    identified by the file's absolute path, size and modification time, so
+    an entry is no longer found once its file has changed.
+
+    Parameters
+    ----------
+    directory : str
+        directory to store the cache in (created if it doesn't exist)
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def entry_path(self, file_path, suffix):
+        """ Return the path of the cache entry for `file_path` whose name ends
+        with `suffix`, or None if the file can't be accessed """
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            Logger.warning("Could not access file to cache its analysis: " + str(e))
+            return None
+        key = u'{}\n{}\n{}'.format(os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+        return os.path.join(self._directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest() + suffix)
+
+    def load_envelope(self, file_path):
+        """ Return the envelope (see analysis.encode_envelope) saved for
+        `file_path`, or None if there isn't one """
+        return self._load_array(file_path, _ENVELOPE_SUFFIX)
+
+    def save_envelope(self, file_path, envelope):
+        """ Save the envelope of `file_path` """
+        self._save_array(file_path, _ENVELOPE_SUFFIX, envelope)
+
+    def load_seek_index(self, file_path):
+        """ Return the seek index (see AudioDecoder.get_seek_index) saved
+        for `file_path`, or None if there isn't one """
+        return self._load_array(file_path, _SEEK_INDEX_SUFFIX)
+
+    def save_seek_index(self, file_path, seek_index):
+        """ Save the seek index of `file_path` """
+        self._save_array(file_path, _SEEK_INDEX_SUFFIX, seek_index)
+
+    def load_analysis(self, file_path):
+        """ Return the (pitch, spectrum, sample rate) saved for `file_path` by
+        an AnalysisWriter, or None if there isn't one. The uint8 spectrum
+        (row=time, col=bin) is memory-mapped read-only from the cache. """
+        analysis_path = self.entry_path(file_path, _ANALYSIS_SUFFIX)
+        spectrum_path = self.entry_path(file_path, _SPECTRUM_SUFFIX)
+        if analysis_path is None or not os.path.isfile(analysis_path):
+            return None
+        try:
+            with np.load(analysis_path) as analysis:
+                pitch = analysis['pitch']
+                samplerate = int(analysis['samplerate'])
+            spectrum = np.load(spectrum_path, mmap_mode='r')
+            # Mark the spectrum as recently used
+            os.utime(spectrum_path, None)
+        except (IOError, OSError, ValueError) as e:
+            Logger.warning("Could not load cached analysis: " + str(e))
+            return None
+        if len(spectrum) != len(pitch):
+            return None
+        return pitch, spectrum, samplerate
+
+    def analysis_writer(self, file_path, data_length, spectrum_size, samplerate):
+        """ Return an AnalysisWriter that saves the analysis of `file_path`,
+        `data_length` hops with spectra of `spectrum_size` bins of audio at
+        `samplerate`, or None if the entry can't be created """
+        spectrum_path = self.entry_path(file_path, _SPECTRUM_SUFFIX)
+        if spectrum_path is None or data_length <= 0:
+            return None
+        try:
+            return AnalysisWriter(self, file_path, spectrum_path, data_length, spectrum_size,
+                                  samplerate)
+        except (IOError, OSError, ValueError) as e:
+            Logger.warning("Could not save analysis to cache: " + str(e))
+            return None
+
+    def _prune_spectra(self):
+        """ Delete the least recently used spectra (and their pitches) while
+        the spectra take more than _MAX_SPECTRUM_BYTES """
+        entries = []
+        for name in os.listdir(self._directory):
+            if name.endswith(_SPECTRUM_SUFFIX):
+                path = os.path.join(self._directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= _MAX_SPECTRUM_BYTES:
+                break
+            for entry_path in (path, path[:-len(_SPECTRUM_SUFFIX)] + _ANALYSIS_SUFFIX):
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def _load_array(self, file_path, suffix):
+        path = self.entry_path(file_path, suffix)
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            return np.load(path)
+        except (IOError, ValueError) as e:
+            Logger.warning("Could not load cached analysis: " + str(e))
+            return None
+
+    def _save_array(self, file_path, suffix, array):
+        self._save(file_path, suffix, lambda f: np.save(f, array))
+
+    def _save(self, file_path, suffix, write):
+        """ Save an entry, written to a file object by `write` """
+        path = self.entry_path(file_path, suffix)
+        if path is None:
+            return
+        # Write to a temporary file first so that a partially written entry
+        # is never loaded
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                write(f)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError) as e:
+            Logger.warning("Could not save analysis to cache: " + str(e))
+
+
+class AnalysisWriter(object):
+    """ Saves the pitch and spectrum of a file to an AnalysisCache a page at
+    a time as the file is analyzed, writing the spectrum straight to disk
+    rather than keeping it in memory. Nothing is added to the cache until
+    `commit` is called.
+    """
+
+    def __init__(self, cache, file_path, spectrum_path, data_length, spectrum_size,
+                 samplerate):
+        self._cache = cache
+        self._file_path = file_path
+        self._samplerate = samplerate
+        self._spectrum_path = spectrum_path
+        self._temp_path = spectrum_path + '.tmp'
+        self._pitch = np.zeros(data_length, dtype=np.float32)
+        self._spectrum = np.lib.format.open_memmap(
+            self._temp_path, mode='w+', dtype=np.uint8, shape=(data_length, spectrum_size))
+        self._length = 0
+
+    def add_data(self, pitch, spectrum):
+        """ Append a page of pitches and uint8 spectra """
+        start = self._length
+        end = min(start + len(pitch), len(self._pitch))
+        self._pitch[start:end] = pitch[:end - start]
+        self._spectrum[start:end] = spectrum[:end - start]
+        self._length = end
+
+    def commit(self):
+        """ Add the analysis to the cache """
+        self._close()
+        try:
+            if os.path.exists(self._spectrum_path):
+                os.remove(self._spectrum_path)
+            os.rename(self._temp_path, self._spectrum_path)
+        except OSError as e:
+            Logger.warning("Could not save analysis to cache: " + str(e))
+            return
+        # The pitch is saved last, as it marks the entry as complete
+        self._cache._save(self._file_path, _ANALYSIS_SUFFIX, lambda f: np.savez(
+            f, pitch=self._pitch, samplerate=self._samplerate))
+        self._cache._prune_spectra()
+
+    def discard(self):
+        """ Delete the data written so far """
+        self._close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+    def _close(self):
+        if self._spectrum is not None:
+            self._spectrum.flush()
+            self._spectrum = None
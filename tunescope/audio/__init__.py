@@ -1,5 +1,7 @@
-from .audiometadata import AudioMetadata
-from .audiodecoder import AudioDecoder
+from .audiometadata import AudioMetadata, MetadataReader, read_metadata
+from .audiodecoder import AudioDecoder, DecoderPool, decoder_pool
+from .pcmdecoder import PCMDecoder, open_decoder
+from .shareddecoder import SharedDecoder
 from .buffering import DecoderBuffer
 from .looper import Looper
 from .timestretcher import TimeStretcher
@@ -10,6 +10,20 @@
 #define BUFFER_INITIAL_CAPACITY 64
 #define MAX_ERROR_MESSAGE_LENGTH 200
 
+// Seconds decoded before the target of a seek that uses the seek index, so
+// that the decoder has settled (e.g. filled the MP3 bit reservoir) by then
+#define SEEK_PREROLL 0.5
+
+// Maximum duration of decoded audio held between the decoder and the
+// converter, in seconds
+#define QUEUE_SECONDS 0.5
+
+// Maximum number of threads used by a decoder that can use several
+#define MAX_DECODER_THREADS 4
+
+// Properties through which decoders are given a number of threads
+static const char *DECODER_THREADS_PROPERTIES[] = {"max-threads", "n-threads", "threads", NULL};
+
 
 // A buffer containing audio samples in 32-bit float format
 typedef struct {
@@ -23,16 +37,54 @@ typedef struct {
 typedef struct {
     int channels;
     int samplerate;
+    double duration;  // In seconds, or 0 if unknown
+    char *title;      // Tags, or NULL if not found
+    char *artist;
+    char *album;
 } AudioDecoderMetadata;
 
 
-// A handle for a decoding pipeline for an individual file.
+// An entry in the seek index: a compressed frame, as output by the parser
+typedef struct {
+    double time;    // Seconds from the start of the stream
+    gint64 offset;  // Byte offset of the frame in the stream
+} AudioDecoderSeekPoint;
+
+
+// Progress of a seek, as seen by the parser's output
+typedef enum {
+    SEEK_NONE,              // Frames are recorded in the seek index
+    SEEK_FAST_STARTED,      // A seek using the index has been started
+    SEEK_FAST_FLUSHED,      // Its flush is done, and its first frame is awaited
+    SEEK_FAST_LANDED,       // Its first frame has been output
+    SEEK_ACCURATE_STARTED,  // An accurate seek has been started
+} SeekState;
+
+
+// A handle for a decoding pipeline. A pipeline decodes one file at a time,
+// but can be reset and reused for another file in the same output format.
 // Each instance of AudioDecoder has an opaque pointer to one of these.
 typedef struct {
-    GstElement *pipeline, *source, *decoder, *converter, *appsink;
+    GstElement *pipeline, *source, *decoder, *queue, *converter, *resampler, *appsink;
     AudioDecoderBuffer buffer;
     AudioDecoderMetadata metadata;
+    int channels;    // Requested number of channels, or 0 for the file's own
+    int samplerate;  // Requested sample rate, or 0 for the file's own
     char *error;
+
+    // The seek index maps the byte offsets of the frames output by the
+    // parser to their times. It is recorded as the file is decoded (or set
+    // from a previous decode), and lets a fast seek, which may land at an
+    // estimated time in a VBR stream, find out exactly where it landed.
+    // It is accessed by the streaming thread, under seek_lock.
+    GMutex seek_lock;
+    GArray *seek_index;     // AudioDecoderSeekPoints, ordered by time and offset
+    int seek_index_usable;  // False if the frames' offsets may change between decodes
+    SeekState seek_state;   // Frames aren't recorded while a seek is in progress
+    gint64 landing_offset;  // Offset and time of the first frame after a fast seek
+    GstClockTime landing_time;
+    double time_offset;     // True time minus pipeline time, after a fast seek
+    double skip_until;      // Time up to which decoded samples are dropped, or -1
 } AudioDecoderHandle;
 
 
@@ -50,13 +102,134 @@ static void set_error(AudioDecoderHandle *handle, char *error)
 }
 
 
-// Links the decoder to the converter when the audio source pad appears on the decoder
+// Forget the metadata of the previous file
+static void clear_metadata(AudioDecoderMetadata *metadata)
+{
+    metadata->channels = 0;
+    metadata->samplerate = 0;
+    metadata->duration = 0;
+    g_free(metadata->title);
+    g_free(metadata->artist);
+    g_free(metadata->album);
+    metadata->title = NULL;
+    metadata->artist = NULL;
+    metadata->album = NULL;
+}
+
+
+// Keep the first value of the given tag found in the list
+static void read_tag(GstTagList *tags, const gchar *tag, char **value)
+{
+    if (*value == NULL) {
+        gst_tag_list_get_string(tags, tag, value);
+    }
+}
+
+
+// Watches the frames output by the parser, recording them in the seek index
+// and noting where a seek using the index has landed
+static GstPadProbeReturn on_parser_output(GstPad *pad, GstPadProbeInfo *info, gpointer data)
+{
+    AudioDecoderHandle *handle = (AudioDecoderHandle *) data;
+
+    g_mutex_lock(&handle->seek_lock);
+    if (info->type & GST_PAD_PROBE_TYPE_EVENT_FLUSH) {
+        if (GST_EVENT_TYPE(GST_PAD_PROBE_INFO_EVENT(info)) == GST_EVENT_FLUSH_STOP) {
+            if (handle->seek_state == SEEK_FAST_STARTED) {
+                handle->seek_state = SEEK_FAST_FLUSHED;
+            } else if (handle->seek_state == SEEK_ACCURATE_STARTED) {
+                handle->seek_state = SEEK_NONE;
+            }
+        }
+    } else if (info->type & GST_PAD_PROBE_TYPE_BUFFER) {
+        GstBuffer *buffer = GST_PAD_PROBE_INFO_BUFFER(info);
+        if (GST_BUFFER_PTS_IS_VALID(buffer) && GST_BUFFER_OFFSET_IS_VALID(buffer)) {
+            if (handle->seek_state == SEEK_FAST_FLUSHED) {
+                handle->seek_state = SEEK_FAST_LANDED;
+                handle->landing_offset = GST_BUFFER_OFFSET(buffer);
+                handle->landing_time = GST_BUFFER_PTS(buffer);
+            } else if (handle->seek_state == SEEK_NONE) {
+                AudioDecoderSeekPoint point;
+                point.time = ((double) GST_BUFFER_PTS(buffer)) / GST_SECOND + handle->time_offset;
+                point.offset = GST_BUFFER_OFFSET(buffer);
+                guint length = handle->seek_index->len;
+                AudioDecoderSeekPoint *last = length > 0
+                    ? &g_array_index(handle->seek_index, AudioDecoderSeekPoint, length - 1)
+                    : NULL;
+                if (last == NULL || (point.time > last->time && point.offset > last->offset)) {
+                    g_array_append_val(handle->seek_index, point);
+                }
+            }
+        }
+    }
+    g_mutex_unlock(&handle->seek_lock);
+
+    return GST_PAD_PROBE_OK;
+}
+
+
+// Let a decoder that can decode with several threads use as many as are
+// useful, if it doesn't by default
+static void configure_decoder_threads(GstElement *element)
+{
+    guint threads = MIN(g_get_num_processors(), MAX_DECODER_THREADS);
+    GObjectClass *element_class = G_OBJECT_GET_CLASS(element);
+    for (int i = 0; DECODER_THREADS_PROPERTIES[i] != NULL; i++) {
+        GParamSpec *spec = g_object_class_find_property(element_class, DECODER_THREADS_PROPERTIES[i]);
+        if (spec == NULL || !(spec->flags & G_PARAM_WRITABLE)) {
+            continue;
+        }
+        if (G_PARAM_SPEC_VALUE_TYPE(spec) == G_TYPE_INT) {
+            GParamSpecInt *int_spec = G_PARAM_SPEC_INT(spec);
+            g_object_set(element, spec->name,
+                         CLAMP((gint) threads, int_spec->minimum, int_spec->maximum), NULL);
+        } else if (G_PARAM_SPEC_VALUE_TYPE(spec) == G_TYPE_UINT) {
+            GParamSpecUInt *uint_spec = G_PARAM_SPEC_UINT(spec);
+            g_object_set(element, spec->name,
+                         CLAMP(threads, uint_spec->minimum, uint_spec->maximum), NULL);
+        }
+        return;
+    }
+}
+
+
+// Watches the elements that the decoder adds for the file
+static void on_element_added(GstBin *bin, GstElement *element, gpointer data)
+{
+    AudioDecoderHandle *handle = (AudioDecoderHandle *) data;
+    const gchar *klass = gst_element_get_metadata(element, GST_ELEMENT_METADATA_KLASS);
+    if (klass == NULL) {
+        return;
+    }
+
+    if (strstr(klass, "Decoder") && strstr(klass, "Audio")) {
+        configure_decoder_threads(element);
+    }
+
+    // The offsets of frames from a container (other than tags) are not
+    // necessarily the same after a seek
+    if (strstr(klass, "Demuxer") && !strstr(klass, "Metadata")) {
+        handle->seek_index_usable = FALSE;
+    }
+
+    if (strstr(klass, "Parser") && strstr(klass, "Audio")) {
+        GstPad *pad = gst_element_get_static_pad(element, "src");
+        if (pad != NULL) {
+            gst_pad_add_probe(pad, GST_PAD_PROBE_TYPE_BUFFER | GST_PAD_PROBE_TYPE_EVENT_FLUSH,
+                              on_parser_output, handle, NULL);
+            gst_object_unref(pad);
+        }
+    }
+}
+
+
+// Links the decoder to the queue when the audio source pad appears on the decoder
 static void on_pad_added(GstElement *element, GstPad *pad, gpointer data)
 {
     AudioDecoderHandle *handle = (AudioDecoderHandle *) data;
 
     // Only link once
-    GstPad *sinkpad = gst_element_get_static_pad(handle->converter, "sink");
+    GstPad *sinkpad = gst_element_get_static_pad(handle->queue, "sink");
     if (GST_PAD_IS_LINKED (sinkpad)) {
         g_object_unref (sinkpad);
         return;
@@ -89,14 +262,21 @@ static void on_pad_added(GstElement *element, GstPad *pad, gpointer data)
 }
 
 
-// Create a new decoding pipeline for the given file
-// and return a handle to it
-AudioDecoderHandle *audiodecoder_gst_new(char *filename)
+// Create a new decoding pipeline, with no file, and return a handle to it.
+// If `channels` or `samplerate` is nonzero, the audio is converted to that
+// number of channels or resampled to that rate as it is decoded.
+// Building the pipeline loads the plugins it needs, so an idle pipeline can
+// be created ahead of time to open a file faster later.
+AudioDecoderHandle *audiodecoder_gst_create(int channels, int samplerate)
 {
     AudioDecoderHandle *handle = (AudioDecoderHandle *) g_malloc0(sizeof(AudioDecoderHandle));
-    handle->metadata.channels = 0;
-    handle->metadata.samplerate = 0;
+    clear_metadata(&handle->metadata);
+    handle->channels = channels;
+    handle->samplerate = samplerate;
     handle->error = NULL;
+    g_mutex_init(&handle->seek_lock);
+    handle->seek_index = g_array_new(FALSE, FALSE, sizeof(AudioDecoderSeekPoint));
+    handle->skip_until = -1;
 
     // Initialize output buffer
     handle->buffer.samples = g_malloc0(BUFFER_INITIAL_CAPACITY * sizeof(float));
@@ -107,51 +287,94 @@ AudioDecoderHandle *audiodecoder_gst_new(char *filename)
     handle->pipeline = gst_pipeline_new("decoder-pipeline");
     handle->source = gst_element_factory_make("filesrc", "source");
     handle->decoder = gst_element_factory_make("decodebin", "decoder");
+    handle->queue = gst_element_factory_make("queue", "queue");
     handle->converter = gst_element_factory_make("audioconvert", "converter");
+    handle->resampler = gst_element_factory_make("audioresample", "resampler");
     handle->appsink = gst_element_factory_make("appsink", "appsink");
-    if (!handle->pipeline || !handle->source || !handle->decoder || !handle->converter || !handle->appsink) {
+    if (!handle->pipeline || !handle->source || !handle->decoder || !handle->queue
+            || !handle->converter || !handle->resampler || !handle->appsink) {
         set_error(handle, "Could not create GStreamer pipeline");
         return handle;
     }
 
+    // The queue lets the file be decoded in one thread while the audio is
+    // converted and resampled in another
+    g_object_set(G_OBJECT(handle->queue),
+                 "max-size-buffers", 0,
+                 "max-size-bytes", 0,
+                 "max-size-time", (guint64) (QUEUE_SECONDS * GST_SECOND),
+                 NULL);
+
     // Set up the appsink to accept only 32-bit float audio
-    // with minimal buffering
+    // (in the requested format, if any) with minimal buffering
     GstCaps *caps = gst_caps_new_simple(
                 "audio/x-raw",
                 "format", G_TYPE_STRING, GST_AUDIO_NE(F32),
-                "channels", GST_TYPE_INT_RANGE, 1, 16,
-                "rate", GST_TYPE_INT_RANGE, 8000, 96000,
+                "layout", G_TYPE_STRING, "interleaved",
                 NULL);
+    if (channels > 0) {
+        gst_caps_set_simple(caps, "channels", G_TYPE_INT, channels, NULL);
+    } else {
+        gst_caps_set_simple(caps, "channels", GST_TYPE_INT_RANGE, 1, 16, NULL);
+    }
+    if (samplerate > 0) {
+        gst_caps_set_simple(caps, "rate", G_TYPE_INT, samplerate, NULL);
+    } else {
+        gst_caps_set_simple(caps, "rate", GST_TYPE_INT_RANGE, 8000, 96000, NULL);
+    }
     gst_app_sink_set_caps(GST_APP_SINK(handle->appsink), caps);
+    gst_caps_unref(caps);
     gst_app_sink_set_max_buffers(GST_APP_SINK(handle->appsink), 1);
 
     // Prevents hang that sometimes occurs when setting pipeline state to NULL
     gst_app_sink_set_wait_on_eos(GST_APP_SINK(handle->appsink), FALSE);
 
-    // Set file source
-    g_object_set(G_OBJECT(handle->source), "location", filename, NULL);
-
-    // Add message handler
-    // FIXME: Need to implement bus_call
-    // GstBus *bus = gst_pipeline_get_bus(GST_PIPELINE(handle->pipeline));
-    // int bus_watch_id = gst_bus_add_watch(bus, bus_call, glib_main_loop);
-    // gst_object_unref(bus);
-
     // Add elements to pipeline
     gst_bin_add_many(GST_BIN(handle->pipeline),
             handle->source,
             handle->decoder,
+            handle->queue,
             handle->converter,
+            handle->resampler,
             handle->appsink,
             NULL);
 
-    // Link elements
+    // Link elements. The decoder is linked to the queue when its audio pad
+    // appears, each time a file is opened.
     gst_element_link(handle->source, handle->decoder);
-    gst_element_link(handle->converter, handle->appsink);
+    gst_element_link_many(handle->queue, handle->converter, handle->resampler,
+                          handle->appsink, NULL);
     g_signal_connect(handle->decoder, "pad-added", G_CALLBACK(on_pad_added), handle);
+    g_signal_connect(handle->decoder, "element-added", G_CALLBACK(on_element_added), handle);
 
-    // Start the pipeline
     gst_pipeline_use_clock(GST_PIPELINE(handle->pipeline), NULL);  // Make pipeline run as fast as possible
+    gst_element_set_state(handle->pipeline, GST_STATE_READY);
+
+    return handle;
+}
+
+
+// Start decoding the given file with a pipeline that is new or has been
+// reset. On failure, the error is set (see audiodecoder_gst_get_error).
+// The duration and tags of the file are read while the pipeline prerolls,
+// so the file doesn't need to be probed again for them.
+void audiodecoder_gst_open(AudioDecoderHandle *handle, char *filename)
+{
+    clear_metadata(&handle->metadata);
+    handle->buffer.size = 0;
+
+    g_mutex_lock(&handle->seek_lock);
+    g_array_set_size(handle->seek_index, 0);
+    handle->seek_index_usable = TRUE;
+    handle->seek_state = SEEK_NONE;
+    handle->time_offset = 0;
+    handle->skip_until = -1;
+    g_mutex_unlock(&handle->seek_lock);
+
+    // Set file source
+    g_object_set(G_OBJECT(handle->source), "location", filename, NULL);
+
+    // Start the pipeline
     gst_element_set_state(handle->pipeline, GST_STATE_PLAYING);
 
     // Wait for the pipeline to enter PLAYING state, or error
@@ -161,10 +384,12 @@ AudioDecoderHandle *audiodecoder_gst_new(char *filename)
     GstState new_state;
     GError *err = NULL;
     gchar *dbg_info = NULL;
+    GstTagList *tags = NULL;
     while (!pipeline_ready && !handle->error) {
         msg = gst_bus_timed_pop(bus, GST_SECOND);
         if (msg == NULL) {
             set_error(handle, "GStreamer bus timeout");
+            break;
         }
         switch (GST_MESSAGE_TYPE(msg)) {
 
@@ -183,15 +408,80 @@ AudioDecoderHandle *audiodecoder_gst_new(char *filename)
                 g_free(dbg_info);
                 break;
 
+            case GST_MESSAGE_TAG:
+                // Tags reach the appsink, which posts them, before the
+                // first buffer, so they are all seen during preroll
+                gst_message_parse_tag(msg, &tags);
+                read_tag(tags, GST_TAG_TITLE, &handle->metadata.title);
+                read_tag(tags, GST_TAG_ARTIST, &handle->metadata.artist);
+                read_tag(tags, GST_TAG_ALBUM, &handle->metadata.album);
+                gst_tag_list_unref(tags);
+                break;
+
             default:
                 break;
         }
+        gst_message_unref(msg);
+    }
+    gst_object_unref(bus);
+
+    gint64 duration_nanoseconds;
+    if (pipeline_ready && gst_element_query_duration(
+                handle->pipeline, GST_FORMAT_TIME, &duration_nanoseconds)) {
+        handle->metadata.duration = ((double) duration_nanoseconds) / GST_SECOND;
     }
 
+    // Report the format of the audio as it is read, rather than as it is
+    // stored in the file
+    if (handle->channels > 0) {
+        handle->metadata.channels = handle->channels;
+    }
+    if (handle->samplerate > 0) {
+        handle->metadata.samplerate = handle->samplerate;
+    }
+}
+
+
+// Create a new decoding pipeline for the given file
+// and return a handle to it.
+// If `channels` or `samplerate` is nonzero, the audio is converted to that
+// number of channels or resampled to that rate as it is decoded.
+AudioDecoderHandle *audiodecoder_gst_new(char *filename, int channels, int samplerate)
+{
+    AudioDecoderHandle *handle = audiodecoder_gst_create(channels, samplerate);
+    if (handle->error == NULL) {
+        audiodecoder_gst_open(handle, filename);
+    }
     return handle;
 }
 
 
+// Stop decoding and release the file, so that the pipeline can be used for
+// another file (see audiodecoder_gst_open).
+// Return 1 on success, 0 if the pipeline can't be reused.
+int audiodecoder_gst_reset(AudioDecoderHandle *handle)
+{
+    if (handle->error != NULL) {
+        return 0;
+    }
+
+    // Going to READY closes the file and removes the decoder's pads, which
+    // unlinks it from the queue
+    if (gst_element_set_state(handle->pipeline, GST_STATE_READY) == GST_STATE_CHANGE_FAILURE) {
+        return 0;
+    }
+
+    // Discard any messages left from decoding the previous file, so they
+    // aren't mistaken for messages about the next one
+    GstBus *bus = gst_pipeline_get_bus(GST_PIPELINE(handle->pipeline));
+    gst_bus_set_flushing(bus, TRUE);
+    gst_bus_set_flushing(bus, FALSE);
+    gst_object_unref(bus);
+
+    return 1;
+}
+
+
 char *audiodecoder_gst_get_error(AudioDecoderHandle *handle)
 {
     return handle->error;
@@ -204,28 +494,49 @@ char *audiodecoder_gst_get_error(AudioDecoderHandle *handle)
 // Treat the returned buffer as read-only.
 AudioDecoderBuffer *audiodecoder_gst_read(AudioDecoderHandle *handle)
 {
-    GstSample *sample = gst_app_sink_pull_sample(GST_APP_SINK(handle->appsink));
-    if (sample == NULL) {
-        // No more audio to be decoded: send an empty buffer downstream
-        handle->buffer.size = handle->buffer.capacity;
-        memset(handle->buffer.samples, 0, handle->buffer.size * sizeof(float));
-        return &(handle->buffer);
-    }
-
-    GstBuffer* gst_buffer = gst_sample_get_buffer(sample);
-	GstMapInfo map;
-    gst_buffer_map(gst_buffer, &map, GST_MAP_READ);
+    GstSample *sample;
+    GstBuffer *gst_buffer;
+    GstMapInfo map;
+    int num_samples;
+    int skip = 0;  // Samples dropped from the start of the buffer
+    while (TRUE) {
+        sample = gst_app_sink_pull_sample(GST_APP_SINK(handle->appsink));
+        if (sample == NULL) {
+            // No more audio to be decoded: send an empty buffer downstream
+            handle->buffer.size = handle->buffer.capacity;
+            memset(handle->buffer.samples, 0, handle->buffer.size * sizeof(float));
+            return &(handle->buffer);
+        }
+        gst_buffer = gst_sample_get_buffer(sample);
+        gst_buffer_map(gst_buffer, &map, GST_MAP_READ);
+        num_samples = map.size / sizeof(float);
 
-    int num_samples = map.size / sizeof(float);
+        // After a seek that used the seek index, drop the samples before the
+        // target of the seek
+        if (handle->skip_until < 0 || !GST_BUFFER_PTS_IS_VALID(gst_buffer)) {
+            break;
+        }
+        double time = ((double) GST_BUFFER_PTS(gst_buffer)) / GST_SECOND + handle->time_offset;
+        skip = (int) ((handle->skip_until - time) * handle->metadata.samplerate + 0.5)
+               * handle->metadata.channels;
+        if (skip < num_samples) {
+            handle->skip_until = -1;
+            skip = skip > 0 ? skip : 0;
+            break;
+        }
+        gst_buffer_unmap(gst_buffer, &map);
+        gst_sample_unref(sample);
+    }
+    num_samples -= skip;
 
     // Resize output buffer if needed
     if (handle->buffer.capacity < num_samples) {
-        handle->buffer.samples = g_realloc(handle->buffer.samples, map.size);
+        handle->buffer.samples = g_realloc(handle->buffer.samples, num_samples * sizeof(float));
         handle->buffer.capacity = num_samples;
     }
 
     // Copy samples to output buffer
-    memmove(handle->buffer.samples, map.data, map.size);
+    memmove(handle->buffer.samples, ((float *) map.data) + skip, num_samples * sizeof(float));
     handle->buffer.size = num_samples;
 
     gst_buffer_unmap(gst_buffer, &map);
@@ -241,22 +552,11 @@ AudioDecoderMetadata *audiodecoder_gst_get_metadata(AudioDecoderHandle *handle)
 }
 
 
-// Seek to the given position in seconds.
+// Wait until a seek has completed.
 // Return 1 on success, 0 on failure.
-int audiodecoder_gst_seek(AudioDecoderHandle *handle, double position)
+static int wait_for_seek(AudioDecoderHandle *handle)
 {
-    int success = gst_element_seek_simple(
-            handle->pipeline,
-            GST_FORMAT_TIME,
-            GST_SEEK_FLAG_FLUSH | GST_SEEK_FLAG_ACCURATE,
-            //GST_SEEK_FLAG_FLUSH | GST_SEEK_FLAG_KEY_UNIT,
-            position * GST_SECOND);
-    if (!success) {
-        g_printerr("gst_element_seek_simple() failed\n");
-        return 0;
-    }
-
-    // Wait until the seek has completed
+    int success;
     GstState state;
     GstStateChangeReturn state_change_return = gst_element_get_state(
             handle->pipeline,
@@ -289,14 +589,164 @@ int audiodecoder_gst_seek(AudioDecoderHandle *handle, double position)
 }
 
 
+// Find the seek point at the given offset, returning 0 if there isn't one
+static int find_seek_point(GArray *seek_index, gint64 offset, AudioDecoderSeekPoint *point)
+{
+    guint low = 0, high = seek_index->len;
+    while (low < high) {
+        guint middle = (low + high) / 2;
+        AudioDecoderSeekPoint *middle_point = &g_array_index(seek_index, AudioDecoderSeekPoint, middle);
+        if (middle_point->offset == offset) {
+            *point = *middle_point;
+            return 1;
+        }
+        if (middle_point->offset < offset) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return 0;
+}
+
+
+// Seek to the given position quickly, with a seek to the nearest frame that
+// is not necessarily accurate, using the seek index to find out the true
+// time of the frame it lands on. The samples before the position are then
+// dropped as they are read.
+// Return 1 on success, 0 if the seek index can't be used for this position
+// (in which case the position in the stream is undefined).
+static int seek_with_index(AudioDecoderHandle *handle, double position)
+{
+    g_mutex_lock(&handle->seek_lock);
+    guint length = handle->seek_index->len;
+    int usable = handle->seek_index_usable && length > 0
+        && position <= g_array_index(handle->seek_index, AudioDecoderSeekPoint, length - 1).time;
+    if (usable) {
+        handle->seek_state = SEEK_FAST_STARTED;
+    }
+    g_mutex_unlock(&handle->seek_lock);
+    if (!usable) {
+        return 0;
+    }
+
+    double start = position > SEEK_PREROLL ? position - SEEK_PREROLL : 0;
+    int success = gst_element_seek_simple(
+            handle->pipeline,
+            GST_FORMAT_TIME,
+            GST_SEEK_FLAG_FLUSH | GST_SEEK_FLAG_KEY_UNIT | GST_SEEK_FLAG_SNAP_BEFORE,
+            start * GST_SECOND)
+        && wait_for_seek(handle);
+
+    // The pipeline has prerolled, so the first frame after the seek has been
+    // output by the parser
+    AudioDecoderSeekPoint point;
+    g_mutex_lock(&handle->seek_lock);
+    success = success && handle->seek_state == SEEK_FAST_LANDED
+        && find_seek_point(handle->seek_index, handle->landing_offset, &point)
+        && point.time <= position;
+    if (success) {
+        handle->time_offset = point.time - ((double) handle->landing_time) / GST_SECOND;
+        handle->skip_until = position;
+        handle->seek_state = SEEK_NONE;
+    }
+    g_mutex_unlock(&handle->seek_lock);
+
+    return success;
+}
+
+
+// Seek to the given position in seconds.
+// Return 1 on success, 0 on failure.
+int audiodecoder_gst_seek(AudioDecoderHandle *handle, double position)
+{
+    handle->skip_until = -1;
+    if (seek_with_index(handle, position)) {
+        return 1;
+    }
+
+    // Without the seek index, GStreamer may have to decode or scan the
+    // stream from an earlier point to find the position. Frames aren't
+    // recorded until the seek has flushed the pipeline, because their times
+    // may be wrong until then.
+    g_mutex_lock(&handle->seek_lock);
+    handle->time_offset = 0;
+    handle->seek_state = SEEK_ACCURATE_STARTED;
+    g_mutex_unlock(&handle->seek_lock);
+    int success = gst_element_seek_simple(
+            handle->pipeline,
+            GST_FORMAT_TIME,
+            GST_SEEK_FLAG_FLUSH | GST_SEEK_FLAG_ACCURATE,
+            position * GST_SECOND);
+    if (!success) {
+        g_printerr("gst_element_seek_simple() failed\n");
+        g_mutex_lock(&handle->seek_lock);
+        handle->seek_state = SEEK_NONE;
+        g_mutex_unlock(&handle->seek_lock);
+        return 0;
+    }
+    return wait_for_seek(handle);
+}
+
+
 double audiodecoder_gst_get_position(AudioDecoderHandle *handle)
 {
+    if (handle->skip_until >= 0) {
+        // Nothing has been read since a seek using the seek index
+        return handle->skip_until;
+    }
     gint64 position_nanoseconds;
     if (!gst_element_query_position(handle->pipeline, GST_FORMAT_TIME, &position_nanoseconds)) {
         g_printerr("Could not query current position.\n");
         return 0;
     }
-    return ((double) position_nanoseconds) / GST_SECOND;
+    return ((double) position_nanoseconds) / GST_SECOND + handle->time_offset;
+}
+
+
+// Return the number of points in the seek index
+size_t audiodecoder_gst_get_seek_index_length(AudioDecoderHandle *handle)
+{
+    g_mutex_lock(&handle->seek_lock);
+    size_t length = handle->seek_index->len;
+    g_mutex_unlock(&handle->seek_lock);
+    return length;
+}
+
+
+// Copy up to `max_length` points of the seek index into the given arrays,
+// returning the number copied
+size_t audiodecoder_gst_copy_seek_index(AudioDecoderHandle *handle,
+                                        double *times, gint64 *offsets, size_t max_length)
+{
+    g_mutex_lock(&handle->seek_lock);
+    size_t length = MIN(handle->seek_index->len, max_length);
+    for (size_t i = 0; i < length; i++) {
+        AudioDecoderSeekPoint *point = &g_array_index(handle->seek_index, AudioDecoderSeekPoint, i);
+        times[i] = point->time;
+        offsets[i] = point->offset;
+    }
+    g_mutex_unlock(&handle->seek_lock);
+    return length;
+}
+
+
+// Replace the seek index with one recorded by another decoder of the same
+// file (see audiodecoder_gst_copy_seek_index), unless this decoder's own
+// index is longer. The points must be ordered by time and offset.
+void audiodecoder_gst_set_seek_index(AudioDecoderHandle *handle,
+                                     double *times, gint64 *offsets, size_t length)
+{
+    g_mutex_lock(&handle->seek_lock);
+    if (length > handle->seek_index->len) {
+        g_array_set_size(handle->seek_index, length);
+        for (size_t i = 0; i < length; i++) {
+            AudioDecoderSeekPoint *point = &g_array_index(handle->seek_index, AudioDecoderSeekPoint, i);
+            point->time = times[i];
+            point->offset = offsets[i];
+        }
+    }
+    g_mutex_unlock(&handle->seek_lock);
 }
 
 
@@ -314,6 +764,9 @@ void audiodecoder_gst_delete(AudioDecoderHandle *handle)
     gst_element_set_state(handle->pipeline, GST_STATE_NULL);
     g_object_unref(handle->pipeline);
     g_free(handle->buffer.samples);
+    clear_metadata(&handle->metadata);
+    g_array_free(handle->seek_index, TRUE);
+    g_mutex_clear(&handle->seek_lock);
     if (handle->error != NULL) {
         g_free(handle->error);
     }
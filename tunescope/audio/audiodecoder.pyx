@@ -1,4 +1,7 @@
 import os.path
+import threading
+# FIXME: Python 2 code
+import Queue
 
 import numpy as np
 cimport numpy as np
@@ -9,6 +12,8 @@ from tunescope.util import encode_file_path
 
 cdef extern from "audiodecoder-gst.c":
 
+    ctypedef long long gint64
+
     ctypedef struct AudioDecoderBuffer:
         size_t capacity
         size_t size
@@ -17,11 +22,17 @@ cdef extern from "audiodecoder-gst.c":
     ctypedef struct AudioDecoderMetadata:
         int channels
         int samplerate
+        double duration
+        char *title
+        char *artist
+        char *album
 
     ctypedef struct AudioDecoderHandle:
         pass
 
-    AudioDecoderHandle *audiodecoder_gst_new(char *filename)
+    AudioDecoderHandle *audiodecoder_gst_create(int channels, int samplerate)
+    void audiodecoder_gst_open(AudioDecoderHandle *handle, char *filename)
+    int audiodecoder_gst_reset(AudioDecoderHandle *handle)
     char *audiodecoder_gst_get_error(AudioDecoderHandle *handle)
     AudioDecoderBuffer *audiodecoder_gst_read(AudioDecoderHandle *handle)
     AudioDecoderMetadata *audiodecoder_gst_get_metadata(AudioDecoderHandle *handle)
@@ -29,26 +40,183 @@ cdef extern from "audiodecoder-gst.c":
     double audiodecoder_gst_get_position(AudioDecoderHandle *handle)
     int audiodecoder_gst_is_eos(AudioDecoderHandle *handle)
     void audiodecoder_gst_delete(AudioDecoderHandle *handle)
+    size_t audiodecoder_gst_get_seek_index_length(AudioDecoderHandle *handle)
+    size_t audiodecoder_gst_copy_seek_index(AudioDecoderHandle *handle,
+                                            double *times, gint64 *offsets, size_t max_length)
+    void audiodecoder_gst_set_seek_index(AudioDecoderHandle *handle,
+                                         double *times, gint64 *offsets, size_t length)
+
+
+# Maximum number of idle pipelines kept by the decoder pool
+_MAX_IDLE_PIPELINES = 4
+
+
+cdef class _Pipeline:
+    """ Owns an idle decoding pipeline in a DecoderPool """
+
+    cdef AudioDecoderHandle *handle
+
+    def __dealloc__(self):
+        if self.handle != NULL:
+            audiodecoder_gst_delete(self.handle)
+
+
+cdef class DecoderPool:
+    """
+    Keeps idle decoding pipelines for reuse. Building a pipeline and loading
+    its plugins is a large part of the time it takes to open a file, so
+    AudioDecoders take their pipelines from `decoder_pool` and return them to
+    it when they are freed, and `prewarm` can build one before it is needed.
+
+    Pipelines convert audio to a fixed format, so the pool keeps them by
+    (channels, samplerate), as passed to AudioDecoder. At most `max_idle`
+    pipelines are kept, the least recently used being deleted first.
+
+    Released pipelines are reset, and prewarmed ones built, by a worker
+    thread, as both block until GStreamer has changed the pipeline's state.
+    """
+
+    cdef object _idle  # List of (channels, samplerate, _Pipeline), oldest first
+    cdef object _lock
+    cdef int max_idle
+    cdef object _tasks  # Queue of (channels, samplerate, _Pipeline or None to build one)
+    cdef object _worker
+
+    def __cinit__(self, int max_idle):
+        self._idle = []
+        self._lock = threading.Lock()
+        self.max_idle = max_idle
+        self._tasks = Queue.Queue()
+        self._worker = None
+
+    cdef AudioDecoderHandle *acquire(self, int channels, int samplerate):
+        """ Take an idle pipeline of the given format from the pool, or create
+        one if there isn't one """
+        cdef _Pipeline pipeline
+        cdef AudioDecoderHandle *handle
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][:2] == (channels, samplerate):
+                    pipeline = self._idle.pop(i)[2]
+                    handle = pipeline.handle
+                    pipeline.handle = NULL
+                    return handle
+        audiobackend.initialize_if_not_initialized()
+        return audiodecoder_gst_create(channels, samplerate)
+
+    cdef release(self, AudioDecoderHandle *handle, int channels, int samplerate):
+        """ Have the worker thread reset the pipeline and return it to the
+        pool, or delete it if it can't be reused """
+        cdef _Pipeline pipeline = _Pipeline()
+        pipeline.handle = handle
+        self._submit((channels, samplerate, pipeline))
+
+    def prewarm(self, int channels=0, int samplerate=0):
+        """ Have the worker thread build an idle pipeline of the given format,
+        unless there is one already """
+        self._submit((channels, samplerate, None))
+
+    def wait(self):
+        """ Wait until the pipelines released and prewarmed so far have been
+        added to the pool (or deleted) """
+        self._tasks.join()
+
+    cdef _submit(self, task):
+        self._tasks.put(task)
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name='decoder-pool')
+                self._worker.daemon = True
+                self._worker.start()
+
+    def _work(self):
+        cdef int channels, samplerate
+        cdef _Pipeline pipeline
+        while True:
+            channels, samplerate, pipeline = self._tasks.get()
+            try:
+                if pipeline is None:
+                    with self._lock:
+                        if any(idle[:2] == (channels, samplerate) for idle in self._idle):
+                            continue
+                    pipeline = _Pipeline()
+                    pipeline.handle = self.acquire(channels, samplerate)
+                # A pipeline that can't be reset is deleted with `pipeline`
+                if audiodecoder_gst_reset(pipeline.handle):
+                    self._add_idle(channels, samplerate, pipeline)
+                pipeline = None
+            finally:
+                self._tasks.task_done()
+
+    cdef _add_idle(self, int channels, int samplerate, _Pipeline pipeline):
+        with self._lock:
+            self._idle.append((channels, samplerate, pipeline))
+            excess = self._idle[:-self.max_idle] if self.max_idle > 0 else self._idle[:]
+            del self._idle[:len(excess)]
+        del excess  # Delete the excess pipelines outside the lock
+
+    def clear(self):
+        """ Delete all idle pipelines, once those being released or
+        prewarmed have been added """
+        self.wait()
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        del idle
+
+    def __len__(self):
+        """ Return the number of idle pipelines """
+        return len(self._idle)
+
+
+cdef DecoderPool _decoder_pool = DecoderPool(_MAX_IDLE_PIPELINES)
+decoder_pool = _decoder_pool
 
 
 cdef class AudioDecoder:
     """
-    Decodes audio data and metadata from a file
+    Decodes audio data and metadata from a file.
+
+    The duration and tags (as found by AudioMetadata) are read while the file
+    is opened, without probing it separately. `duration` is 0 if the decoder
+    couldn't determine it, and missing tags are empty strings.
+
+    By default, audio is read with the file's own number of channels and
+    sample rate. If `channels` or `samplerate` is given, the audio is
+    downmixed/upmixed or resampled by GStreamer as it is decoded, and the
+    `channels` and `samplerate` properties report the converted format.
+
+    The decoding pipeline is taken from `decoder_pool`, and returned to it
+    when the decoder is freed.
+
+    As the file is decoded, a seek index of the times of the compressed
+    frames is recorded. Seeking within the part of the file covered by the
+    index is fast and accurate even in VBR streams, where GStreamer would
+    otherwise have to scan the stream for the position. The index can be
+    kept (see `get_seek_index`) and given to a later decoder of the same file.
     """
 
     cdef AudioDecoderHandle *_handle
     cdef AudioDecoderMetadata *_metadata;
+    cdef int _channels, _samplerate  # As requested, for returning the pipeline to the pool
 
-    def __cinit__(self, filename):
+    def __cinit__(self, filename, int channels=0, int samplerate=0):
         if not os.path.isfile(filename):
             raise IOError(u"No such file: '{}'".format(filename))
-        audiobackend.initialize_if_not_initialized()
-        
-        self._handle = audiodecoder_gst_new(encode_file_path(filename))
+        self._channels = channels
+        self._samplerate = samplerate
 
+        self._handle = _decoder_pool.acquire(channels, samplerate)
         cdef char *error = audiodecoder_gst_get_error(self._handle)
+        if not error:
+            audiodecoder_gst_open(self._handle, encode_file_path(filename))
+            error = audiodecoder_gst_get_error(self._handle)
         if error:
-            raise IOError(error)
+            # Not returned to the pool, as the pipeline may be broken
+            message = <bytes> error
+            audiodecoder_gst_delete(self._handle)
+            self._handle = NULL
+            raise IOError(message)
 
         self._metadata = audiodecoder_gst_get_metadata(self._handle)
 
@@ -80,6 +248,26 @@ cdef class AudioDecoder:
         Return True on success, False on failure. """
         return audiodecoder_gst_seek(self._handle, position)
 
+    def get_seek_index(self):
+        """ Return the seek index as an ndarray of (time, byte offset) rows """
+        cdef size_t length = audiodecoder_gst_get_seek_index_length(self._handle)
+        cdef np.ndarray[np.float64_t] times = np.empty(length, dtype=np.float64)
+        cdef np.ndarray[np.int64_t] offsets = np.empty(length, dtype=np.int64)
+        if length > 0:
+            length = audiodecoder_gst_copy_seek_index(
+                self._handle, &times[0], <gint64 *> &offsets[0], length)
+        return np.column_stack((times[:length], offsets[:length]))
+
+    def set_seek_index(self, seek_index):
+        """ Use a seek index returned by `get_seek_index` for the same file,
+        unless the index recorded so far is longer """
+        seek_index = np.asarray(seek_index, dtype=np.float64).reshape(-1, 2)
+        cdef np.ndarray[np.float64_t] times = np.ascontiguousarray(seek_index[:, 0])
+        cdef np.ndarray[np.int64_t] offsets = np.ascontiguousarray(seek_index[:, 1], dtype=np.int64)
+        if len(times) > 0:
+            audiodecoder_gst_set_seek_index(
+                self._handle, &times[0], <gint64 *> &offsets[0], len(times))
+
     @property
     def channels(self):
         return self._metadata.channels
@@ -88,11 +276,38 @@ cdef class AudioDecoder:
     def samplerate(self):
         return self._metadata.samplerate
 
+    @property
+    def duration(self):
+        """ The duration of the file in seconds """
+        return self._metadata.duration
+
+    @property
+    def title(self):
+        return _c_string_to_unicode(self._metadata.title)
+
+    @property
+    def artist(self):
+        return _c_string_to_unicode(self._metadata.artist)
+
+    @property
+    def album(self):
+        return _c_string_to_unicode(self._metadata.album)
+
     @property
     def position(self):
         """ The current position in seconds """
         return audiodecoder_gst_get_position(self._handle)
 
     def __dealloc__(self):
-        if self._handle != NULL:
-            audiodecoder_gst_delete(self._handle)
+        if self._handle == NULL:
+            return
+        if _decoder_pool is not None:
+            _decoder_pool.release(self._handle, self._channels, self._samplerate)
+        else:
+            audiodecoder_gst_delete(self._handle)  # At exit
+
+
+cdef unicode _c_string_to_unicode(char *string):
+    if string == NULL:
+        return u''
+    return string.decode('UTF-8')
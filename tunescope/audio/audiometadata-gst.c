@@ -16,41 +16,55 @@ typedef struct {
 } AudioMetadataStruct;
 
 
-AudioMetadataStruct *attempt_read(char *uri) {
-    AudioMetadataStruct *metadata = (AudioMetadataStruct *) g_malloc0(sizeof(AudioMetadataStruct));
-
+// Create a discoverer for reading the metadata of one file after another,
+// returning NULL in case of an error.
+// The caller should free it using audiometadata_gst_delete_discoverer().
+GstDiscoverer *audiometadata_gst_create_discoverer(void)
+{
     GError *error = NULL;
-
     GstDiscoverer *discoverer = gst_discoverer_new(TIMEOUT_SECONDS * GST_SECOND, &error);
     if (discoverer == NULL) {
         g_printerr("gst_discoverer_new() failed: %s\n", error->message);
         g_clear_error(&error);
-        return NULL;
     }
+    return discoverer;
+}
+
+
+void audiometadata_gst_delete_discoverer(GstDiscoverer *discoverer)
+{
+    g_object_unref(discoverer);
+}
+
+
+AudioMetadataStruct *attempt_read(GstDiscoverer *discoverer, char *uri) {
+    GError *error = NULL;
 
     GstDiscovererInfo *info = gst_discoverer_discover_uri(discoverer, uri, &error);
     if (info == NULL) {
         g_printerr("gst_discoverer_discover_uri() failed: %s\n", error->message);
         g_clear_error(&error);
-        g_object_unref(discoverer);
         return NULL;
     }
 
-    metadata->duration = ((double) gst_discoverer_info_get_duration(info)) / GST_SECOND;
-    if (metadata->duration <= 0) {
+    double duration = ((double) gst_discoverer_info_get_duration(info)) / GST_SECOND;
+    if (duration <= 0) {
         g_printerr("gst_discoverer_discover_uri() failed to get duration\n");
-        g_clear_error(&error);
-        g_object_unref(discoverer);
+        gst_discoverer_info_unref(info);
         return NULL;
     }
 
+    AudioMetadataStruct *metadata = (AudioMetadataStruct *) g_malloc0(sizeof(AudioMetadataStruct));
+    metadata->duration = duration;
+
     const GstTagList *tags = gst_discoverer_info_get_tags(info);
-    gst_tag_list_get_string(tags, "title", &(metadata->title));
-    gst_tag_list_get_string(tags, "artist", &(metadata->artist));
-    gst_tag_list_get_string(tags, "album", &(metadata->album));
+    if (tags != NULL) {
+        gst_tag_list_get_string(tags, "title", &(metadata->title));
+        gst_tag_list_get_string(tags, "artist", &(metadata->artist));
+        gst_tag_list_get_string(tags, "album", &(metadata->album));
+    }
 
     gst_discoverer_info_unref(info);
-    g_object_unref(discoverer);
 
     return metadata;
 }
@@ -65,7 +79,12 @@ AudioMetadataStruct *audiometadata_gst_read(char *uri)
     // GstDiscoverer sometimes reports 0 duration on the first try,
     // but returns a positive value on a subsequent attempt.
     for (int attempt = 0; attempt < MAX_ATTEMPTS; attempt++) {
-        metadata = attempt_read(uri);
+        GstDiscoverer *discoverer = audiometadata_gst_create_discoverer();
+        if (discoverer == NULL) {
+            return NULL;
+        }
+        metadata = attempt_read(discoverer, uri);
+        g_object_unref(discoverer);
         if (metadata) {
             return metadata;
         }
@@ -75,6 +94,22 @@ AudioMetadataStruct *audiometadata_gst_read(char *uri)
 }
 
 
+// Read metadata for the file at the given URI with an existing discoverer,
+// which saves setting one up for each file. A discoverer may only be used
+// by one thread at a time.
+AudioMetadataStruct *audiometadata_gst_read_with_discoverer(GstDiscoverer *discoverer, char *uri)
+{
+    AudioMetadataStruct *metadata;
+    for (int attempt = 0; attempt < MAX_ATTEMPTS; attempt++) {
+        metadata = attempt_read(discoverer, uri);
+        if (metadata) {
+            return metadata;
+        }
+    }
+    return NULL;
+}
+
+
 void audiometadata_gst_delete(AudioMetadataStruct *metadata)
 {
     g_free(metadata->title);
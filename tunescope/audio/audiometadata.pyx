@@ -1,4 +1,7 @@
 import os.path
+import threading
+# FIXME: Python 2 code
+import Queue
 
 # FIXME: Python 2 code
 from pathlib2 import Path
@@ -14,26 +17,69 @@ cdef extern from "audiometadata-gst.c":
         char *artist
         char *album
 
+    ctypedef struct GstDiscoverer:
+        pass
+
     AudioMetadataStruct *audiometadata_gst_read(char *filename)
+    GstDiscoverer *audiometadata_gst_create_discoverer()
+    void audiometadata_gst_delete_discoverer(GstDiscoverer *discoverer)
+    AudioMetadataStruct *audiometadata_gst_read_with_discoverer(
+        GstDiscoverer *discoverer, char *uri) nogil
     void audiometadata_gst_delete(AudioMetadataStruct *metadata)
 
 
+# Default number of threads used by read_metadata()
+_READ_METADATA_WORKERS = 4
+
+
+cdef class MetadataReader:
+    """ Reads the metadata of one file after another with the same
+    GstDiscoverer, which saves setting one up for each file. A MetadataReader
+    may only be used by one thread at a time. """
+
+    cdef GstDiscoverer *_discoverer
+
+    def __cinit__(self):
+        audiobackend.initialize_if_not_initialized()
+        self._discoverer = audiometadata_gst_create_discoverer()
+        if self._discoverer == NULL:
+            raise RuntimeError("Could not create GStreamer discoverer")
+
+    def read(self, filename):
+        """ Return the AudioMetadata of the given file """
+        return AudioMetadata(filename, self)
+
+    def __dealloc__(self):
+        if self._discoverer != NULL:
+            audiometadata_gst_delete_discoverer(self._discoverer)
+
+
 cdef class AudioMetadata:
-    """ Provides duration and basic tags data for the given audio file """
+    """ Provides duration and basic tags data for the given audio file.
+    If a MetadataReader is given, it is used to read the file. """
 
     cdef readonly double duration
     cdef readonly unicode title  # FIXME Python 2 code
     cdef readonly unicode artist
     cdef readonly unicode album
 
-    def __cinit__(self, filename):
+    def __cinit__(self, filename, MetadataReader reader=None):
         audiobackend.initialize_if_not_initialized()
 
-    def __init__(self, filename):
+    def __init__(self, filename, MetadataReader reader=None):
         if not os.path.isfile(filename):
             raise IOError(u"No such file: '{}'".format(filename))
 
-        metadata_struct = audiometadata_gst_read(Path(filename).as_uri())
+        uri = Path(filename).as_uri()
+        cdef char *c_uri = uri
+        cdef AudioMetadataStruct *metadata_struct
+        if reader is None:
+            metadata_struct = audiometadata_gst_read(c_uri)
+        else:
+            # Other threads may read metadata in the meantime
+            with nogil:
+                metadata_struct = audiometadata_gst_read_with_discoverer(
+                    reader._discoverer, c_uri)
 
         if metadata_struct == NULL:
             raise IOError(u"Error reading metadata from {}".format(filename))
@@ -46,6 +92,52 @@ cdef class AudioMetadata:
         audiometadata_gst_delete(metadata_struct)
 
 
+def read_metadata(file_paths, int workers=_READ_METADATA_WORKERS):
+    """ Read the metadata of many files with a pool of `workers` threads,
+    each with its own MetadataReader. Yield a (file path, AudioMetadata)
+    tuple for each file as soon as it has been read, with None in place of
+    the AudioMetadata if the file's metadata can't be read. Files that are
+    still queued when the generator is closed are not read. """
+    pending = Queue.Queue()
+    for file_path in file_paths:
+        pending.put(file_path)
+    results = Queue.Queue()
+    stopped = threading.Event()
+
+    def work():
+        try:
+            reader = MetadataReader()
+            while not stopped.is_set():
+                try:
+                    file_path = pending.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    metadata = reader.read(file_path)
+                except IOError:
+                    metadata = None
+                results.put((file_path, metadata))
+        finally:
+            results.put(None)  # This worker has finished
+
+    threads = [threading.Thread(target=work, name='read-metadata')
+               for _ in range(max(1, min(workers, pending.qsize())))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < len(threads):
+            result = results.get()
+            if result is None:
+                finished += 1
+            else:
+                yield result
+    finally:
+        stopped.set()
+
+
 cdef unicode _c_string_to_unicode(char *string):
     if string == NULL:
         return u''
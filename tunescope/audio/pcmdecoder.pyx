@@ -0,0 +1,272 @@
+import mmap
+import os.path
+import struct
+
+import numpy as np
+cimport numpy as np
+
+from tunescope.util import encode_file_path
+
+
+# Number of frames returned by PCMDecoder.read()
+_BLOCK_FRAMES = 4096
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Tags read from the INFO list of a WAV file
+_WAV_TAGS = {b'INAM': 'title', b'IART': 'artist', b'IPRD': 'album'}
+
+# Tags read from the text chunks of an AIFF file
+_AIFF_TAGS = {b'NAME': 'title', b'AUTH': 'artist'}
+
+# Sample kind and byte order of each AIFF-C compression type that is
+# uncompressed PCM
+_AIFC_FORMATS = {
+    b'NONE': ('i', True),
+    b'twos': ('i', True),
+    b'sowt': ('i', False),
+    b'fl32': ('f', True),
+    b'FL32': ('f', True),
+    b'fl64': ('f', True),
+    b'FL64': ('f', True),
+}
+
+
+def open_decoder(filename, int channels=0, int samplerate=0):
+    """ Return a PCMDecoder for the given file if it is uncompressed PCM that
+    can be read in the requested format, and an AudioDecoder otherwise """
+    from .audiodecoder import AudioDecoder
+    try:
+        return PCMDecoder(filename, channels, samplerate)
+    except ValueError:
+        return AudioDecoder(filename, channels, samplerate)
+
+
+cdef class PCMDecoder:
+    """
+    Reads uncompressed PCM audio from a WAV or AIFF file, with the same
+    interface as AudioDecoder. The file is memory-mapped, and its samples
+    (8, 16, 24 or 32-bit integers, or 32 or 64-bit floats) are converted to
+    32-bit floats a block at a time, which is much faster than decoding them
+    with GStreamer. Seeking is exact and instant.
+
+    If `channels` is given, multichannel audio can be downmixed to 1 channel,
+    and mono audio upmixed to any number of channels. `samplerate`, if given,
+    must be the file's own sample rate. ValueError is raised if the file isn't
+    uncompressed PCM or can't be read in the requested format; `open_decoder`
+    falls back to AudioDecoder for such files.
+    """
+
+    cdef readonly int channels
+    cdef readonly int samplerate
+    cdef readonly unicode title
+    cdef readonly unicode artist
+    cdef readonly unicode album
+
+    cdef object _samples  # The file's samples as stored, mapped from the file
+    cdef int _file_channels
+    cdef int _sample_width  # In bytes
+    cdef bint _big_endian
+    cdef double _offset  # Added to the samples before scaling (for unsigned samples)
+    cdef double _scale   # Converts the samples to the range [-1, 1)
+    cdef size_t _frame_count
+    cdef size_t _frame   # Index of the next frame to read
+
+    def __cinit__(self, filename, int channels=0, int samplerate=0):
+        if not os.path.isfile(filename):
+            raise IOError(u"No such file: '{}'".format(filename))
+        with open(encode_file_path(filename), 'rb') as f:
+            header = f.read(12)
+            if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+                parse = _parse_wav
+            elif header[:4] == b'FORM' and header[8:12] in (b'AIFF', b'AIFC'):
+                parse = _parse_aiff
+            else:
+                raise ValueError("Not a WAV or AIFF file")
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError) as e:
+                raise ValueError("Could not map file: " + str(e))
+
+        try:
+            (file_channels, file_samplerate, kind, self._sample_width, self._big_endian,
+             data_offset, data_size, tags) = parse(data, header[8:12] == b'AIFC')
+        except struct.error:
+            # A chunk was cut short
+            raise ValueError("Malformed header")
+        if samplerate not in (0, file_samplerate):
+            raise ValueError("Can't resample")
+        if channels not in (0, 1, file_channels) and file_channels != 1:
+            raise ValueError("Can't convert {} channels to {}".format(file_channels, channels))
+
+        self.channels = channels or file_channels
+        self.samplerate = file_samplerate
+        self.title = tags.get('title', u'')
+        self.artist = tags.get('artist', u'')
+        self.album = tags.get('album', u'')
+        self._file_channels = file_channels
+        self._offset = -128 if kind == 'u' else 0
+        if kind == 'f':
+            self._scale = 1
+        elif self._sample_width == 3:
+            self._scale = 1.0 / 2 ** 31  # Read into the top 3 bytes of an int32
+        else:
+            self._scale = 1.0 / 2 ** (8 * self._sample_width - 1)
+
+        # The data of a file that was still being written may be cut short
+        data_size = max(min(data_size, len(data) - data_offset), 0)
+        self._frame_count = data_size // (self._sample_width * file_channels)
+        self._frame = 0
+        sample_count = self._frame_count * file_channels
+        if self._sample_width == 3:
+            # There is no numpy type for 24-bit samples
+            self._samples = np.frombuffer(data, np.uint8, sample_count * 3, data_offset)
+            self._samples = self._samples.reshape(sample_count, 3)
+        else:
+            dtype = np.dtype('{}{}{}'.format('>' if self._big_endian else '<', kind,
+                                             self._sample_width))
+            self._samples = np.frombuffer(data, dtype, sample_count, data_offset)
+
+    cpdef bint is_eos(self):
+        """ Return True if end-of-stream has been reached """
+        return self._frame >= self._frame_count
+
+    cpdef np.ndarray[np.float32_t] read(self):
+        """
+        Read a block of 32-bit float channel-interleaved audio samples
+        from the file as a numpy.ndarray.
+        If called beyond the end of the stream, a zero-filled array is returned.
+        """
+        cdef size_t start = self._frame
+        cdef size_t end = min(start + _BLOCK_FRAMES, self._frame_count)
+        if end <= start:
+            return np.zeros(_BLOCK_FRAMES * self.channels, dtype=np.float32)
+        self._frame = end
+
+        stored = self._samples[start * self._file_channels:end * self._file_channels]
+        if self._sample_width == 3:
+            padded = np.zeros((len(stored), 4), dtype=np.uint8)
+            if self._big_endian:
+                padded[:, :3] = stored
+                stored = padded.view('>i4').ravel()
+            else:
+                padded[:, 1:] = stored
+                stored = padded.view('<i4').ravel()
+        samples = stored.astype(np.float32)
+        if self._offset != 0:
+            samples += self._offset
+        if self._scale != 1:
+            samples *= self._scale
+
+        if self.channels != self._file_channels:
+            if self.channels == 1:
+                samples = samples.reshape(-1, self._file_channels).mean(axis=1)
+            else:
+                samples = np.repeat(samples, self.channels)
+        return samples
+
+    cpdef bint seek(self, double position):
+        """ Seek to the given position in seconds.
+        Return True on success, False on failure. """
+        if position < 0 or position > self.duration:
+            return False
+        self._frame = min(<size_t> (position * self.samplerate + 0.5), self._frame_count)
+        return True
+
+    @property
+    def position(self):
+        """ The current position in seconds """
+        return self._frame / <double> self.samplerate
+
+    @property
+    def duration(self):
+        """ The duration of the file in seconds """
+        return self._frame_count / <double> self.samplerate
+
+
+def _chunks(data, size_t start, size_t end, byte_order):
+    """ Yield the (ID, data offset, size) of each chunk in data[start:end] """
+    cdef size_t offset = start
+    end = min(end, len(data))
+    while offset + 8 <= end:
+        chunk_id, size = struct.unpack(byte_order + '4sI', data[offset:offset + 8])
+        yield chunk_id, offset + 8, size
+        offset += 8 + size + (size & 1)  # Chunks are padded to an even size
+
+
+def _parse_wav(data, is_aifc):
+    """ Return (channels, samplerate, sample kind, sample width in bytes,
+    big endian, data offset, data size, tags) for a WAV file """
+    fmt = stream = None
+    tags = {}
+    for chunk_id, offset, size in _chunks(data, 12, len(data), '<'):
+        if chunk_id == b'fmt ' and size >= 16:
+            format_tag, channels, samplerate, _, block_align, bits = struct.unpack(
+                '<HHIIHH', data[offset:offset + 16])
+            if format_tag == _WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # The format tag starts the subformat GUID
+                format_tag, = struct.unpack('<H', data[offset + 24:offset + 26])
+            fmt = format_tag, channels, samplerate, block_align, bits
+        elif chunk_id == b'data':
+            stream = offset, size
+        elif chunk_id == b'LIST' and data[offset:offset + 4] == b'INFO':
+            for tag_id, tag_offset, tag_size in _chunks(data, offset + 4, offset + size, '<'):
+                if tag_id in _WAV_TAGS:
+                    tags[_WAV_TAGS[tag_id]] = _decode_tag(data[tag_offset:tag_offset + tag_size])
+    if fmt is None or stream is None:
+        raise ValueError("Missing format or data chunk")
+
+    format_tag, channels, samplerate, block_align, bits = fmt
+    if format_tag == _WAVE_FORMAT_PCM and bits in (8, 16, 24, 32):
+        kind = 'u' if bits == 8 else 'i'
+    elif format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        kind = 'f'
+    else:
+        raise ValueError("Unsupported WAV format")
+    if channels < 1 or samplerate < 1 or block_align != channels * bits // 8:
+        raise ValueError("Invalid WAV format")
+    return channels, samplerate, kind, bits // 8, False, stream[0], stream[1], tags
+
+
+def _parse_aiff(data, is_aifc):
+    """ Like _parse_wav, for an AIFF or AIFF-C file """
+    comm = stream = None
+    tags = {}
+    for chunk_id, offset, size in _chunks(data, 12, len(data), '>'):
+        if chunk_id == b'COMM' and size >= 18:
+            channels, frame_count, bits = struct.unpack('>hIh', data[offset:offset + 8])
+            samplerate = int(round(_extended_to_float(data[offset + 8:offset + 18])))
+            compression = data[offset + 18:offset + 22] if is_aifc else b'NONE'
+            comm = channels, frame_count, bits, samplerate, compression
+        elif chunk_id == b'SSND' and size >= 8:
+            data_offset, = struct.unpack('>I', data[offset:offset + 4])
+            stream = offset + 8 + data_offset, size - 8 - data_offset
+        elif chunk_id in _AIFF_TAGS:
+            tags[_AIFF_TAGS[chunk_id]] = _decode_tag(data[offset:offset + size])
+    if comm is None or stream is None:
+        raise ValueError("Missing COMM or SSND chunk")
+
+    channels, frame_count, bits, samplerate, compression = comm
+    if compression not in _AIFC_FORMATS:
+        raise ValueError("Compressed AIFF-C file")
+    kind, big_endian = _AIFC_FORMATS[compression]
+    supported_bits = [8, 16, 24, 32] if kind == 'i' else [32, 64]
+    if bits not in supported_bits or channels < 1 or samplerate < 1:
+        raise ValueError("Unsupported AIFF format")
+    data_size = min(stream[1], frame_count * channels * (bits // 8))
+    return channels, samplerate, kind, bits // 8, big_endian, stream[0], data_size, tags
+
+
+def _extended_to_float(data):
+    """ Convert an 80-bit IEEE 754 extended precision number (as used for
+    the sample rate of AIFF files) to a float """
+    sign_exponent, mantissa = struct.unpack('>HQ', data)
+    exponent = (sign_exponent & 0x7FFF) - 16383 - 63
+    value = mantissa * 2.0 ** exponent
+    return -value if sign_exponent & 0x8000 else value
+
+
+def _decode_tag(data):
+    return data.split(b'\0', 1)[0].decode('utf-8', 'replace').strip()
@@ -0,0 +1,228 @@
+from bisect import bisect_right
+import threading
+
+import numpy as np
+cimport numpy as np
+
+
+cdef class SharedDecoder:
+    """
+    Decodes a stream once on behalf of several readers, such as the playback
+    pipeline and the analysis. Each reader returned by `reader()` has the same
+    interface as AudioDecoder and moves through the stream independently.
+
+    Decoded blocks are kept in memory, so a reader that is behind (or seeks
+    backwards, e.g. to loop) reads them without decoding them again. Whichever
+    reader is furthest ahead decodes the next block, without holding up
+    readers that have decoded blocks to read.
+
+    A reader that seeks past the part of the stream decoded so far switches to
+    a private decoder until the shared decoder catches up with it. If keeping
+    the decoded stream would take more than `max_samples` samples, the memory
+    is released and every reader carries on with a private decoder.
+    """
+
+    cdef readonly int channels
+    cdef readonly int samplerate
+
+    cdef readonly size_t samples_decoded
+    """ Number of samples decoded so far by the shared decoder """
+
+    cdef object _open_decoder
+    cdef object _decoder
+    cdef size_t _max_samples
+    cdef object _lock  # A Condition, notified when a block has been decoded
+    cdef bint _decoding  # True while a reader is decoding the next block
+    cdef list _blocks  # None once `max_samples` has been exceeded
+    cdef list _block_offsets  # Offset in samples of the start of each block
+
+    def __cinit__(self, object open_decoder, size_t max_samples, object decoder=None):
+        """ Create a SharedDecoder. `open_decoder` is a callable that returns
+        a new decoder (normally an AudioDecoder) at the start of the stream.
+        It is called once for the shared decoder, unless `decoder`, a decoder
+        that has just been opened, is given, and once for every private
+        decoder. """
+        self._open_decoder = open_decoder
+        self._decoder = decoder if decoder is not None else open_decoder()
+        self.channels = self._decoder.channels
+        self.samplerate = self._decoder.samplerate
+        self.samples_decoded = 0
+        self._max_samples = max_samples
+        self._lock = threading.Condition()
+        self._decoding = False
+        self._blocks = []
+        self._block_offsets = []
+
+    def reader(self):
+        """ Return a new SharedDecoderReader at the start of the stream """
+        return SharedDecoderReader(self)
+
+    @property
+    def shared(self):
+        """ False once the decoded stream has outgrown `max_samples` """
+        return self._blocks is not None
+
+    cdef object _read(self, SharedDecoderReader reader):
+        """ Return the next block for `reader`, or None if the decoded stream
+        has been released and `reader` needs a private decoder """
+        cdef np.ndarray block
+        with self._lock:
+            while self._blocks is not None and reader._block_index == len(self._blocks):
+                if not self._decoding:
+                    if self._decoder.is_eos():
+                        return np.zeros(self.channels, dtype=np.float32)
+                    self._decoding = True
+                    break
+                # Another reader is decoding the block
+                self._lock.wait()
+            else:
+                if self._blocks is None:
+                    return None
+                return self._next_block(reader)
+
+        # The block is decoded without holding the lock, so that other readers
+        # can read the blocks decoded already in the meantime
+        try:
+            block = self._decoder.read()
+        except:
+            with self._lock:
+                self._decoding = False
+                self._lock.notify_all()
+            raise
+
+        with self._lock:
+            self._decoding = False
+            self._lock.notify_all()
+            if self.samples_decoded + len(block) > self._max_samples:
+                # Release the decoded stream. This reader keeps the shared
+                # decoder, so it continues without seeking.
+                self._blocks = None
+                self._block_offsets = None
+                reader._private_decoder = self._decoder
+                self._decoder = None
+                return block
+            self._blocks.append(block)
+            self._block_offsets.append(self.samples_decoded)
+            self.samples_decoded += len(block)
+            return self._next_block(reader)
+
+    cdef object _next_block(self, SharedDecoderReader reader):
+        """ Return the decoded block at `reader`'s position and move it past
+        the block. Must be called with the lock held. """
+        cdef np.ndarray block = self._blocks[reader._block_index]
+        cdef size_t skip = reader._sample_position - self._block_offsets[reader._block_index]
+        reader._block_index += 1
+        reader._sample_position += len(block) - skip
+        return block[skip:] if skip else block
+
+    cdef bint _seek(self, SharedDecoderReader reader, size_t sample_position):
+        """ Move `reader` to `sample_position` within the decoded stream.
+        Return False if the position hasn't been decoded yet. """
+        with self._lock:
+            if self._blocks is None:
+                return False
+            if sample_position >= self.samples_decoded:
+                # The decoder is only at the end of the stream if it isn't
+                # decoding another block
+                if (sample_position > self.samples_decoded
+                        and (self._decoding or not self._decoder.is_eos())):
+                    return False
+                sample_position = self.samples_decoded
+                reader._block_index = len(self._blocks)
+            else:
+                reader._block_index = bisect_right(self._block_offsets, sample_position) - 1
+            reader._sample_position = sample_position
+            return True
+
+    cdef bint _is_eos(self, SharedDecoderReader reader):
+        with self._lock:
+            if self._blocks is None:
+                return False
+            return (reader._block_index == len(self._blocks)
+                    and not self._decoding
+                    and self._decoder.is_eos())
+
+
+cdef class SharedDecoderReader:
+    """
+    A reader of a SharedDecoder, with the same interface as AudioDecoder.
+    Arrays returned by `read()` may be shared with other readers and must be
+    treated as read-only.
+    """
+
+    cdef SharedDecoder _shared
+    cdef object _private_decoder  # Used outside the decoded stream
+    cdef size_t _sample_position  # Position in the decoded stream in samples
+    cdef size_t _block_index  # Index of the block containing _sample_position
+
+    def __cinit__(self, SharedDecoder shared):
+        self._shared = shared
+        self._private_decoder = None
+        self._sample_position = 0
+        self._block_index = 0
+
+    @property
+    def channels(self):
+        return self._shared.channels
+
+    @property
+    def samplerate(self):
+        return self._shared.samplerate
+
+    @property
+    def position(self):
+        """ The current position in seconds """
+        if self._private_decoder is not None:
+            return self._private_decoder.position
+        return (<double> self._sample_position
+                / self._shared.channels
+                / self._shared.samplerate)
+
+    @property
+    def shared(self):
+        """ True if the reader is reading the shared decoded stream """
+        return self._private_decoder is None
+
+    cpdef np.ndarray[np.float32_t] read(self):
+        """ Read the next block of 32-bit float channel-interleaved samples.
+        If called beyond the end of the stream, a zero-filled array is
+        returned. """
+        cdef np.ndarray block
+        if (self._private_decoder is not None
+                and self._shared._seek(self, self._to_samples(self._private_decoder.position))):
+            # The shared decoder has caught up; rejoin it
+            self._private_decoder = None
+        if self._private_decoder is None:
+            block = self._shared._read(self)
+            if block is not None:
+                return block
+            if self._private_decoder is None:
+                self._open_private_decoder(self.position)
+        return self._private_decoder.read()
+
+    cpdef bint seek(self, double position):
+        """ Seek to the given position in seconds.
+        Return True on success, False on failure. """
+        if position < 0:
+            return False
+        if self._shared._seek(self, self._to_samples(position)):
+            self._private_decoder = None
+            return True
+        if self._private_decoder is None:
+            self._private_decoder = self._shared._open_decoder()
+        return self._private_decoder.seek(position)
+
+    cpdef bint is_eos(self):
+        """ Return True if end-of-stream has been reached """
+        if self._private_decoder is not None:
+            return self._private_decoder.is_eos()
+        return self._shared._is_eos(self)
+
+    cdef size_t _to_samples(self, double position):
+        return (<size_t> (position * self._shared.samplerate + 0.5)
+                * self._shared.channels)
+
+    cdef _open_private_decoder(self, double position):
+        self._private_decoder = self._shared._open_decoder()
+        if position > 0:
+            self._private_decoder.seek(position)
@@ -35,6 +35,17 @@ keyboard_shortcuts = [
         },
         'action': 'play_pause',
     },
+    {
+        'description': 'Toggle High Resolution Analysis',
+        'platform': {
+            'macos': {
+                'keys': ['shift', 'meta', 'h'],
+            },
+            'linux': {},
+            'windows': {},
+        },
+        'action': 'toggle_high_resolution_analysis',
+    },
 
 ]
 
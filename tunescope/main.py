@@ -1,9 +1,11 @@
 from __future__ import division
+from collections import OrderedDict
 import datetime
 import math
 import os.path
 import platform
 import sys
+import threading
 
 from async_gui.engine import Task
 from async_gui.toolkits.kivy import KivyEngine
@@ -22,20 +24,25 @@ from kivy.properties import (
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.modalview import ModalView
 from kivy.uix.widget import Widget
-import plyer
+import numpy as np
 
-from tunescope.analysis import analyze
-from tunescope.audio import AudioDecoder, DecoderBuffer
+from tunescope.analysis import (
+    AnalysisJob, choose_analysis_parameters, encode_envelope, encode_spectrum,
+    measure_analysis_speed)
+from tunescope.analysiscache import AnalysisCache
 from tunescope.filehistory import FileHistory
 from tunescope.keyboardshortcuts import keyboard_action
 from tunescope.player import Player
 from tunescope.selections import SelectionList
 from tunescope.theme import Theme
 from tunescope.util import bind_properties, decode_file_path
-from tunescope.widgets.aboutpage import AboutPage
-from tunescope.widgets.selectionmenu import SelectionMenu
 
 
+# Modules that are slow to import (the audio stack, which loads GStreamer;
+# aubio; plyer; and the dialogs) are imported where they are first used, so
+# that the window appears sooner. tests/benchmarks/startup-time.py measures
+# the startup time.
+
 _async_engine = KivyEngine()
 
 if platform.system() == 'Darwin':
@@ -44,6 +51,60 @@ else:
     _DATA_DIR = os.path.expanduser('~/.local/share/TuneScope')
 
 
+# Number of data points in the quick overview of a file's spectrogram shown
+# while it is being analyzed. Files with fewer than four times as many data
+# points, or whose audio can't be sampled quickly (see _overview_method), are
+# analyzed in full straight away.
+_OVERVIEW_LENGTH = 256
+
+# Number of data points plotted at a time from a cached analysis
+_CACHED_PAGE_SIZE = 1024
+
+# Files are analyzed at a resolution expected to take no longer than this (in
+# seconds) on the machine, unless high resolution analysis is enabled
+_TARGET_ANALYSIS_TIME = 15.0
+
+# Width of a second of the plots at the highest horizontal zoom, in dp (as in
+# tunescope.kv). Files aren't analyzed at a finer resolution than this.
+_MAX_PIXELS_PER_SECOND = 120 * 10
+
+# Sample rate that files are converted to for analysis when they have their
+# own decoder (those sharing the player's decoding keep their own rate)
+_ANALYSIS_SAMPLERATE = 22050
+
+# Looped selections up to this long (in seconds) are analyzed in more detail
+_DETAIL_MAX_DURATION = 30.0
+
+# Maximum number of data points in the detailed spectrogram of a selection
+_DETAIL_MAX_LENGTH = 4096
+
+# Number of detailed spectrograms of selections kept in memory
+_DETAIL_CACHE_SIZE = 8
+
+# Number of recently opened files that the player prepares in the background
+# after a file has been analyzed, so that they can be opened again instantly
+_PREPARED_RECENT_FILES = 2
+
+
+def _overview_method(decoder, duration):
+    """ Return how the quick overview of the `duration` seconds of audio from
+    `decoder` is best analyzed (see analyze_overview): 'seek' where seeking is
+    fast, 'read' where the audio read is kept for the full analysis by a
+    shared decoder, or None where neither is the case, as the overview would
+    then delay the full analysis more than it helps """
+    from tunescope.audio import AudioDecoder, PCMDecoder
+
+    if isinstance(decoder, PCMDecoder):
+        return 'seek'
+    if isinstance(decoder, AudioDecoder):
+        # Without a seek index, GStreamer scans compressed streams to seek
+        # accurately
+        seek_index = decoder.get_seek_index()
+        indexed_duration = seek_index[-1, 0] if len(seek_index) > 0 else 0
+        return 'seek' if indexed_duration >= duration * (1 - 1 / _OVERVIEW_LENGTH) else None
+    return 'read' if decoder.shared else None
+
+
 # TODO: Enable vsync:
 # https://github.com/missionpinball/mpf-mc/issues/289
 # https://kivy.org/docs/api-kivy.config.html#module-kivy.config
@@ -56,6 +117,9 @@ class MainWindow(Widget):
     selection_list = ObjectProperty(SelectionList(), rebind=True)
     editing_selection_name = BooleanProperty(False)
 
+    high_resolution_analysis = BooleanProperty(False)
+    """ Analyze files at the finest resolution, however long it takes """
+
     def __init__(self, **kwargs):
         super(MainWindow, self).__init__(**kwargs)
 
@@ -74,9 +138,34 @@ class MainWindow(Widget):
 
         db_path = os.path.join(_DATA_DIR, 'file_history.sqlite3')
         self._file_history = FileHistory(db_path)
+        self._analysis_cache = AnalysisCache(os.path.join(_DATA_DIR, 'analysis_cache'))
+
+        # Spectrograms of long recordings are kept on disk rather than in memory
+        self.ids.spectrogram.scratch_directory = _DATA_DIR
 
         self._open_dialog_path = os.path.join(os.path.expanduser('~'), 'Music')
 
+        # Analysis progress is reported from the analysis thread and shown via
+        # this trigger, which coalesces updates into at most one per frame
+        self._loading_fraction = 0.0
+        self._loading_progress_trigger = Clock.create_trigger(self._update_loading_progress)
+
+        # The AnalysisJob for the current file. The lock prevents a job from
+        # plotting any more data once it has been cancelled.
+        self._analysis_job = None
+        self._analysis_lock = threading.Lock()
+        self._analysis_speed = None  # Hops per second, measured when first needed
+        self._analysis_samplerate = None  # Sample rate of the plotted analysis
+
+        # Detailed spectra of looped selections, keyed by (file path, start,
+        # end), from least to most recently used
+        self._detail_cache = OrderedDict()
+        self._detail_job = None
+        self._detail_trigger = Clock.create_trigger(self._update_detail, 0.25)
+        self.player.bind(looping_enabled=self._detail_trigger,
+                         selection_start=self._detail_trigger,
+                         selection_end=self._detail_trigger)
+
     def _setup_keyboard(self):
         def keyboard_closed():
             pass
@@ -93,6 +182,8 @@ class MainWindow(Widget):
                 self.show_open_dialog()
             elif action == 'show_recent_files':
                 self.ids.recent_files_button.trigger_action()
+            elif action == 'toggle_high_resolution_analysis':
+                self.high_resolution_analysis = not self.high_resolution_analysis
 
         keyboard.bind(on_key_down=on_key_down)
 
@@ -132,6 +223,7 @@ class MainWindow(Widget):
         return App.get_running_app().player
 
     def show_open_dialog(self):
+        import plyer
         selected_files = plyer.filechooser.open_file(
             path=self._open_dialog_path,
             multiple=False,
@@ -143,6 +235,11 @@ class MainWindow(Widget):
 
     @_async_engine.async
     def open_file(self, file_path):
+        if self._analysis_job is not None:
+            with self._analysis_lock:
+                self._analysis_job.cancel()
+        if self._detail_job is not None:
+            self._detail_job.cancel()
         if self.player.file_path is not None:
             self._save_state()
         file_path = os.path.abspath(decode_file_path(file_path))
@@ -156,39 +253,270 @@ class MainWindow(Widget):
             popup.open()
             return
 
+        seek_index = self._analysis_cache.load_seek_index(file_path)
+        if seek_index is not None:
+            self.player.seek_index = seek_index
+
         self._load_state()
         self._file_opened_time = datetime.datetime.now()
         self._save_state()
+        self._analyze(file_path, use_cache=True)
 
-        yield Task(self._analyze_file)
+    def on_high_resolution_analysis(self, *args):
+        if self.player.file_path is not None:
+            self._analyze(self.player.file_path)
 
-    def _analyze_file(self):
+    @_async_engine.async
+    def _analyze(self, file_path, use_cache=False):
+        """ Analyze the open file `file_path` in the background and plot the
+        results, cancelling any analysis in progress. If `use_cache` is True,
+        an analysis of the file saved in the analysis cache is plotted
+        instead, unless high resolution analysis is enabled. Analyses at the
+        usual resolution are saved in the cache. """
+        if self._analysis_job is not None:
+            with self._analysis_lock:
+                self._analysis_job.cancel()
+        job = self._analysis_job = AnalysisJob()
+        self._loading_fraction = 0.0
         self.loading_progress = 0
         self.ids.loading_progress_indicator.opacity = 1
-
-        window_size = 4096
-        hop_size = window_size // 4
-        audio_source = DecoderBuffer(AudioDecoder(self.player.file_path), 4096)
-        duration_frames = int(math.ceil(self.player.duration * audio_source.samplerate))
+        self._analysis_samplerate = None
+
+        envelope = self._analysis_cache.load_envelope(file_path)
+        if envelope is not None:
+            self.ids.waveform.set_envelope(envelope)
+
+        analysis = None
+        if use_cache and envelope is not None and not self.high_resolution_analysis:
+            analysis = self._analysis_cache.load_analysis(file_path)
+        if analysis is not None:
+            pitch, spectrum, self._analysis_samplerate = analysis
+            yield Task(self._plot_cached_analysis, job, pitch, spectrum)
+            if job.cancelled:
+                return
+        else:
+            duration = self.player.duration
+            # Opening a decoder may block, e.g. while a GStreamer pipeline prerolls
+            decoder = yield Task(self.player.open_decoder,
+                                 channels=1, samplerate=_ANALYSIS_SAMPLERATE)
+            if job.cancelled:
+                return
+            self._analysis_samplerate = decoder.samplerate
+            yield Task(self._analyze_file, job, decoder, duration,
+                       int(duration * dp(_MAX_PIXELS_PER_SECOND)),
+                       file_path if envelope is None else None,
+                       None if self.high_resolution_analysis else file_path)
+            if job.cancelled:
+                return
+            self._save_seek_index(file_path, decoder)
+        fadeout = Animation(opacity=0, duration=1)
+        fadeout.start(self.ids.loading_progress_indicator)
+        self._detail_trigger()
+        self._prepare_recent_files()
+
+    def _save_seek_index(self, file_path, decoder):
+        """ Cache the seek index recorded while the open file `file_path`
+        was decoded for analysis by `decoder`, and let the player use it """
+        if hasattr(decoder, 'get_seek_index'):
+            seek_index = decoder.get_seek_index()
+            self.player.seek_index = seek_index
+        else:
+            # The decoder shared the player's decoding
+            seek_index = self.player.seek_index
+        if seek_index is not None and len(seek_index) > 0:
+            self._analysis_cache.save_seek_index(file_path, seek_index)
+
+    def _prepare_recent_files(self):
+        """ Have the player prepare the most recently opened files other than
+        the open one, at their saved positions """
+        files = []
+        for record in self._file_history.recent(_PREPARED_RECENT_FILES + 1):
+            file_path = os.path.join(record['directory'], record['filename'])
+            if file_path == self.player.file_path or not os.path.isfile(file_path):
+                continue
+            record = self._file_history.get(record['directory'], record['filename'])
+            try:
+                position = float(record['state']['player']['position'])
+            except (KeyError, TypeError, ValueError):
+                position = 0.0
+            files.append((file_path, position))
+        self.player.prepare_files(files[:_PREPARED_RECENT_FILES])
+
+    def _analyze_file(self, job, decoder, duration, max_hop_count, envelope_file_path=None,
+                      analysis_file_path=None):
+        """ Analyze the audio from `decoder` and plot the results, stopping
+        early if `job` is cancelled. Runs in a worker thread. The decoder is
+        freed as soon as this returns.
+
+        The resolution is chosen to finish in about _TARGET_ANALYSIS_TIME on
+        this machine, producing no more than `max_hop_count` data points,
+        unless high_resolution_analysis is enabled.
+
+        If `envelope_file_path` is given, the waveform is drawn as the
+        analysis progresses, and its envelope is cached for that file once
+        the analysis is complete. Likewise, if `analysis_file_path` is given,
+        the pitch and spectrum are cached for that file.
+        """
+        from tunescope.audio import DecoderBuffer
+
+        if self._analysis_speed is None:
+            self._analysis_speed = measure_analysis_speed(decoder.samplerate)
+            Logger.info("Analysis: {:.0f} hops per second".format(self._analysis_speed))
+        window_size, hop_size = choose_analysis_parameters(
+            duration, decoder.samplerate, self._analysis_speed, _TARGET_ANALYSIS_TIME,
+            max_hop_count, self.high_resolution_analysis)
+        audio_source = DecoderBuffer(decoder, 4096)
+        duration_frames = int(math.ceil(duration * audio_source.samplerate))
         data_length = int(math.ceil(duration_frames / hop_size))
-        self.ids.spectrogram.prepare(data_length)
-        self.ids.pitch_plot.prepare(data_length)
 
-        self.__hops_analyzed = 0
+        with self._analysis_lock:
+            if job.cancelled:
+                return
+            self.ids.spectrogram.prepare(data_length)
+            self.ids.pitch_plot.prepare(data_length)
+            if envelope_file_path is not None:
+                self.ids.waveform.prepare(data_length)
+
+        overview_method = None
+        if data_length >= 4 * _OVERVIEW_LENGTH:
+            overview_method = _overview_method(decoder, duration)
+        if overview_method is not None:
+            for hop_start, hop_end, page in job.analyze_overview(
+                    audio_source, duration, _OVERVIEW_LENGTH,
+                    window_size=window_size,
+                    hop_size=hop_size,
+                    seek=overview_method == 'seek',
+                    spectrum_format='uint8'):
+                with self._analysis_lock:
+                    if job.cancelled:
+                        return
+                    self.ids.spectrogram.add_overview_data(page['spectrum'], hop_start, hop_end)
+            if job.cancelled or not audio_source.seek(0):
+                return
+
+        def on_progress(hops_analyzed):
+            if not job.cancelled:
+                self._loading_fraction = min(hops_analyzed / data_length, 1.0)
+                self._loading_progress_trigger()
 
-        def on_progress():
-            self.__hops_analyzed += 1
-            self.loading_progress = int(round(self.__hops_analyzed / data_length * 100))
+        analysis_writer = None
+        if analysis_file_path is not None:
+            analysis_writer = self._analysis_cache.analysis_writer(
+                analysis_file_path, data_length, window_size // 2 + 1, audio_source.samplerate)
 
-        for page in analyze(audio_source,
+        envelope_pages = []
+        for page in job.run(audio_source,
                             window_size=window_size,
                             hop_size=hop_size,
                             on_progress=on_progress):
-            # self.ids.pitch_plot.add_data(page['pitch'])
-            self.ids.spectrogram.add_data(page['spectrum'])
+            with self._analysis_lock:
+                if job.cancelled:
+                    break
+                self.ids.pitch_plot.add_data(page['pitch'])
+                self.ids.spectrogram.add_data(page['spectrum'])
+                if envelope_file_path is not None:
+                    envelope = encode_envelope(page['peak'], page['rms'])
+                    envelope_pages.append(envelope)
+                    self.ids.waveform.add_data(envelope)
+            if analysis_writer is not None:
+                analysis_writer.add_data(page['pitch'], encode_spectrum(page['spectrum'], 'uint8'))
+
+        if analysis_writer is not None:
+            if job.cancelled:
+                analysis_writer.discard()
+            else:
+                analysis_writer.commit()
+        if envelope_file_path is not None and envelope_pages and not job.cancelled:
+            self._analysis_cache.save_envelope(
+                envelope_file_path, np.concatenate(envelope_pages)[:data_length])
+
+    def _plot_cached_analysis(self, job, pitch, spectrum):
+        """ Plot the pitch and spectrum of an analysis loaded from the
+        analysis cache, stopping early if `job` is cancelled. Runs in a worker
+        thread. """
+        data_length = len(pitch)
+        with self._analysis_lock:
+            if job.cancelled:
+                return
+            self.ids.spectrogram.prepare(data_length)
+            self.ids.pitch_plot.prepare(data_length)
+
+        for start in range(0, data_length, _CACHED_PAGE_SIZE):
+            end = min(start + _CACHED_PAGE_SIZE, data_length)
+            # Copied out of the read-only memory map, as the plot requires
+            # a writable array
+            spectrum_page = np.array(spectrum[start:end])
+            with self._analysis_lock:
+                if job.cancelled:
+                    return
+                self.ids.pitch_plot.add_data(pitch[start:end])
+                self.ids.spectrogram.add_data(spectrum_page)
+            self._loading_fraction = end / data_length
+            self._loading_progress_trigger()
 
-        fadeout = Animation(opacity=0, duration=1)
-        fadeout.start(self.ids.loading_progress_indicator)
+    @_async_engine.async
+    def _update_detail(self, *args):
+        """ Show a detailed spectrogram of the selection if it is looped,
+        analyzing it in the background unless it is cached """
+        if self._detail_job is not None:
+            self._detail_job.cancel()
+            self._detail_job = None
+        player = self.player
+        spectrogram = self.ids.spectrogram
+        spectrogram.clear_detail()
+        start, end = player.selection_start, player.selection_end
+        if (not player.looping_enabled
+                or player.file_path is None
+                or not 0 < end - start <= _DETAIL_MAX_DURATION):
+            return
+
+        plot_samplerate = self._analysis_samplerate
+        if plot_samplerate is None:
+            return
+
+        key = (player.file_path, start, end)
+        detail = self._detail_cache.pop(key, None)
+        if detail is None:
+            job = self._detail_job = AnalysisJob()
+            try:
+                detail = yield Task(self._analyze_detail, job, start, end, plot_samplerate)
+            except IOError as e:
+                Logger.warning("Could not analyze selection: {}".format(e))
+                return
+            if job.cancelled:
+                return
+            self._detail_job = None
+
+        self._detail_cache[key] = detail
+        while len(self._detail_cache) > _DETAIL_CACHE_SIZE:
+            self._detail_cache.popitem(last=False)
+        spectrum, samplerate = detail
+        spectrogram.show_detail(spectrum, start / player.duration, end / player.duration,
+                                samplerate / float(self._analysis_samplerate))
+
+    def _analyze_detail(self, job, start, end, samplerate):
+        """ Analyze the open file between `start` and `end` seconds at a
+        finer resolution than the whole file, with a decoder that converts it
+        to `samplerate` if it can, returning (spectrum, sample rate), or None
+        if `job` is cancelled. Runs in a worker thread, as opening the
+        decoder may block. """
+        from tunescope.audio import DecoderBuffer
+
+        decoder = self.player.open_decoder(channels=1, samplerate=samplerate)
+
+        # About 23 ms windows, with hops as short as 3 ms
+        window_size = 2 ** int(round(math.log(decoder.samplerate * 1024 / 44100, 2)))
+        hop_size = window_size // 8
+        while (end - start) * decoder.samplerate / hop_size > _DETAIL_MAX_LENGTH:
+            hop_size *= 2
+        page = job.analyze_range(DecoderBuffer(decoder, 4096), start, end,
+                                 window_size=window_size,
+                                 hop_size=hop_size,
+                                 spectrum_format='uint8')
+        return None if page is None else (page['spectrum'], decoder.samplerate)
+
+    def _update_loading_progress(self, dt):
+        self.loading_progress = int(round(self._loading_fraction * 100))
 
     def show_recent_files_menu(self):
         dropdown = Factory.RecentFilesDropDown()
@@ -219,6 +547,8 @@ class MainWindow(Widget):
         dropdown.bind(on_select=on_select)
 
     def show_selection_menu(self):
+        from tunescope.widgets.selectionmenu import SelectionMenu
+
         padding = dp(10)
         modal = ModalView(
             size_hint=(0.7, None),
@@ -323,6 +653,8 @@ class MainWindow(Widget):
         return False  # False means go ahead and close the window
 
     def show_about_page(self):
+        from tunescope.widgets.aboutpage import AboutPage
+
         padding = dp(10)
         modal = ModalView(
             size_hint=(0.7, 0.7),
@@ -0,0 +1,175 @@
+import os
+import os.path
+import sqlite3
+
+from kivy import Logger
+
+from .util import decode_file_path
+
+
+AUDIO_EXTENSIONS = frozenset(['.aac', '.aif', '.aiff', '.flac', '.m4a', '.mp3', '.ogg',
+                              '.opus', '.wav', '.wma'])
+""" Extensions (in lower case) of the files found by `MetadataCache.scan` """
+
+_COMMIT_INTERVAL = 100  # Number of files read by `scan` between commits
+
+
+class MetadataCache(object):
+    """ Stores the duration and tags of audio files in a SQLite database, so
+    that a library of many files can be browsed without reading each file.
+    Each record (returned as a dict by `get` and `records`) has the following
+    fields:
+
+    path : str
+        absolute path of the file
+    duration : float
+    title : str
+    artist : str
+    album : str
+
+    Records are keyed by path, and also hold the file's size and modification
+    time, so that a record is no longer returned once its file has changed,
+    and `scan` only reads the files that are new or have changed.
+
+    Parameters
+    ----------
+    db_path : str
+        file path to store the database
+    """
+
+    def __init__(self, db_path):
+        self._db = None
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        c = self._db.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                duration REAL,
+                title TEXT,
+                artist TEXT,
+                album TEXT
+            )
+            ''')
+
+    def get(self, file_path):
+        """ Return the record of `file_path`, or None if there is no record
+        of the file as it is now or its metadata couldn't be read """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        c = self._db.cursor()
+        c.execute('''
+            SELECT path, duration, title, artist, album
+            FROM metadata
+            WHERE path = ? AND size = ? AND mtime = ? AND duration IS NOT NULL
+            ''', (self._key(file_path), stat.st_size, stat.st_mtime))
+        record = c.fetchone()
+        return dict(record) if record is not None else None
+
+    def update(self, file_path, metadata):
+        """ Insert or replace the record of `file_path` from `metadata`, an
+        object with duration, title, artist and album attributes (such as an
+        AudioMetadata). If `metadata` is None, the file is recorded as having
+        no readable metadata, so that it isn't read again until it changes. """
+        self._update(file_path, metadata)
+        self._db.commit()
+
+    def records(self, directory):
+        """ Return the records of the files within `directory` (at any depth),
+        ordered by path """
+        start, end = self._path_range(directory)
+        c = self._db.cursor()
+        c.execute('''
+            SELECT path, duration, title, artist, album
+            FROM metadata
+            WHERE path >= ? AND path < ? AND duration IS NOT NULL
+            ORDER BY path
+            ''', (start, end))
+        return [dict(record) for record in c.fetchall()]
+
+    def scan(self, directory, workers=None, progress_callback=None):
+        """ Bring the records of the audio files within `directory` (at any
+        depth) up to date. Only the files that are new or have changed since
+        they were last read are read, with a pool of `workers` threads (see
+        audio.read_metadata), and the records of files that no longer exist
+        are deleted. `progress_callback`, if given, is called with the number
+        of files read so far and the number to read.
+
+        Return the number of files read.
+        """
+        from .audio import read_metadata
+
+        directory = self._key(directory)
+        known = {}
+        start, end = self._path_range(directory)
+        c = self._db.cursor()
+        c.execute('SELECT path, size, mtime FROM metadata WHERE path >= ? AND path < ?',
+                  (start, end))
+        for path, size, mtime in c.fetchall():
+            known[path] = (size, mtime)
+
+        stale = []
+        for file_path in self._find_audio_files(directory):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if known.pop(file_path, None) != (stat.st_size, stat.st_mtime):
+                stale.append(file_path)
+
+        c.executemany('DELETE FROM metadata WHERE path = ?', [(path,) for path in known])
+        self._db.commit()
+
+        kwargs = {'workers': workers} if workers is not None else {}
+        files_read = 0
+        for file_path, metadata in read_metadata(stale, **kwargs):
+            self._update(file_path, metadata)
+            files_read += 1
+            if files_read % _COMMIT_INTERVAL == 0:
+                self._db.commit()
+            if progress_callback is not None:
+                progress_callback(files_read, len(stale))
+        self._db.commit()
+        return files_read
+
+    def _update(self, file_path, metadata):
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            Logger.warning("Could not access file to cache its metadata: " + str(e))
+            return
+        if metadata is not None:
+            values = (metadata.duration, metadata.title, metadata.artist, metadata.album)
+        else:
+            values = (None, None, None, None)
+        c = self._db.cursor()
+        c.execute('''
+            INSERT OR REPLACE INTO metadata (path, size, mtime, duration, title, artist, album)
+            VALUES (?,?,?,?,?,?,?)
+            ''', (self._key(file_path), stat.st_size, stat.st_mtime) + values)
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.abspath(decode_file_path(file_path))
+
+    @staticmethod
+    def _find_audio_files(directory):
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+                    yield os.path.join(dirpath, filename)
+
+    @staticmethod
+    def _path_range(directory):
+        """ Return (start, end) such that the paths within `directory` are
+        those in the range [start, end) """
+        prefix = os.path.join(MetadataCache._key(directory), u'')
+        return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+    def __del__(self):
+        if self._db is not None:
+            self._db.close()
@@ -1,17 +1,21 @@
+from collections import OrderedDict
 import os.path
+import threading
 
 from kivy.event import EventDispatcher
 from kivy.properties import NumericProperty, BoundedNumericProperty, BooleanProperty, StringProperty
 from kivy.clock import Clock
 import numpy as np
 
-from .audio import AudioMetadata, AudioDecoder, DecoderBuffer, Looper, TimeStretcher, AudioOutput
 from .ituneslibrary import ITunesLibrary
 
 
 _FRAMERATE = 60.0
 _POSITION_INTERPOLATION_THRESHOLD = 0.2
 _POSITION_CORRECTION_FRAMES = 60.0
+_SHARED_DECODE_MAX_SAMPLES = 64 * 1024 * 1024  # 256 MB of float32 samples
+_PREPARED_FILE_COUNT = 3  # Number of recently used files kept ready to play
+_PREPARED_MAX_SAMPLES = 64 * 1024 * 1024  # Decoded audio they may hold in total
 _DEFAULT_STATE = {
     'position': 0.0,
     'speed': 1.0,
@@ -23,8 +27,68 @@ _DEFAULT_STATE = {
 }
 
 
+class _FileMetadata(object):
+    """ The duration and tags of a file, as read by the AudioDecoder that
+    opened it """
+
+    def __init__(self, decoder):
+        self.duration = decoder.duration
+        self.title = decoder.title
+        self.artist = decoder.artist
+        self.album = decoder.album
+
+
+class _PreparedFile(object):
+    """ The audio pipeline of a file up to the time stretcher, and the file's
+    metadata, ready to be played from `position`. `shared_decoder` is None if
+    the file is read by a PCMDecoder. """
+
+    def __init__(self, file_path, position=0.0):
+        # The audio stack is imported when first needed, because importing
+        # it loads GStreamer, which slows down startup
+        from .audio import (AudioMetadata, AudioDecoder, PCMDecoder, SharedDecoder,
+                            DecoderBuffer, Looper, TimeStretcher, open_decoder)
+
+        self.file_path = file_path
+
+        # The decoder reads the metadata while opening the file, so the file
+        # only needs to be probed separately if it couldn't find the duration
+        decoder = self.decoder = open_decoder(file_path)
+        self.metadata = _FileMetadata(decoder)
+        if self.metadata.duration <= 0:
+            self.metadata = AudioMetadata(file_path)
+
+        if isinstance(decoder, PCMDecoder):
+            # Uncompressed audio is read straight from the file, so there is
+            # nothing to gain from keeping it in memory
+            self.shared_decoder = None
+            self.audio_decoder = decoder
+        else:
+            # The file is decoded once for playback and any decoders returned
+            # by Player.open_decoder(). Private decoders seek with the seek
+            # index recorded by the shared decoder.
+            def open_private_decoder():
+                private_decoder = AudioDecoder(file_path)
+                private_decoder.set_seek_index(decoder.get_seek_index())
+                return private_decoder
+            self.shared_decoder = SharedDecoder(open_private_decoder,
+                                                _SHARED_DECODE_MAX_SAMPLES, decoder)
+            self.audio_decoder = self.shared_decoder.reader()
+        self.decoder_buffer = DecoderBuffer(self.audio_decoder, 4096)
+        self.looper = Looper(self.decoder_buffer)
+        self.time_stretcher = TimeStretcher(self.looper)
+        self.position = 0.0
+        if position > 0 and self.time_stretcher.seek(position):
+            self.position = position
+
+
 class Player(EventDispatcher):
-    """ Audio player engine """
+    """ Audio player engine
+
+    The pipelines of the last few files played, and of any files passed to
+    `prepare_files`, are kept ready (within a budget of decoded audio) so that
+    they can be opened again straight away.
+    """
 
     playing = BooleanProperty(False)  # Set to True to play, False to pause
     position = NumericProperty(0.0)   # Current playback position in file in seconds
@@ -45,6 +109,10 @@ class Player(EventDispatcher):
         self.register_event_type('on_itunes_library_found')
         super(Player, self).__init__(**kwargs)
 
+        self._prepared_file = None  # _PreparedFile of the open file
+        self._prepared_files = OrderedDict()  # Others, by path, least recently used first
+        self._prepared_files_lock = threading.Lock()
+        self._shared_decoder = None
         self._audio_decoder = None
         self._decoder_buffer = None
         self._looper = None
@@ -56,35 +124,70 @@ class Player(EventDispatcher):
         self._position_sync_interval = None  # ClockEvent for position sync
 
     def open_file(self, file_path):
-        """ Open an audio file"""
+        """ Open an audio file. A prepared file is opened at the position it
+        was prepared at, keeping the selection for the caller to restore;
+        any other file is opened at the start, with all of it selected. """
+        from .audio import AudioOutput, decoder_pool
+
+        with self._prepared_files_lock:
+            prepared_file = self._prepared_files.pop(file_path, None)
+        was_prepared = prepared_file is not None
+        if not was_prepared:
+            prepared_file = _PreparedFile(file_path)
+
         if self._audio_output is not None:
             self._audio_output.close()
 
-        # Build audio pipeline
-        self._audio_decoder = AudioDecoder(file_path)
-        self._decoder_buffer = DecoderBuffer(self._audio_decoder, 4096)
-        self._looper = Looper(self._decoder_buffer)
-        self._time_stretcher = TimeStretcher(self._looper)
+        # Keep the previous file's pipeline ready in case it is opened again
+        previous_file = self._prepared_file
+        self._prepared_file = prepared_file
+        self._filepath = file_path
+        if previous_file is not None:
+            previous_file.time_stretcher.eos_callback = None
+            previous_file.position = self.position
+            self._keep_prepared_file(previous_file)
+
+        self._shared_decoder = prepared_file.shared_decoder
+        self._audio_decoder = prepared_file.audio_decoder
+        self._decoder_buffer = prepared_file.decoder_buffer
+        self._looper = prepared_file.looper
+        self._time_stretcher = prepared_file.time_stretcher
         self._time_stretcher.eos_callback = self.on_eos
         self._audio_output = AudioOutput(self._time_stretcher)
 
-        self._previous_pipeline_position = 0.0
+        self._previous_pipeline_position = prepared_file.position
         self._position_error = 0.0
         self._position_correction_increment = 0.0
 
+        # The pipeline is already at the prepared position, and seeking it
+        # again would discard the audio decoded from there
         self.playing = False
-        self.seek(0)
+        self.position = prepared_file.position
         self.speed = 1
         self.pitch = 0
 
-        self.load_metadata(file_path)
-
-        # Success. Update self.file_path
-        self._filepath = file_path
-
-    def load_metadata(self, file_path):
-        """" Populate the player's metadata properties from the tags found in the file and/or the user's iTunes library. """
-        metadata = AudioMetadata(file_path)
+        self.load_metadata(file_path, prepared_file.metadata, reset=False)
+        if not was_prepared:
+            self.selection_start = 0
+            self.selection_end = self.duration
+        # The looper of a prepared file may still be looping the selection
+        # it had when it was last open
+        self.on_looping_enabled(self, self.looping_enabled)
+
+        # Have a pipeline ready for opening the next file
+        decoder_pool.prewarm()
+
+    def load_metadata(self, file_path, metadata=None, reset=True):
+        """" Populate the player's metadata properties from the tags found in the file and/or the user's iTunes library.
+        `metadata` is the file's metadata, if it has already been read. Unless `reset` is False, playback is also
+        stopped and rewound, with the speed and pitch reset and the whole file selected. """
+        from .audio import AudioMetadata
+
+        if metadata is None:
+            if self._prepared_file is not None and file_path == self._filepath:
+                metadata = self._prepared_file.metadata
+            else:
+                metadata = AudioMetadata(file_path)
         self.duration = metadata.duration
         if metadata.title == '':
             if self._itunes_library is not None:
@@ -99,12 +202,74 @@ class Player(EventDispatcher):
         self.title = metadata.title
         self.artist = metadata.artist
         self.album = metadata.album
-        self.playing = False
-        self.seek(0)
-        self.speed = 1
-        self.pitch = 0
-        self.selection_start = 0
-        self.selection_end = self.duration
+        if reset:
+            self.playing = False
+            self.seek(0)
+            self.speed = 1
+            self.pitch = 0
+            self.selection_start = 0
+            self.selection_end = self.duration
+
+    def open_decoder(self, channels=0, samplerate=0):
+        """ Return a new decoder for the open file. If the whole file fits in
+        the memory set aside for decoding it once for playback and other
+        uses, the decoder shares the decoded audio with playback, and the
+        arguments are ignored. Uncompressed files are read by a PCMDecoder at
+        their own sample rate, which is faster than resampling them.
+        Otherwise, a separate AudioDecoder is opened that converts the audio
+        to `channels` and `samplerate` (0 for the file's own). """
+        from .audio import open_decoder
+
+        shared_decoder = self._shared_decoder
+        if shared_decoder is None:
+            return open_decoder(self._filepath, channels)
+        samples = self.duration * shared_decoder.channels * shared_decoder.samplerate
+        if shared_decoder.shared and samples <= _SHARED_DECODE_MAX_SAMPLES:
+            return shared_decoder.reader()
+        decoder = open_decoder(self._filepath, channels, samplerate)
+        seek_index = self.seek_index
+        if seek_index is not None and hasattr(decoder, 'set_seek_index'):
+            decoder.set_seek_index(seek_index)
+        return decoder
+
+    def prepare_files(self, files):
+        """ Prepare the pipelines of `files`, a list of (file path, position)
+        tuples in order of priority, in a background thread, so that
+        `open_file` can open them straight away. Files that can't be opened
+        are skipped. """
+        def prepare():
+            for file_path, position in files:
+                with self._prepared_files_lock:
+                    if file_path in self._prepared_files or file_path == self._filepath:
+                        continue
+                try:
+                    prepared_file = _PreparedFile(file_path, position)
+                except IOError:
+                    continue
+                self._keep_prepared_file(prepared_file)
+
+        thread = threading.Thread(target=prepare, name='prepare-files')
+        thread.daemon = True
+        thread.start()
+
+    def _keep_prepared_file(self, prepared_file):
+        """ Add `prepared_file` to the most recently used end of the prepared
+        files, dropping the least recently used ones to stay within the
+        budget """
+        with self._prepared_files_lock:
+            if prepared_file.file_path == self._filepath:
+                return
+            self._prepared_files.pop(prepared_file.file_path, None)
+            self._prepared_files[prepared_file.file_path] = prepared_file
+            dropped = []
+            while (len(self._prepared_files) > _PREPARED_FILE_COUNT
+                   or sum(f.shared_decoder.samples_decoded for f in self._prepared_files.values()
+                          if f.shared_decoder is not None)
+                   > _PREPARED_MAX_SAMPLES):
+                dropped.append(self._prepared_files.popitem(last=False)[1])
+        # Their decoders are freed (and their pipelines returned to the
+        # decoder pool) outside the lock
+        del dropped
 
     def load_itunes_library(self):
         if self._itunes_library is None:
@@ -210,6 +375,24 @@ class Player(EventDispatcher):
     def file_path(self):
         return self._filepath
 
+    @property
+    def seek_index(self):
+        """ The seek index (see AudioDecoder.get_seek_index) of the open
+        file, or None if the file isn't read by an AudioDecoder """
+        if self._prepared_file is None:
+            return None
+        decoder = self._prepared_file.decoder
+        if not hasattr(decoder, 'get_seek_index'):
+            return None
+        return decoder.get_seek_index()
+
+    @seek_index.setter
+    def seek_index(self, seek_index):
+        """ Use a seek index saved from an earlier decode of the open file """
+        if self._prepared_file is not None and hasattr(self._prepared_file.decoder,
+                                                        'set_seek_index'):
+            self._prepared_file.decoder.set_seek_index(seek_index)
+
     @property
     def state(self):
         """ Returns a dictionary of class properties related to the player state."""
@@ -218,10 +401,12 @@ class Player(EventDispatcher):
     @state.setter
     def state(self, values):
         """ Populates the class state properties. """
+        position = self.position
         for prop_name, default in _DEFAULT_STATE.iteritems():
             setattr(self, prop_name, values.get(prop_name, default))
-        if 'position' in values:
-            self.seek(values['position'])
+        # Don't seek if already there, as seeking discards decoded audio
+        if self.position != position:
+            self.seek(self.position)
 
     def _sync_position(self, dt):
         """ Update the `position` property from the pipeline position, using interpolation
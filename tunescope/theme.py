@@ -2,7 +2,7 @@ import os.path
 import json
 
 from kivy.event import EventDispatcher
-from kivy.properties import ListProperty
+from kivy.properties import ListProperty, StringProperty
 from kivy.utils import get_color_from_hex
 
 from .util import get_data_dir
@@ -22,8 +22,11 @@ class Theme(EventDispatcher):
     icon_color                  = ListProperty([1, 1, 1, 1])
     pitch_plot_background_color = ListProperty([0, 0, 0, 1])
     pitch_plot_line_color       = ListProperty([1, 1, 1, 1])
+    waveform_peak_color         = ListProperty([1, 1, 1, 0.4])
+    waveform_rms_color          = ListProperty([1, 1, 1, 0.8])
     progress_background_color   = ListProperty([0, 0, 0, 1])
     progress_text_color         = ListProperty([1, 1, 1, 1])
+    spectrogram_colormap        = StringProperty('viridis')
 
     def __init__(self, **kwargs):
         super(EventDispatcher, self).__init__(**kwargs)
@@ -32,6 +35,10 @@ class Theme(EventDispatcher):
     def load_theme(self, file_path):
         with open(file_path) as f:
             theme = json.load(f)
-        for prop_name in self.properties().keys():
-            if prop_name in theme:
+        for prop_name, prop in self.properties().items():
+            if prop_name not in theme:
+                continue
+            if isinstance(prop, ListProperty):
                 setattr(self, prop_name, get_color_from_hex(theme[prop_name]))
+            else:
+                setattr(self, prop_name, theme[prop_name])
@@ -0,0 +1,24 @@
+from __future__ import division
+
+import numpy as np
+
+
+def decimate_min_max(values, bucket_count):
+    """ Reduce the 1D ndarray `values` to at most 2 * `bucket_count` points
+    for drawing as a line. `values` is split into `bucket_count` buckets of
+    (nearly) equal length, and the minimum and maximum of each bucket are
+    kept, so that peaks survive the decimation. If there are no more than
+    2 * `bucket_count` values, all of them are kept.
+
+    Return a tuple (x, y) of ndarrays, where x holds the (fractional) indices
+    of the points in `values` and y their values.
+    """
+    if len(values) <= 2 * bucket_count:
+        return np.arange(len(values), dtype=np.float32), values
+    starts = np.arange(bucket_count) * len(values) // bucket_count
+    centers = (starts + np.append(starts[1:], len(values)) - 1) / 2
+    x = np.repeat(centers, 2)
+    y = np.empty(2 * bucket_count, dtype=values.dtype)
+    y[0::2] = np.minimum.reduceat(values, starts)
+    y[1::2] = np.maximum.reduceat(values, starts)
+    return x, y
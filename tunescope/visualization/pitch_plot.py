@@ -4,26 +4,52 @@ from functools import partial
 import numpy as np
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.properties import NumericProperty, ObjectProperty, ListProperty
-from kivy.graphics import Color, Scale, Line
+from kivy.graphics import Color, Line
 from kivy.clock import Clock
 from kivy.metrics import dp
 
+from .lines import decimate_min_max
+from .viewport import visible_x_range
+
+
+# Width, as a fraction of the visible width, of the region drawn beyond each
+# side of the visible part of the plot, so that it can be scrolled a little
+# without drawing the line again
+_DRAW_MARGIN = 1.0
+
 
 class PitchPlot(RelativeLayout):
     """ A plot of MIDI pitch over time
 
-    All public methods may be safely called from a non-GUI thread.
+    The pitches are kept in an ndarray, and only the part of the plot that is
+    visible through `viewport` (plus a margin) is drawn, as a line with at
+    most a minimum and a maximum point per pixel. The line is drawn again
+    when the plot is resized, scrolled beyond the drawn region, or given new
+    data in the drawn region.
+
+    `prepare` and `add_data` may be safely called from a non-GUI thread.
     """
 
     line_color = ListProperty([0, 0, 0, 1])
 
+    viewport = ObjectProperty(None, allownone=True)
+    """ The ScrollView through which the plot is seen """
+
     def __init__(self, **kwargs):
         super(PitchPlot, self).__init__(**kwargs)
-        self._scale_matrix = None
+        self._data_length = 1
+        self._pitches = np.zeros(0, dtype=np.float32)
+        self._pitches_plotted = 0
+        self._max_pitch = 1
+        self._line = None
+        self._drawn_range = None  # (x_start, x_end) of the drawn line
+        self._drawn_max_pitch = None
+        self._draw_trigger = Clock.create_trigger(self._draw)
 
     def prepare(self, data_length):
         """ Prepare the canvas for a new plot """
         self._data_length = data_length
+        self._pitches = np.zeros(data_length, dtype=np.float32)
         self._pitches_plotted = 0
         self._max_pitch = 1
         Clock.schedule_once(self._prepare_canvas, 0)
@@ -31,33 +57,70 @@ class PitchPlot(RelativeLayout):
     def _prepare_canvas(self, dt):
         self.canvas.clear()
         with self.canvas:
-            self._scale_matrix = Scale(1, 1, 1)
             Color(*self.line_color)
-        self._update_scale_matrix()
+            self._line = Line(points=[], width=dp(1))
+        self._drawn_range = None
+        self._draw_trigger()
 
     def add_data(self, pitches):
         """ Append ndarray `pitches` to the plot """
-        max_pitch = pitches.max()
-        if max_pitch > self._max_pitch:
-            self._max_pitch = max_pitch
-            self._update_scale_matrix()
-        points = np.empty((len(pitches), 2), dtype=np.float32)
-        points[:, 0] = np.arange(
-            self._pitches_plotted,
-            self._pitches_plotted + len(pitches),
-            dtype=np.float32)
-        points[:, 1] = pitches
-        points = list(points.flatten())
-        Clock.schedule_once(partial(self._plot, points), 0)
-        self._pitches_plotted += len(pitches)
-
-    def _plot(self, points, dt):
-        self.canvas.add(Line(points=points, width=dp(1)))
+        start = self._pitches_plotted
+        end = min(start + len(pitches), len(self._pitches))
+        if end == start:
+            return
+        self._pitches[start:end] = pitches[:end - start]
+        self._max_pitch = max(self._max_pitch, self._pitches[start:end].max())
+        self._pitches_plotted = end
+        Clock.schedule_once(partial(self._on_data_added, start, end), 0)
+
+    def _on_data_added(self, start, end, dt):
+        if self._drawn_range is None or self._max_pitch != self._drawn_max_pitch:
+            self._draw_trigger()
+            return
+        x_scale = self.width / float(self._data_length)
+        x_start, x_end = self._drawn_range
+        if start * x_scale < x_end and end * x_scale > x_start:
+            self._draw_trigger()
+
+    def on_viewport(self, instance, viewport):
+        if viewport is not None:
+            viewport.bind(scroll_x=self._on_scroll, size=self._draw_trigger)
+
+    def _on_scroll(self, *args):
+        """ Draw the line again if the visible region is no longer within
+        the drawn region """
+        if self._drawn_range is None:
+            return
+        x_start, x_end = visible_x_range(self, self.viewport)
+        drawn_start, drawn_end = self._drawn_range
+        if max(x_start, 0) < drawn_start or min(x_end, self.width) > drawn_end:
+            self._draw_trigger()
 
     def on_size(self, *args):
-        self._update_scale_matrix()
+        self._draw_trigger()
+
+    def _draw(self, *args):
+        """ Draw the visible part of the plot and its margins """
+        if self._line is None or self.width == 0:
+            return
+
+        x_start, x_end = visible_x_range(self, self.viewport)
+        margin = (x_end - x_start) * _DRAW_MARGIN
+        x_start = max(x_start - margin, 0)
+        x_end = min(x_end + margin, self.width)
+        self._drawn_range = (x_start, x_end)
+        self._drawn_max_pitch = self._max_pitch
+
+        x_scale = self.width / float(self._data_length)
+        i_start = max(int(math.floor(x_start / x_scale)), 0)
+        i_end = min(int(math.ceil(x_end / x_scale)) + 1, self._pitches_plotted)
+        if i_end - i_start < 2:
+            self._line.points = []
+            return
 
-    def _update_scale_matrix(self):
-        if self._scale_matrix:
-            self._scale_matrix.x = self.width / self._data_length
-            self._scale_matrix.y = self.height / self._max_pitch
+        x, y = decimate_min_max(self._pitches[i_start:i_end],
+                                max(int(math.ceil(x_end - x_start)), 1))
+        points = np.empty(2 * len(x), dtype=np.float32)
+        points[0::2] = (x + i_start) * x_scale
+        points[1::2] = y * (self.height / self._max_pitch)
+        self._line.points = points.tolist()
@@ -1,8 +1,31 @@
+cimport cython
 import numpy as np
 cimport numpy as np
 from libc.math cimport ceil
 
 
+# Spectra are normalized by the loudest bin of each time step, but quiet
+# passages are not amplified by more than 1 / _MIN_NORMALIZATION_PEAK
+DEF _MIN_NORMALIZATION_PEAK = 0.03
+
+# Number of time steps render_spectra() processes at a time
+DEF _RENDER_BLOCK_SIZE = 64
+
+# Resolution of the lookup table that replaces log10() in render_spectra()
+DEF _INTENSITY_LUT_SIZE = 4096
+
+# Number of distinct values in the intensity images produced by
+# render_spectra(), which is also the required size of colormaps
+INTENSITY_LEVELS = 256
+
+_log_axis_weights_cache = {}
+
+
+ctypedef fused spectrum_t:
+    float
+    unsigned char
+
+
 cpdef np.ndarray[np.float32_t] log_axis(np.ndarray[np.float32_t, ndim=2] input_spectra):
     """
     Given an array of spectra (row=time, col=bin) whose bins are linearly spaced
@@ -40,3 +63,159 @@ cpdef np.ndarray[np.float32_t] log_axis(np.ndarray[np.float32_t, ndim=2] input_s
                           0))
 
     return output_spectra
+
+
+cdef tuple _log_axis_weights(int bins):
+    """
+    Return the input-to-output bin weights used by log_axis() for spectra with
+    `bins` bins, in compressed sparse row form: the weights for output bin
+    `obin` are `weights[offsets[obin]:offsets[obin + 1]]`, applied to input bins
+    `indices[offsets[obin]:offsets[obin + 1]]`.
+    """
+    if bins in _log_axis_weights_cache:
+        return _log_axis_weights_cache[bins]
+
+    cdef float max_bin = bins - 1
+    cdef float ratio = max_bin ** (1. / (max_bin - 1))
+    cdef int ibin, obin
+    cdef float ibin_upper_bound, ibin_lower_bound
+    cdef float obin_lower_bound, obin_upper_bound
+    cdef float overlap
+
+    offsets = [0]
+    indices = []
+    weights = []
+    for obin in range(bins):
+        obin_lower_bound = 0 if obin == 0 else ratio ** (obin - 0.5 - 1)
+        obin_upper_bound = min(ratio ** (obin + 0.5 - 1), max_bin)
+
+        for ibin in range(<int> obin_lower_bound,
+                          <int> ceil(obin_upper_bound) + 1):
+            ibin_upper_bound = max(ibin - 0.5, 0)
+            ibin_lower_bound = min(ibin + 0.5, max_bin)
+            overlap = max(min(obin_upper_bound, ibin_lower_bound)
+                          - max(obin_lower_bound, ibin_upper_bound),
+                          0)
+            if overlap > 0:
+                indices.append(ibin)
+                weights.append(overlap / (ibin_lower_bound - ibin_upper_bound))
+        offsets.append(len(indices))
+
+    result = (np.array(offsets, dtype=np.int32),
+              np.array(indices, dtype=np.int32),
+              np.array(weights, dtype=np.float32))
+    _log_axis_weights_cache[bins] = result
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def render_spectra(
+        spectrum_t[:, :] spectra,
+        unsigned char[:, ::1] intensities,
+        int x_offset=0,
+        float[:] magnitudes=None):
+    """
+    Render an array of linear-frequency FFT magnitude spectra (row=time,
+    col=bin), either float32 or uint8 indices into the lookup table
+    `magnitudes` (see analysis.UINT8_SPECTRUM_MAGNITUDES), into an image of
+    `intensities` (row=output bin, col=time) ranging from 0 to
+    INTENSITY_LEVELS - 1, in a single pass. This is equivalent to
+    applying log_axis(), normalizing each time step by its loudest bin,
+    compressing with log10(x * 9 + 1) and quantizing the result to
+    INTENSITY_LEVELS levels (give or take one level), but without allocating
+    any full-size temporary arrays. Use apply_colormap() to turn the
+    intensities into pixels.
+
+    The lowest output bin is dropped, so `intensities` must have at least
+    `spectra.shape[1] - 1` rows. Time step `t` is written to column
+    `x_offset + t`, which allows rendering directly into part of a larger
+    image.
+    """
+    cdef int duration = spectra.shape[0]
+    cdef int bins = spectra.shape[1]
+
+    if intensities.shape[0] < bins - 1 or intensities.shape[1] < x_offset + duration:
+        raise ValueError("intensity buffer too small")
+    if spectrum_t is not float and (magnitudes is None or magnitudes.shape[0] < 256):
+        raise ValueError("uint8 spectra require a 256-entry magnitude table")
+
+    cdef int[:] offsets, indices
+    cdef float[:] weights
+    offsets, indices, weights = _log_axis_weights(bins)
+
+    # Map normalized magnitudes (quantized to _INTENSITY_LUT_SIZE steps) to
+    # intensity levels, saving a log10() per pixel
+    cdef unsigned char[:] levels = np.clip(
+        (np.log10(np.linspace(0, 1, _INTENSITY_LUT_SIZE, dtype=np.float32) * 9 + 1)
+         * INTENSITY_LEVELS).astype(np.int32),
+        0, INTENSITY_LEVELS - 1).astype(np.uint8)
+
+    # Time steps are processed in blocks so that intensities can be written
+    # row by row rather than with a stride of a whole row per bin
+    cdef float[:, :] block = np.empty((_RENDER_BLOCK_SIZE, bins), dtype=np.float32)
+    cdef float[:] peaks = np.empty(_RENDER_BLOCK_SIZE, dtype=np.float32)
+
+    cdef int block_start, block_length, t, obin, k
+    cdef float value, peak
+    cdef unsigned char *intensity
+
+    with nogil:
+        for block_start in range(0, duration, _RENDER_BLOCK_SIZE):
+            block_length = min(_RENDER_BLOCK_SIZE, duration - block_start)
+
+            for t in range(block_length):
+                peak = 0
+                for obin in range(bins):
+                    value = 0
+                    for k in range(offsets[obin], offsets[obin + 1]):
+                        if spectrum_t is float:
+                            value = value + spectra[block_start + t, indices[k]] * weights[k]
+                        else:
+                            value = value + (magnitudes[spectra[block_start + t, indices[k]]]
+                                             * weights[k])
+                    block[t, obin] = value
+                    if value > peak:
+                        peak = value
+                peaks[t] = min(max(peak, _MIN_NORMALIZATION_PEAK), 1)
+
+            for obin in range(1, bins):
+                intensity = &intensities[obin - 1, x_offset + block_start]
+                for t in range(block_length):
+                    value = block[t, obin] / peaks[t]
+                    if value >= 1:
+                        intensity[t] = levels[_INTENSITY_LUT_SIZE - 1]
+                    else:
+                        intensity[t] = levels[<int> (value * (_INTENSITY_LUT_SIZE - 1) + 0.5)]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef apply_colormap(
+        unsigned char[:, :] intensities,
+        unsigned char[:, ::1] colormap,
+        unsigned char[:, :, ::1] pixels):
+    """
+    Convert an image of `intensities` as produced by render_spectra() to RGB
+    `pixels` of the same height and width (ubyte RGB), using the
+    INTENSITY_LEVELS-entry `colormap` as a lookup table.
+    """
+    if colormap.shape[0] != INTENSITY_LEVELS or colormap.shape[1] != 3:
+        raise ValueError("colormap must have {} RGB entries".format(INTENSITY_LEVELS))
+    if (pixels.shape[0] != intensities.shape[0]
+            or pixels.shape[1] != intensities.shape[1]):
+        raise ValueError("pixel buffer size does not match intensities")
+
+    cdef int y, x
+    cdef unsigned char level
+    cdef unsigned char *pixel
+
+    with nogil:
+        for y in range(intensities.shape[0]):
+            pixel = &pixels[y, 0, 0]
+            for x in range(intensities.shape[1]):
+                level = intensities[y, x]
+                pixel[0] = colormap[level, 0]
+                pixel[1] = colormap[level, 1]
+                pixel[2] = colormap[level, 2]
+                pixel += 3
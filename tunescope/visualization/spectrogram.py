@@ -1,22 +1,38 @@
 import math
+import threading
 from functools import partial
 
 import numpy as np
 from kivy.uix.relativelayout import RelativeLayout
-from kivy.properties import NumericProperty, ObjectProperty, ListProperty
+from kivy.properties import (
+    NumericProperty, ObjectProperty, ListProperty, OptionProperty, StringProperty)
 from kivy.graphics import Color, Scale, Line, Rectangle
 from kivy.graphics.texture import Texture
 from kivy.graphics.instructions import InstructionGroup
 from kivy.clock import Clock
 from kivy.metrics import dp
 
-from .colormaps import viridis
-from .processing import log_axis
+from ..analysis import UINT8_SPECTRUM_MAGNITUDES
+from .colormaps import COLORMAP_NAMES, colormap_lut
+from .processing import apply_colormap, render_spectra
+from .tiles import TilePyramid
+from .viewport import visible_x_range
+
+
+# Width in data points (hops) of each spectrogram tile
+_TILE_WIDTH = 512
+
+# Number of tiles kept on the GPU beyond each side of the visible region
+_TILE_MARGIN = 1
+
+# Largest rendered spectrogram (level 0 of the pyramid) kept in memory. Larger
+# ones are kept in a file in `scratch_directory`, if set.
+_MAX_IN_MEMORY_BYTES = 128 * 1024 * 1024
 
 
 def spectra_to_pixels(spectra, colormap):
-    """spectra dimensions: 
-        rows must be a power of 2 
+    """spectra dimensions:
+        rows must be a power of 2
         collumns must be a power of 2 + 1"""
     colormap_indices = np.clip(
         (spectra[:,1:].T.flatten() * len(colormap)).astype(np.int32),
@@ -26,48 +42,327 @@ def spectra_to_pixels(spectra, colormap):
     return pixels, size
 
 
+def _prepare_spectra(spectra):
+    """ Return `spectra` in a format accepted by render_spectra(), along
+    with the magnitude table it requires (None if not uint8) """
+    if spectra.dtype == np.uint8:
+        return spectra, UINT8_SPECTRUM_MAGNITUDES
+    return spectra.astype(np.float32, copy=False), None
+
+
 class Spectrogram(RelativeLayout):
+    """ A spectrogram plot
+
+    The rendered spectrogram is kept in memory as a pyramid of rows of
+    fixed-width tiles of intensity levels, with each level half as wide as the
+    one below. Only the tiles of the level that best matches the current zoom
+    that are visible through `viewport` are colorized and uploaded to the GPU,
+    using textures recycled from a pool. Changing the colormap or the
+    black and white levels only colorizes the displayed tiles again.
+
+    The pyramid of a long recording, whose level 0 would take more than
+    _MAX_IN_MEMORY_BYTES, is kept in a temporary file in `scratch_directory`
+    (if set) and mapped in a tile at a time, so that memory use doesn't grow
+    with the length of the recording.
+
+    Before the data arrives, the plot may be roughly filled in with
+    `add_overview_data`.
+
+    A more detailed spectrogram of part of the plot (see `show_detail`) may
+    be drawn over it.
+
+    `prepare`, `add_data` and `add_overview_data` may be safely called from
+    non-GUI threads.
+    """
+
+    viewport = ObjectProperty(None, allownone=True)
+    """ The ScrollView through which the spectrogram is seen """
+
+    colormap = OptionProperty('viridis', options=list(COLORMAP_NAMES))
+    """ Name of the colormap (one of colormaps.COLORMAP_NAMES) """
+
+    black_level = NumericProperty(0.0)
+    """ Intensity (0-1) shown as the bottom of the colormap """
+
+    white_level = NumericProperty(1.0)
+    """ Intensity (0-1) shown as the top of the colormap """
+
+    scratch_directory = StringProperty(None, allownone=True)
+    """ Directory for the files of spectrograms too large to keep in memory """
 
     def __init__(self, **kwargs):
         super(Spectrogram, self).__init__(**kwargs)
         self._scale_matrix = None
-        self._colormap = (np.array(viridis) * 255).astype(np.uint8)
+        self._colormap = colormap_lut(self.colormap, self.black_level, self.white_level)
+        self._data_length = 1
+        self._spectra_plotted = 0
+        self._columns_filled = 0  # Including columns filled by overview data
+        self._data_lock = threading.Lock()
+        self._pyramid = None
+        self._level = 0  # Pyramid level currently displayed
+        self._tile_group = None
+        self._displayed_tiles = {}  # tile index => Rectangle
+        self._upload_buffer = None  # RGB pixels of the tile being uploaded
+        self._texture_pool = []
+        self._dirty_tiles = set()
+        self._update_tiles_trigger = Clock.create_trigger(self._update_tiles)
+        self._detail = None  # (start, end, bottom, top) of the detail overlay
+        self._detail_intensities = None
+        self._detail_rectangle = None
+        self.bind(colormap=self._update_colormap,
+                  black_level=self._update_colormap,
+                  white_level=self._update_colormap)
 
     def prepare(self, data_length):
         """ Prepare the canvas for a new plot """
-        self._data_length = data_length
-        self._spectra_plotted = 0
-        self._max_texture_height = 1
+        with self._data_lock:
+            self._data_length = data_length
+            self._spectra_plotted = 0
+            self._columns_filled = 0
+            self._pyramid = None
+            self._level = 0
         Clock.schedule_once(self._prepare_canvas, 0)
 
     def _prepare_canvas(self, dt):
         self.canvas.clear()
+        self.clear_detail()
+        self._displayed_tiles = {}
+        self._texture_pool = []
+        self._dirty_tiles = set()
         with self.canvas:
             self._scale_matrix = Scale(1, 1, 1)
             Color(1, 1, 1)
+        self._tile_group = InstructionGroup()
+        self.canvas.add(self._tile_group)
         self._update_scale_matrix()
+        self._update_tiles_trigger()
 
     def add_data(self, spectra):
-        spectra = log_axis(spectra)
-        spectra = spectra / np.clip(spectra.max(axis=1)[:,np.newaxis], 0.03, 1) # normalize
-        pixels, texture_size = spectra_to_pixels(np.log10(spectra * 9 + 1), self._colormap)
-        if texture_size[1] > self._max_texture_height:
-            self._max_texture_height = texture_size[1]
-            self._update_scale_matrix()
-        Clock.schedule_once(partial(self._plot_spectra, self._spectra_plotted, pixels, texture_size), 0)
-        self._spectra_plotted += len(spectra)
+        """ Append ndarray `spectra` (row=time, col=bin) to the plot. `spectra`
+        may be in any of the formats in analysis.SPECTRUM_FORMATS. """
+        spectra, magnitudes = _prepare_spectra(spectra)
+        with self._data_lock:
+            pyramid = self._get_pyramid(spectra.shape[1] - 1)
+            x_start = self._spectra_plotted
+            x_end = x_start + len(spectra)
+            tiles = pyramid.levels[0]
+            for tile_index, tile_x, start, end in tiles.spans(x_start, len(spectra)):
+                render_spectra(spectra[start:end], tiles.tile(tile_index), tile_x, magnitudes)
+            pyramid.update(x_start, x_end)
+            self._spectra_plotted = x_end
+            self._columns_filled = max(self._columns_filled, x_end)
+
+        Clock.schedule_once(partial(self._on_columns_changed, x_start, x_end), 0)
+
+    def add_overview_data(self, spectrum, x_start, x_end):
+        """ Fill the columns `x_start` to `x_end` of the plot with a single
+        time step `spectrum` (a 2D ndarray with one row, in any of the formats
+        accepted by `add_data`) that is representative of them. Columns
+        already plotted by `add_data` are left alone, and the rest will be
+        replaced as `add_data` reaches them. """
+        spectrum, magnitudes = _prepare_spectra(spectrum)
+        column = np.zeros((spectrum.shape[1] - 1, 1), dtype=np.uint8)
+        render_spectra(spectrum[:1], column, 0, magnitudes)
+        with self._data_lock:
+            pyramid = self._get_pyramid(len(column))
+            x_start = max(x_start, self._spectra_plotted)
+            x_end = min(x_end, self._data_length)
+            if x_end <= x_start:
+                return
+            pyramid.levels[0].write(
+                x_start, np.broadcast_to(column, (len(column), x_end - x_start)))
+            pyramid.update(x_start, x_end)
+            self._columns_filled = max(self._columns_filled, x_end)
+
+        Clock.schedule_once(partial(self._on_columns_changed, x_start, x_end), 0)
 
-    def _plot_spectra(self, x, pixels, texture_size, dt):
-        texture = Texture.create(size=texture_size)
-        texture.blit_buffer(pixels, colorfmt='rgb', bufferfmt='ubyte')
-        # rectangle = Rectangle(pos=(x, 0), size=texture_size)
-        rectangle = Rectangle(pos=(x, 0), size=texture_size, texture=texture)
-        self.canvas.add(rectangle)
+    def _get_pyramid(self, height):
+        """ Return the pyramid, (re)creating it if it doesn't exist or its
+        height is not `height` """
+        if self._pyramid is None or self._pyramid.height != height:
+            directory = None
+            if height * self._data_length > _MAX_IN_MEMORY_BYTES:
+                directory = self.scratch_directory
+            self._pyramid = TilePyramid(height, _TILE_WIDTH, self._data_length, directory)
+            Clock.schedule_once(lambda dt: self._update_scale_matrix(), 0)
+        return self._pyramid
+
+    def _on_columns_changed(self, x_start, x_end, dt):
+        """ Mark the displayed tiles that cover level-0 columns `x_start` to
+        `x_end` as needing to be uploaded again """
+        pyramid = self._pyramid
+        if pyramid is None:
+            return
+        # The level may not have been chosen for this pyramid yet;
+        # _update_tiles switches to the right one
+        level = min(self._level, len(pyramid.levels) - 1)
+        scale = 2 ** level
+        self._dirty_tiles.update(pyramid.levels[level].tile_range(
+            x_start // scale, -(-x_end // scale)))
+        self._update_tiles()
+
+    def show_detail(self, spectra, start, end, samplerate_ratio=1.0):
+        """ Draw `spectra`, in any of the formats accepted by `add_data`,
+        over the part of the plot from `start` to `end`, which are fractions
+        of the plot's width. `samplerate_ratio` is the sample rate of the
+        audio `spectra` were analyzed from divided by that of the plot.
+        `spectra` are aligned with the plot's frequency axis: the plot shows
+        through at frequencies they don't cover, and frequencies above the
+        plot's highest are left out. """
+        self.clear_detail()
+        pyramid = self._pyramid
+        if pyramid is None or len(spectra) == 0:
+            return
+        spectra, magnitudes = _prepare_spectra(spectra)
+        height = spectra.shape[1] - 1
+
+        # Both frequency axes are logarithmic from the frequency of bin 1
+        # (the sample rate divided by twice the height) to the Nyquist
+        # frequency, so the detail's axis is a linear part of the plot's,
+        # starting higher if its window is smaller, and shifted by the
+        # ratio of the sample rates
+        plot_height = pyramid.height
+        log_range = math.log(plot_height)
+        bottom = math.log(plot_height / float(height) * samplerate_ratio) / log_range
+        top = 1 + math.log(samplerate_ratio) / log_range
+        if top <= max(bottom, 0) or bottom >= 1:
+            return
+        self._detail = (start, end, bottom, top)
+
+        intensities = np.zeros((height, len(spectra)), dtype=np.uint8)
+        render_spectra(spectra, intensities, 0, magnitudes)
+        self._detail_intensities = intensities
+        texture = Texture.create(size=(len(spectra), height))
+        with self.canvas.after:
+            Color(1, 1, 1)
+            self._detail_rectangle = Rectangle(texture=texture)
+        self._upload_detail()
+        self._update_detail_rectangle()
+
+    def clear_detail(self):
+        """ Remove the detail drawn by `show_detail` """
+        self.canvas.after.clear()
+        self._detail = None
+        self._detail_intensities = None
+        self._detail_rectangle = None
+
+    def _upload_detail(self):
+        intensities = self._detail_intensities
+        pixels = np.empty(intensities.shape + (3,), dtype=np.uint8)
+        apply_colormap(intensities, self._colormap, pixels)
+        self._detail_rectangle.texture.blit_buffer(
+            pixels.reshape(-1), colorfmt='rgb', bufferfmt='ubyte')
+        self.canvas.ask_update()
+
+    def _update_colormap(self, *args):
+        """ Colorize the displayed tiles and the detail again with the
+        current colormap settings """
+        self._colormap = colormap_lut(self.colormap, self.black_level, self.white_level)
+        self._dirty_tiles.update(self._displayed_tiles)
+        self._update_tiles()
+        if self._detail_rectangle is not None:
+            self._upload_detail()
+
+    def _update_detail_rectangle(self):
+        if self._detail_rectangle is not None:
+            start, end, bottom, top = self._detail
+            # Only the part of the detail within the plot's frequencies is shown
+            visible_bottom = max(bottom, 0)
+            visible_top = min(top, 1)
+            v0 = (visible_bottom - bottom) / (top - bottom)
+            v1 = (visible_top - bottom) / (top - bottom)
+            self._detail_rectangle.pos = (start * self.width, visible_bottom * self.height)
+            self._detail_rectangle.size = ((end - start) * self.width,
+                                           (visible_top - visible_bottom) * self.height)
+            self._detail_rectangle.tex_coords = (0, v0, 1, v0, 1, v1, 0, v1)
+
+    def on_viewport(self, instance, viewport):
+        if viewport is not None:
+            viewport.bind(scroll_x=self._update_tiles_trigger,
+                          size=self._update_tiles_trigger)
+
+    def on_pos(self, *args):
+        self._update_tiles_trigger()
 
     def on_size(self, *args):
         self._update_scale_matrix()
+        self._update_detail_rectangle()
+        self._update_tiles_trigger()
+
+    def _update_tiles(self, *args):
+        """ Upload the tiles that are in view (or about to be) and release the
+        textures of those that are not """
+        pyramid = self._pyramid
+        if self._tile_group is None or pyramid is None or self.width == 0:
+            return
+
+        # Switch to the pyramid level that has about one column per pixel
+        level = pyramid.level_for_scale(self._data_length / float(self.width))
+        if level != self._level:
+            for tile_index in list(self._displayed_tiles):
+                self._hide_tile(tile_index)
+            self._level = level
+            self._update_scale_matrix()
+        tiles = pyramid.levels[level]
+
+        x_start, x_end = visible_x_range(self, self.viewport)
+        x_scale = self.width / float(self._data_length) * 2 ** level
+        visible_tiles = tiles.tile_range(x_start / x_scale, x_end / x_scale)
+        first = max(visible_tiles[0] - _TILE_MARGIN, 0) if visible_tiles else 0
+        last = visible_tiles[-1] + 1 + _TILE_MARGIN if visible_tiles else 0
+
+        for tile_index in list(self._displayed_tiles):
+            if not first <= tile_index < last:
+                self._hide_tile(tile_index)
+
+        for tile_index in range(first, min(last, len(tiles))):
+            if tile_index not in self._displayed_tiles:
+                self._show_tile(tile_index)
+            elif tile_index in self._dirty_tiles:
+                self._upload_tile(tile_index)
+        self._dirty_tiles.clear()
+
+    def _show_tile(self, tile_index):
+        # prepare() may drop the pyramid from the analysis thread at any time
+        pyramid = self._pyramid
+        if pyramid is None or pyramid.levels[self._level].get(tile_index) is None:
+            return
+        if self._texture_pool:
+            texture = self._texture_pool.pop()
+        else:
+            texture = Texture.create(size=(_TILE_WIDTH, pyramid.height))
+        rectangle = Rectangle(pos=(tile_index * _TILE_WIDTH, 0), texture=texture)
+        self._tile_group.add(rectangle)
+        self._displayed_tiles[tile_index] = rectangle
+        self._upload_tile(tile_index)
+
+    def _hide_tile(self, tile_index):
+        rectangle = self._displayed_tiles.pop(tile_index)
+        self._tile_group.remove(rectangle)
+        self._texture_pool.append(rectangle.texture)
+
+    def _upload_tile(self, tile_index):
+        pyramid = self._pyramid
+        if pyramid is None:
+            return
+        rectangle = self._displayed_tiles[tile_index]
+        height = pyramid.height
+        if self._upload_buffer is None or self._upload_buffer.shape[0] != height:
+            self._upload_buffer = np.empty((height, _TILE_WIDTH, 3), dtype=np.uint8)
+        apply_colormap(pyramid.levels[self._level].get(tile_index),
+                       self._colormap, self._upload_buffer)
+        rectangle.texture.blit_buffer(self._upload_buffer.reshape(-1),
+                                      colorfmt='rgb', bufferfmt='ubyte')
+
+        # Only show the part of the tile that has been filled in
+        level_columns_filled = -(-self._columns_filled // 2 ** self._level)
+        filled_width = min(_TILE_WIDTH, level_columns_filled - tile_index * _TILE_WIDTH)
+        u = filled_width / float(_TILE_WIDTH)
+        rectangle.size = (filled_width, height)
+        rectangle.tex_coords = (0, 0, u, 0, u, 1, 0, 1)
 
     def _update_scale_matrix(self):
-        if self._scale_matrix:
-            self._scale_matrix.x = self.width / self._data_length
-            self._scale_matrix.y = self.height / self._max_texture_height
+        pyramid = self._pyramid
+        if self._scale_matrix and pyramid is not None:
+            self._scale_matrix.x = self.width / self._data_length * 2 ** self._level
+            self._scale_matrix.y = self.height / pyramid.height
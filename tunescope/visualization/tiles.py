@@ -0,0 +1,189 @@
+from __future__ import division
+import math
+import tempfile
+
+import numpy as np
+
+
+class TileStore(object):
+    """ A CPU-side single-channel uint8 image of unbounded width, stored as a
+    row of fixed-size tiles that are allocated as they are first written. Each
+    tile is an ndarray of shape (height, tile_width).
+
+    Parameters
+    ----------
+    height : int
+        Height of the image (and of each tile) in pixels
+    tile_width : int
+        Width of each tile in pixels
+    """
+
+    def __init__(self, height, tile_width):
+        self.height = height
+        self.tile_width = tile_width
+        self._tiles = {}
+
+    def __len__(self):
+        """ Return the number of tiles, including unallocated tiles between
+        allocated ones """
+        if not self._tiles:
+            return 0
+        return max(self._tiles) + 1
+
+    def get(self, index):
+        """ Return the tile at `index`, or None if it hasn't been allocated """
+        return self._tiles.get(index)
+
+    def tile(self, index):
+        """ Return the tile at `index`, allocating a zero-filled tile if
+        necessary """
+        tile = self._tiles.get(index)
+        if tile is None:
+            tile = np.zeros((self.height, self.tile_width), dtype=np.uint8)
+            self._tiles[index] = tile
+        return tile
+
+    def tile_range(self, x_start, x_end):
+        """ Return the range of indices of tiles that intersect the columns
+        `x_start` (inclusive) to `x_end` (exclusive) """
+        first = max(int(math.floor(x_start / self.tile_width)), 0)
+        if x_end <= x_start:
+            return range(first, first)
+        last = max(int(math.ceil(x_end / self.tile_width)), first)
+        return range(first, last)
+
+    def spans(self, x, width):
+        """ Split the columns `x` to `x + width` along tile boundaries.
+        Return a list of tuples (tile_index, tile_x, start, end), where the
+        columns `start` to `end` (relative to `x`) belong to tile `tile_index`,
+        beginning at column `tile_x` of the tile. """
+        spans = []
+        start = 0
+        while start < width:
+            tile_index, tile_x = divmod(x + start, self.tile_width)
+            end = min(width, start + self.tile_width - tile_x)
+            spans.append((tile_index, tile_x, start, end))
+            start = end
+        return spans
+
+    def read(self, x, width):
+        """ Return a copy of the columns `x` to `x + width` as an ndarray of
+        shape (height, width). Unallocated columns read as zeros. """
+        data = np.zeros((self.height, width), dtype=np.uint8)
+        for tile_index, tile_x, start, end in self.spans(x, width):
+            tile = self.get(tile_index)
+            if tile is not None:
+                data[:, start:end] = tile[:, tile_x:tile_x + end - start]
+        return data
+
+    def write(self, x, data):
+        """ Write `data`, an ndarray of shape (height, width), to the columns
+        starting at `x` """
+        for tile_index, tile_x, start, end in self.spans(x, data.shape[1]):
+            self.tile(tile_index)[:, tile_x:tile_x + end - start] = data[:, start:end]
+
+    def clear(self):
+        """ Free all tiles """
+        self._tiles = {}
+
+
+class MappedTileStore(TileStore):
+    """ A TileStore whose tiles are kept in an anonymous temporary file
+    rather than in memory. Each tile returned is a fresh memory map of its
+    part of the file, so the tiles are only resident while they are in use,
+    and the memory used doesn't grow with the width of the image. The file
+    grows (sparsely) as tiles are allocated, and is deleted when the store is
+    garbage-collected.
+
+    Parameters
+    ----------
+    height : int
+        Height of the image (and of each tile) in pixels
+    tile_width : int
+        Width of each tile in pixels
+    directory : str
+        Directory in which to create the file, or None for the system's
+        temporary directory
+    """
+
+    def __init__(self, height, tile_width, directory=None):
+        super(MappedTileStore, self).__init__(height, tile_width)
+        self._file = tempfile.TemporaryFile(prefix='tunescope-tiles-', dir=directory)
+        self._allocated = set()
+
+    def __len__(self):
+        if not self._allocated:
+            return 0
+        return max(self._allocated) + 1
+
+    def get(self, index):
+        if index not in self._allocated:
+            return None
+        return self._map(index)
+
+    def tile(self, index):
+        tile = self._map(index)
+        self._allocated.add(index)
+        return tile
+
+    def _map(self, index):
+        # Mapping beyond the end of the file extends it with zeros
+        return np.memmap(self._file, dtype=np.uint8, mode='r+',
+                         offset=index * self.height * self.tile_width,
+                         shape=(self.height, self.tile_width))
+
+    def clear(self):
+        self._file.truncate(0)
+        self._allocated = set()
+
+
+class TilePyramid(object):
+    """ A stack of TileStores in which each level is half the width of the
+    level below it, for drawing zoomed-out views without sampling more columns
+    than there are pixels. Level 0 is written directly; call `update` after
+    writing it to bring the higher levels up to date. Each column of a higher
+    level is the maximum of the two corresponding columns of the level below.
+
+    Parameters
+    ----------
+    height : int
+        Height of the image in pixels
+    tile_width : int
+        Width of each tile in pixels
+    width : int
+        Expected final width of level 0. Levels are added until a level fits
+        in a single tile.
+    directory : str, optional
+        If given, the levels are MappedTileStores with their files in
+        `directory`, for images too large to keep in memory
+    """
+
+    def __init__(self, height, tile_width, width, directory=None):
+        self.height = height
+        self.tile_width = tile_width
+        level_count = 1
+        while width > tile_width:
+            width = int(math.ceil(width / 2))
+            level_count += 1
+        if directory is None:
+            self.levels = [TileStore(height, tile_width) for _ in range(level_count)]
+        else:
+            self.levels = [MappedTileStore(height, tile_width, directory)
+                           for _ in range(level_count)]
+
+    def update(self, x_start, x_end):
+        """ Recompute the higher levels from the columns `x_start` (inclusive)
+        to `x_end` (exclusive) of level 0 """
+        for child, parent in zip(self.levels, self.levels[1:]):
+            x_start //= 2
+            x_end = int(math.ceil(x_end / 2))
+            columns = child.read(2 * x_start, 2 * (x_end - x_start))
+            parent.write(x_start, np.maximum(columns[:, 0::2], columns[:, 1::2]))
+
+    def level_for_scale(self, columns_per_pixel):
+        """ Return the index of the highest level that still has at least one
+        column per pixel when level 0 is drawn at `columns_per_pixel` """
+        if columns_per_pixel <= 1:
+            return 0
+        level = int(math.floor(math.log(columns_per_pixel, 2)))
+        return min(level, len(self.levels) - 1)
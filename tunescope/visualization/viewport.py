@@ -0,0 +1,10 @@
+def visible_x_range(widget, viewport):
+    """ Return the horizontal range (x_start, x_end), in the local coordinates
+    of `widget` (which must be a RelativeLayout), that is visible through
+    `viewport` (normally a ScrollView containing `widget`). If `viewport` is
+    None, the whole width of `widget` is considered visible. """
+    if viewport is None:
+        return 0, widget.width
+    window_x, window_y = viewport.to_window(viewport.x, viewport.y)
+    x_start, _ = widget.to_widget(window_x, window_y, relative=True)
+    return x_start, x_start + viewport.width
@@ -0,0 +1,120 @@
+import numpy as np
+from kivy.uix.widget import Widget
+from kivy.properties import NumericProperty, ListProperty
+from kivy.graphics import Color, Mesh, Rectangle
+from kivy.clock import Clock
+from kivy.metrics import dp
+
+
+class Waveform(Widget):
+    """ A strip showing the peak and RMS envelopes (see
+    analysis.encode_envelope) of a whole file, for navigating it. Touching
+    the strip dispatches `on_seek` with the touched position as a fraction
+    of the file's duration.
+
+    `prepare` and `add_data` may be safely called from a non-GUI thread.
+    """
+
+    peak_color = ListProperty([1, 1, 1, 0.4])
+    rms_color = ListProperty([1, 1, 1, 0.8])
+    marker_color = ListProperty([1, 1, 1, 1])
+
+    position = NumericProperty(0)
+    """ Position of the playback marker as a fraction of the file's duration """
+
+    __events__ = ('on_seek',)
+
+    def __init__(self, **kwargs):
+        super(Waveform, self).__init__(**kwargs)
+        self._envelope = np.zeros((0, 2), dtype=np.uint8)
+        self._data_added = 0
+        self._marker = None
+        self._draw_trigger = Clock.create_trigger(self._draw)
+        self.bind(pos=self._draw_trigger,
+                  size=self._draw_trigger,
+                  position=self._update_marker,
+                  peak_color=self._draw_trigger,
+                  rms_color=self._draw_trigger)
+
+    def prepare(self, data_length):
+        """ Clear the strip for an envelope of `data_length` hops """
+        self._envelope = np.zeros((data_length, 2), dtype=np.uint8)
+        self._data_added = 0
+        self._draw_trigger()
+
+    def add_data(self, envelope):
+        """ Append `envelope` to the strip """
+        start = self._data_added
+        end = min(start + len(envelope), len(self._envelope))
+        self._envelope[start:end] = envelope[:end - start]
+        self._data_added = end
+        self._draw_trigger()
+
+    def set_envelope(self, envelope):
+        """ Show the complete `envelope` of a file """
+        self.prepare(len(envelope))
+        self.add_data(envelope)
+
+    def on_seek(self, fraction):
+        pass
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(Waveform, self).on_touch_down(touch)
+        touch.grab(self)
+        self._seek_to_touch(touch)
+        return True
+
+    def on_touch_move(self, touch):
+        if touch.grab_current is not self:
+            return super(Waveform, self).on_touch_move(touch)
+        self._seek_to_touch(touch)
+        return True
+
+    def on_touch_up(self, touch):
+        if touch.grab_current is not self:
+            return super(Waveform, self).on_touch_up(touch)
+        touch.ungrab(self)
+        return True
+
+    def _seek_to_touch(self, touch):
+        if self.width > 0:
+            fraction = min(max((touch.x - self.x) / float(self.width), 0), 1)
+            self.dispatch('on_seek', fraction)
+
+    def _draw(self, *args):
+        """ Draw the envelopes with one column per pixel (at most) """
+        self.canvas.clear()
+        self._marker = None
+        data_length = len(self._envelope)
+        columns = min(int(self.width), data_length)
+        if columns > 0:
+            starts = np.arange(columns) * data_length // columns
+            x = self.x + (np.arange(columns) + 0.5) * (self.width / float(columns))
+            with self.canvas:
+                for color, amplitudes in (
+                        (self.peak_color, np.maximum.reduceat(self._envelope[:, 0], starts)),
+                        (self.rms_color, np.maximum.reduceat(self._envelope[:, 1], starts))):
+                    Color(*color)
+                    self._draw_envelope(x, amplitudes / 255.0)
+        with self.canvas:
+            Color(*self.marker_color)
+            self._marker = Rectangle(size=(dp(1), self.height))
+        self._update_marker()
+
+    def _draw_envelope(self, x, amplitudes):
+        """ Draw a filled envelope symmetrical about the middle of the strip,
+        as a triangle strip between its top and bottom edges """
+        half_height = self.height / 2.0
+        middle = self.y + half_height
+        vertices = np.zeros((len(x), 2, 4), dtype=np.float32)
+        vertices[:, :, 0] = x[:, np.newaxis]
+        vertices[:, 0, 1] = middle + amplitudes * half_height
+        vertices[:, 1, 1] = middle - amplitudes * half_height
+        Mesh(vertices=vertices.ravel().tolist(),
+             indices=range(2 * len(x)),
+             mode='triangle_strip')
+
+    def _update_marker(self, *args):
+        if self._marker is not None:
+            self._marker.pos = (self.x + self.position * self.width, self.y)